@@ -0,0 +1,472 @@
+# benchmark.py
+"""Load test for index.py against local stand-ins for OpenAI, Stripe and the market/sentiment APIs.
+
+    python benchmark.py --concurrency 1,8,32 --duration 10 --output bench.json
+    python benchmark.py --openai 2000:0.4:0.01 --server-cmd "gunicorn -w 4 -b 127.0.0.1:{port} index:app"
+    python benchmark.py --compare bench.json
+    python benchmark.py --routes generate-strategy --openai-model gpt-4o-mini=6000:0.8:0.05 --openai-model gpt-4.1-nano=800
+
+Latency profiles are median_ms[:sigma[:error_rate]] with log-normal jitter around the median.
+--openai-model gives one model its own profile, e.g. to exercise LLM routing, hedging and the template fallback.
+Results are JSON so runs can be diffed with --compare.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROUTES = ('generate-strategy', 'check-user-usage', 'get-user-history')
+PRODUCTS = [
+    "Organic cold brew coffee subscription",
+    "Handmade leather wallets for minimalists",
+    "AI bookkeeping software for freelancers",
+    "Eco-friendly yoga mats with alignment lines",
+    "Online Spanish lessons for busy professionals",
+    "Smart home energy monitor",
+    "Vegan protein bars for endurance athletes",
+    "Boutique pet grooming studio"
+]
+
+class LatencyProfile:
+    """Log-normal latency around a median, plus a fraction of requests answered with 503"""
+    def __init__(self, median_ms, sigma=0.3, error_rate=0.0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+
+    @classmethod
+    def parse(cls, spec):
+        parts = [float(part) for part in spec.split(':')]
+        return cls(*parts)
+
+    def sample(self):
+        return self.median_ms * math.exp(random.gauss(0, self.sigma)) / 1000
+
+    def to_dict(self):
+        return {"median_ms": self.median_ms, "sigma": self.sigma, "error_rate": self.error_rate}
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    """Market data, sentiment, OpenAI and Stripe stand-ins on one local port"""
+    protocol_version = 'HTTP/1.1'
+    profiles = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _simulate(self, service):
+        """Sleep for the service's sampled latency; False means answer with an error"""
+        profile = self.profiles[service]
+        time.sleep(profile.sample())
+        return random.random() >= profile.error_rate
+
+    def _send_json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_GET(self):
+        if self.path == '/social/trends':
+            service, body = 'market', {
+                "trending_platforms": ["TikTok", "Instagram Reels", "LinkedIn", "YouTube Shorts"],
+                "popular_content_types": ["Short Videos", "Carousels", "Live Streams"],
+                "engagement_tips": ["Hook in the first second", "Reply to comments within an hour"]
+            }
+        elif self.path.startswith('/seo/'):
+            keyword = self.path[len('/seo/'):]
+            service, body = 'market', {
+                "keyword_difficulty": random.choice(["Low", "Medium", "High"]),
+                "search_volume": random.randint(500, 50000),
+                "cpc": round(random.uniform(0.3, 4.0), 2),
+                "related_keywords": [f"{keyword} review", f"cheap {keyword}", f"{keyword} near me"]
+            }
+        else:
+            return self._send_json({"error": "not found"}, 404)
+
+        if not self._simulate(service):
+            return self._send_json({"error": "unavailable"}, 503)
+        self._send_json(body)
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path == '/sentiment':
+            if not self._simulate('sentiment'):
+                return self._send_json({"error": "unavailable"}, 503)
+            return self._send_json({
+                "sentiment": random.choice(["positive", "neutral", "negative"]),
+                "confidence": round(random.uniform(0.5, 0.99), 2),
+                "keywords": ["quality", "price", "service"]
+            })
+        if self.path.rstrip('/').endswith('/chat/completions'):
+            request_body = json.loads(body or b'{}')
+            service = f"openai:{request_body.get('model')}"
+            if not self._simulate(service if service in self.profiles else 'openai'):
+                return self._send_json({"error": {"message": "overloaded", "type": "server_error"}}, 503)
+            return self._chat_completion(request_body)
+        if self.path.startswith('/v1/'):
+            if not self._simulate('stripe'):
+                return self._send_json({"error": {"message": "unavailable", "type": "api_error"}}, 503)
+            return self._stripe()
+        self._send_json({"error": "not found"}, 404)
+
+    def _chat_completion(self, request_body):
+        content = json.dumps({
+            "social_media": {"platforms": ["Instagram", "TikTok"], "posting_frequency": "5x per week"},
+            "seo": {"focus_keywords": ["benchmark keyword"], "content_pillars": ["guides", "comparisons"]},
+            "content": {"themes": ["customer stories", "behind the scenes"], "formats": ["video", "blog"]}
+        })
+        created = int(time.time())
+        usage = {"prompt_tokens": 350, "completion_tokens": 180, "total_tokens": 530}
+        if not request_body.get('stream'):
+            return self._send_json({
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": created,
+                "model": request_body.get('model', 'fake'),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage
+            })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for i in range(0, len(content), 16):
+            chunk = {
+                "id": "chatcmpl-stream",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": request_body.get('model', 'fake'),
+                "choices": [{"index": 0, "delta": {"content": content[i:i + 16]}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        if (request_body.get('stream_options') or {}).get('include_usage'):
+            chunk = {"id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": created, "model": request_body.get('model', 'fake'), "choices": [], "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _stripe(self):
+        suffix = uuid.uuid4().hex[:14]
+        if self.path == '/v1/customers':
+            return self._send_json({"id": f"cus_{suffix}", "object": "customer"})
+        if self.path == '/v1/subscriptions':
+            return self._send_json({
+                "id": f"sub_{suffix}",
+                "object": "subscription",
+                "status": "incomplete",
+                "latest_invoice": {
+                    "id": f"in_{suffix}",
+                    "object": "invoice",
+                    "payment_intent": {
+                        "id": f"pi_{suffix}",
+                        "object": "payment_intent",
+                        "status": "requires_confirmation",
+                        "client_secret": f"pi_{suffix}_secret"
+                    }
+                }
+            })
+        match = re.match(r'^/v1/payment_intents/([^/]+)/confirm$', self.path)
+        if match:
+            return self._send_json({
+                "id": match.group(1),
+                "object": "payment_intent",
+                "status": "succeeded",
+                "client_secret": f"{match.group(1)}_secret"
+            })
+        self._send_json({"error": {"message": "unknown endpoint", "type": "invalid_request_error"}}, 404)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def process_tree(pid):
+    """pid plus all descendants (Linux /proc)"""
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+def tree_rss_bytes(pid):
+    total = 0
+    for child in process_tree(pid):
+        try:
+            with open(f'/proc/{child}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+class RSSSampler(threading.Thread):
+    """Tracks peak resident memory of the app's process tree"""
+    def __init__(self, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, tree_rss_bytes(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.peak or None
+
+def start_app(args, upstream_url, db_path):
+    port = free_port()
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=f'{upstream_url}/v1/',
+        STRIPE_API_BASE=upstream_url,
+        MARKET_DATA_API_URL=upstream_url,
+        SENTIMENT_API_URL=upstream_url,
+        RATELIMIT_ENABLED='0',
+        USER_DB_PATH=db_path
+    )
+    if args.server_cmd:
+        command = args.server_cmd.format(port=port).split()
+    else:
+        command = [sys.executable, '-c', f"import index; index.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    process = subprocess.Popen(
+        command,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'App exited during startup with code {process.returncode}')
+        try:
+            requests.get(f'{base_url}/check-user-usage?user_id=bench_probe', timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('App did not start in time')
+
+def build_request(route, base_url, users):
+    if route == 'generate-strategy':
+        # Fresh user ids so the free-tier check never blocks the run
+        return 'POST', f'{base_url}/generate-strategy', {
+            "product": random.choice(PRODUCTS),
+            "audience": random.choice(["Small business owners", "Gen Z students", "Remote workers"]),
+            "budget": random.choice([500, 1000, 2500, 5000, 10000]),
+            "user_id": f"bench_{uuid.uuid4().hex[:12]}"
+        }
+    if route == 'check-user-usage':
+        return 'GET', f'{base_url}/check-user-usage?user_id={random.choice(users)}', None
+    return 'GET', f'{base_url}/get-user-history?user_id={random.choice(users)}', None
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(math.ceil(fraction * len(sorted_values))) - 1)
+    return round(sorted_values[max(0, index)] * 1000, 2)
+
+def run_level(route, concurrency, duration, base_url, users):
+    """Drive one route at a fixed number of closed-loop clients for duration seconds"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    start = time.monotonic()
+    deadline = start + duration
+
+    def client():
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            method, url, body = build_request(route, base_url, users)
+            began = time.perf_counter()
+            try:
+                response = session.request(method, url, json=body, timeout=60)
+                failed = response.status_code >= 400
+            except requests.RequestException:
+                failed = True
+            elapsed = time.perf_counter() - began
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - start
+
+    latencies.sort()
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "error_rate": round(errors[0] / len(latencies), 4) if latencies else None,
+        "rps": round(len(latencies) / wall, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99)
+    }
+
+def seed_users(base_url, count):
+    """Create users with one strategy each so usage and history routes read real rows; raises if any seed fails"""
+    users = []
+    session = requests.Session()
+    for i in range(count):
+        user_id = f'bench_seed_{i}'
+        try:
+            response = session.post(f'{base_url}/generate-strategy', json={
+                "product": PRODUCTS[i % len(PRODUCTS)],
+                "audience": "Benchmark audience",
+                "budget": 1000,
+                "user_id": user_id
+            }, timeout=60)
+        except requests.RequestException as e:
+            raise RuntimeError(f'Seeding {user_id} failed: {e}') from e
+        try:
+            strategy = response.json()
+        except ValueError:
+            strategy = {}
+        if response.status_code != 200 or 'error' in strategy or 'timestamp' not in strategy:
+            raise RuntimeError(f'Seeding {user_id} failed with {response.status_code}: {response.text[:500]}')
+        users.append(user_id)
+    return users
+
+def failing_levels(results, max_error_rate):
+    """Levels whose error rate is over the threshold; their latencies measure failures, not the app"""
+    return [r for r in results if r['error_rate'] is not None and r['error_rate'] > max_error_rate]
+
+def compare(baseline_path, current, max_regression):
+    """Print per-level deltas against a previous run; True if any level regressed past the threshold"""
+    with open(baseline_path) as f:
+        baseline = {(r['route'], r['concurrency']): r for r in json.load(f)['results']}
+    regressed = False
+    print(f"{'route':<20}{'conc':>6}{'rps':>12}{'Δrps':>9}{'p95 ms':>12}{'Δp95':>9}")
+    for result in current['results']:
+        before = baseline.get((result['route'], result['concurrency']))
+        if before is None or not before['rps'] or not before['p95_ms'] or result['p95_ms'] is None:
+            continue
+        rps_change = result['rps'] / before['rps'] - 1
+        p95_change = result['p95_ms'] / before['p95_ms'] - 1
+        regressed |= rps_change < -max_regression or p95_change > max_regression
+        print(f"{result['route']:<20}{result['concurrency']:>6}{result['rps']:>12}{rps_change:>+9.1%}"
+              f"{result['p95_ms']:>12}{p95_change:>+9.1%}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', default=','.join(ROUTES), help='Comma-separated routes to drive')
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated client counts')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per route and concurrency level')
+    parser.add_argument('--seed-users', type=int, default=20)
+    parser.add_argument('--market', default='80:0.3:0.01', help='Market data API latency profile')
+    parser.add_argument('--sentiment', default='120:0.3:0.01', help='Sentiment API latency profile')
+    parser.add_argument('--openai', default='1500:0.4:0.005', help='OpenAI latency profile')
+    parser.add_argument('--openai-model', action='append', default=[], metavar='MODEL=PROFILE', help='Latency profile for one OpenAI model')
+    parser.add_argument('--stripe', default='300:0.3:0.0', help='Stripe latency profile')
+    parser.add_argument('--server-cmd', help='Command to boot the app; {port} is substituted')
+    parser.add_argument('--startup-timeout', type=float, default=30)
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    parser.add_argument('--compare', help='Previous results JSON to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.10, help='Allowed rps drop / p95 rise before --compare fails')
+    parser.add_argument('--max-error-rate', type=float, default=0.05, help='Error rate per level above which the run fails')
+    parser.add_argument('--random-seed', type=int, default=1)
+    args = parser.parse_args()
+    if args.seed_users < 1 and {'check-user-usage', 'get-user-history'} & set(args.routes.split(',')):
+        parser.error('--seed-users must be at least 1 to drive the usage and history routes')
+
+    random.seed(args.random_seed)
+    FakeUpstream.profiles = {
+        'market': LatencyProfile.parse(args.market),
+        'sentiment': LatencyProfile.parse(args.sentiment),
+        'openai': LatencyProfile.parse(args.openai),
+        'stripe': LatencyProfile.parse(args.stripe)
+    }
+    for spec in args.openai_model:
+        model, _, profile = spec.partition('=')
+        FakeUpstream.profiles[f'openai:{model}'] = LatencyProfile.parse(profile)
+    upstream = ThreadingHTTPServer(('127.0.0.1', 0), FakeUpstream)
+    upstream.daemon_threads = True
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    upstream_url = f'http://127.0.0.1:{upstream.server_address[1]}'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        process, base_url = start_app(args, upstream_url, os.path.join(tmp, 'bench.db'))
+        sampler = RSSSampler(process.pid)
+        sampler.start()
+        try:
+            users = seed_users(base_url, args.seed_users)
+            results = [
+                run_level(route, int(concurrency), args.duration, base_url, users)
+                for route in args.routes.split(',')
+                for concurrency in args.concurrency.split(',')
+            ]
+        finally:
+            peak_rss = sampler.stop()
+            process.terminate()
+            process.wait(timeout=10)
+            upstream.shutdown()
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "server_cmd": args.server_cmd or 'flask dev server (threaded)',
+        "duration": args.duration,
+        "upstreams": {name: profile.to_dict() for name, profile in FakeUpstream.profiles.items()},
+        "peak_rss_bytes": peak_rss,
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    failed = failing_levels(results, args.max_error_rate)
+    for result in failed:
+        print(f"ERROR RATE {result['error_rate']:.1%} on {result['route']} at concurrency {result['concurrency']} "
+              f"({result['errors']}/{result['requests']} requests failed, limit {args.max_error_rate:.1%})", file=sys.stderr)
+
+    if args.compare and compare(args.compare, report, args.max_regression):
+        sys.exit(1)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,40 @@
 # advanced_marketing_strategist.py
-from flask import Flask, request, jsonify, render_template_string
-import openai
+import time
+_import_started = time.perf_counter()  # Module import time is reported as dacv_startup_seconds{phase="module_import"}
+from flask import Flask, Response, abort, g, has_request_context, request, jsonify, stream_with_context
 import os
-from datetime import datetime
-import stripe
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-import requests
+from datetime import datetime, timedelta
+import click
+import functools
+import gc
+import importlib
 import json
+import asyncio
+import gzip
 import hashlib
+import ipaddress
+import random
+import math
+import re
+import bisect
+import itertools
+import mmap
+import queue
+import socket
+import uuid
+import sqlite3
+import struct
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from statistics import NormalDist
+
+try:
+    import orjson  # Optional: faster JSON encoding of API responses
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # Change for production
@@ -20,148 +46,2644 @@ app.config.update(
     STRIPE_SECRET_KEY='your-stripe-secret-key',
     MARKET_DATA_API_KEY='your-market-data-api-key',
     SENTIMENT_API_KEY='your-sentiment-api-key',
+    OPENAI_BASE_URL=os.environ.get('OPENAI_BASE_URL'),  # API base overrides, e.g. local stand-ins in benchmark.py
+    STRIPE_API_BASE=os.environ.get('STRIPE_API_BASE'),
+    MARKET_DATA_API_URL=os.environ.get('MARKET_DATA_API_URL', 'https://api.example.com'),
+    SENTIMENT_API_URL=os.environ.get('SENTIMENT_API_URL', 'https://api.example.com'),
+    RATELIMIT_ENABLED=os.environ.get('RATELIMIT_ENABLED', '1') != '0',
     MAX_FREE_USES=1,
-    STRIPE_WEBHOOK_SECRET='your-stripe-webhook-secret'  # For production
+    PLANS={  # Per-user request rate and plan quota; None means unlimited
+        'free': {'requests_per_minute': 5, 'monthly_quota': None},  # Limited to MAX_FREE_USES in total
+        'starter': {'requests_per_minute': 10, 'monthly_quota': 10},
+        'professional': {'requests_per_minute': 30, 'monthly_quota': None},
+        'enterprise': {'requests_per_minute': 60, 'monthly_quota': None}
+    },
+    PRICE_PLANS={'price_1': 'starter', 'price_2': 'professional', 'price_3': 'enterprise'},
+    IP_RATE_LIMIT='60 per minute',  # Coarse per-IP abuse guard; generous so users behind one NAT are not throttled together
+    OPENAI_MODEL='gpt-4o-mini',
+    AI_PRODUCT_TOKEN_BUDGET=200,  # Longer product descriptions are summarized down to this many tokens
+    AI_AUDIENCE_TOKEN_BUDGET=60,
+    AI_PROMPT_LIST_ITEMS=5,  # Trend and sentiment keywords kept in the prompt
+    LLM_ROUTES={  # Model, completion cap and hedge model per plan; 'large' overrides apply to prompts over LLM_LARGE_PROMPT_TOKENS
+        'free': {'model': 'gpt-4o-mini', 'max_tokens': 300, 'hedge_model': 'gpt-4.1-nano'},
+        'starter': {'model': 'gpt-4o-mini', 'max_tokens': 400, 'hedge_model': 'gpt-4.1-nano', 'large': {'max_tokens': 500}},
+        'professional': {'model': 'gpt-4.1-mini', 'max_tokens': 600, 'hedge_model': 'gpt-4o-mini', 'large': {'model': 'gpt-4.1', 'max_tokens': 800}},
+        'enterprise': {'model': 'gpt-4.1', 'max_tokens': 800, 'hedge_model': 'gpt-4.1-mini', 'large': {'max_tokens': 1000}}
+    },
+    LLM_LARGE_PROMPT_TOKENS=400,
+    LLM_HEDGE_PERCENTILE=0.95,  # Hedge a call once it outlasts this percentile of its model's recent latencies
+    LLM_HEDGE_MIN_SAMPLES=20,  # Latencies needed before the percentile is trusted; LLM_HEDGE_DELAY applies until then
+    LLM_HEDGE_DELAY=8.0,
+    LLM_LATENCY_WINDOW=200,  # Recent latencies kept per model
+    LLM_TIMEOUT=30,  # Seconds before a call and its hedge are abandoned for the template strategy
+    LLM_POOL_SIZE=32,  # Threads running sync LLM calls and their hedges
+    # SQLite file for users, quotas, history, jobs and webhook events, created on first use; empty keeps them in STORAGE_URL
+    USER_DB_PATH=os.environ.get('USER_DB_PATH', os.path.join(app.instance_path, 'dacv.db')),
+    HISTORY_MAX_PER_USER=100,  # Oldest strategies beyond this are dropped
+    HISTORY_RETENTION_DAYS=90,
+    HISTORY_PAGE_SIZE=20,
+    HISTORY_MAX_PAGE_SIZE=100,
+    AI_CACHE_TTL=86400,  # Seconds a generated AI strategy is reused
+    AI_CACHE_MAX_ENTRIES=5000,
+    AI_CACHE_MAX_BYTES=32 * 1024 * 1024,
+    AI_CACHE_NEAR_DUPLICATES=False,  # Also reuse strategies for near-identical product descriptions
+    AI_CACHE_SIMILARITY=0.85,  # Estimated Jaccard similarity needed for a near-duplicate hit
+    STORAGE_URL='memory://',  # Or sqlite:////var/lib/dacv/state.db, redis://localhost:6379/0 to share across workers
+    CACHE_TTLS={'social_trends': 900, 'seo': 3600, 'sentiment': 3600},  # Seconds per namespace
+    CACHE_MAX_ENTRIES=10000,
+    CACHE_MAX_BYTES=64 * 1024 * 1024,
+    CACHE_STALE_TTL=300,  # Seconds an expired value may be served while it is refreshed
+    CACHE_WARM_ENABLED=True,
+    CACHE_WARM_INTERVAL=30,  # Seconds between warmer passes
+    CACHE_WARM_LEAD=90,  # Refresh hot keys expiring within this many seconds
+    CACHE_WARM_TRENDS_INTERVAL=600,  # Seconds between scheduled social trends refreshes
+    CACHE_WARM_MAX_KEYS=100,  # Hot SEO/sentiment keys kept warm
+    CACHE_WARM_MAX_REFRESHES=20,  # Upstream refreshes per warmer pass
+    CACHE_WARM_TRACKED_KEYS=5000,  # Keys whose popularity is tracked
+    MARKET_INDEX_PATH=os.environ.get('MARKET_INDEX_PATH', 'market.idx'),  # Built offline with `flask --app index build-market-index`
+    MARKET_INDEX_CHECK_INTERVAL=30,  # Seconds between checks for a rebuilt index file
+    COMPETITOR_LIMIT=5,
+    PROVIDER_POOL_SIZE=16,
+    PROVIDER_DEADLINES={'social_trends': 2.0, 'seo': 2.0, 'sentiment': 2.0},  # Seconds per provider call
+    PROVIDER_TOTAL_DEADLINE=2.5,  # Seconds for the whole fan-out
+    PROVIDER_HTTP_POOL_SIZE=32,  # Keep-alive connections per provider host
+    PROVIDER_CONNECT_TIMEOUT=1.0,
+    PROVIDER_READ_TIMEOUT=2.0,
+    PROVIDER_MAX_RETRIES=2,
+    PROVIDER_RETRY_BACKOFF=0.1,  # Base delay, doubled per attempt with full jitter
+    ALLOCATION_CANDIDATES=4096,  # Candidate budget splits scored per request
+    ALLOCATION_DRAWS=1000,  # Monte Carlo draws behind each confidence interval
+    ALLOCATION_INTERVAL=0.9,  # Confidence level of reported conversion intervals
+    BATCH_MAX_ITEMS=50,
+    BATCH_LLM_CONCURRENCY=4,  # Concurrent OpenAI calls per batch
+    JOB_WORKERS=4,  # Background strategy generation threads per process
+    JOB_STALE_AFTER=600,  # Seconds before a job left running by a dead worker is requeued
+    JOB_CALLBACK_TIMEOUT=5,
+    JOB_CALLBACK_RETRIES=3,
+    JOB_CALLBACK_ALLOWED_HOSTS=None,  # Hostnames that may receive callbacks; None allows any host resolving to public addresses
+    STRIPE_CONNECT_TIMEOUT=2.0,
+    STRIPE_TIMEOUTS={'customer': 5.0, 'subscription': 10.0, 'retrieve': 3.0},  # Read timeout in seconds per Stripe call
+    STRIPE_MAX_NETWORK_RETRIES=2,  # Safe because every write carries an idempotency key
+    CHECKOUT_TTL=86400,  # Seconds checkout progress is kept; Stripe keeps idempotency keys for 24 hours
+    WEBHOOK_BATCH_SIZE=100,  # Stripe events applied per user store transaction
+    WEBHOOK_POLL_INTERVAL=5,  # Seconds between checks for events queued by other workers
+    WEBHOOK_STALE_AFTER=300,  # Seconds before events claimed by a dead worker are retried
+    WEBHOOK_RETENTION_DAYS=30,  # Processed event ids kept for de-duplication
+    ASYNC_MAX_CONNECTIONS=256,  # Async mode: concurrent provider connections per process
+    CIRCUIT_FAILURE_THRESHOLD=5,
+    CIRCUIT_RESET_TIMEOUT=30,
+    STRIPE_WEBHOOK_SECRET='your-stripe-webhook-secret',  # For production
+    RESPONSE_COMPRESS_MIN_BYTES=1024,  # API responses smaller than this are sent uncompressed
+    ASSET_MAX_AGE=31536000,  # Seconds browsers may cache content-hashed CSS/JS
+    METRICS_SERVER_TIMING=False  # Add a Server-Timing header with per-stage durations to responses
+)
+
+# Initialize services
+startup_timings = {}  # Phase -> seconds spent importing and starting up, exported by /metrics
+
+def _setup_openai(module):
+    module.api_key = app.config['OPENAI_API_KEY']
+    if app.config['OPENAI_BASE_URL']:
+        module.base_url = app.config['OPENAI_BASE_URL']
+
+def _setup_stripe(module):
+    module.api_key = app.config['STRIPE_SECRET_KEY']
+    if app.config['STRIPE_API_BASE']:
+        module.api_base = app.config['STRIPE_API_BASE']
+
+def _setup_requests(module):
+    importlib.import_module('requests.adapters')
+
+def _setup_limits(module):
+    importlib.import_module('limits.storage')
+    importlib.import_module('limits.strategies')
+
+def _setup_numpy(module):
+    importlib.import_module('numpy.random')
+
+SDK_SETUP = {
+    'openai': _setup_openai, 'stripe': _setup_stripe, 'requests': _setup_requests, 'limits': _setup_limits,
+    'numpy': _setup_numpy  # Only the allocation engine and the market index need it
+}
+_sdks = {}
+_sdk_lock = threading.Lock()
+
+def sdk(name):
+    """Import and configure a heavy SDK on first use, so routes that never touch it do not pay for it"""
+    module = _sdks.get(name)
+    if module is None:
+        with _sdk_lock:
+            module = _sdks.get(name)
+            if module is None:
+                started = time.perf_counter()
+                module = importlib.import_module(name)
+                SDK_SETUP[name](module)
+                startup_timings[f'import_{name}'] = time.perf_counter() - started
+                _sdks[name] = module
+    return module
+
+RATELIMIT_STORAGE_URI = app.config['STORAGE_URL'] if app.config['STORAGE_URL'].startswith(('redis://', 'rediss://')) else 'memory://'
+
+class IPRateLimiter:
+    """Per-client-IP moving-window limits; the limits package and its storage load on the first limited request"""
+    def __init__(self, storage_uri):
+        self.storage_uri = storage_uri
+        self._strategy = None
+        self._parsed = {}
+        self._lock = threading.Lock()
+
+    def hit(self, limit_value, scope, key):
+        """Count one request against limit_value (e.g. '60 per minute'); False once it is exceeded"""
+        limits = sdk('limits')
+        if self._strategy is None:
+            with self._lock:
+                if self._strategy is None:
+                    self._strategy = limits.strategies.MovingWindowRateLimiter(limits.storage.storage_from_string(self.storage_uri))
+        item = self._parsed.get(limit_value)
+        if item is None:
+            item = self._parsed[limit_value] = limits.parse(limit_value)
+        return self._strategy.hit(item, scope, key)
+
+    def limit(self, limit_value):
+        """Route decorator; limit_value is a limit string or a callable returning one"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapped(*args, **kwargs):
+                if app.config['RATELIMIT_ENABLED']:
+                    value = limit_value() if callable(limit_value) else limit_value
+                    if not self.hit(value, request.endpoint, request.remote_addr or '127.0.0.1'):
+                        abort(429, value)
+                return view(*args, **kwargs)
+            return wrapped
+        return decorator
+
+limiter = IPRateLimiter(RATELIMIT_STORAGE_URI)
+
+# Metrics
+class Metrics:
+    """In-process Prometheus-style histograms, counters and gauges, rendered by /metrics"""
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    TOKEN_BUCKETS = (32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+    def __init__(self):
+        self._histograms = {}  # (name, labels) -> [bucket counts, sum, count, bucket bounds]
+        self._counters = defaultdict(float)
+        self._gauges = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, value, buckets=BUCKETS, **labels):
+        key = self._key(name, labels)
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0, buckets]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self._counters[self._key(name, labels)] += amount
+
+    def gauge_add(self, name, amount, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] += amount
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a pipeline stage into dacv_stage_duration_seconds (and Server-Timing when enabled)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe('dacv_stage_duration_seconds', elapsed, stage=stage)
+            if app.config['METRICS_SERVER_TIMING'] and has_request_context():
+                g.setdefault('server_timing', []).append((stage, elapsed))
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self, extra=()):
+        """Prometheus text exposition format; extra holds (kind, name, value, labels) read at scrape time"""
+        with self._lock:
+            histograms = {key: (list(h[0]), h[1], h[2], h[3]) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        for kind, name, value, labels in extra:
+            (counters if kind == 'counter' else gauges)[self._key(name, labels)] = value
+        
+        lines = []
+        for kind, series in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({name for name, _ in series}):
+                lines.append(f'# TYPE {name} {kind}')
+                for (series_name, labels), value in sorted(series.items()):
+                    if series_name == name:
+                        lines.append(f'{name}{self._labels(labels)} {value:g}')
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f'# TYPE {name} histogram')
+            for (series_name, labels), (buckets, total, count, bounds) in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(bounds + ('+Inf',), buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{self._labels(labels)} {total:g}')
+                lines.append(f'{name}_count{self._labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.gauge_add('dacv_requests_in_flight', 1)
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'request_started' in g:
+        metrics.gauge_add('dacv_requests_in_flight', -1)
+        metrics.observe(
+            'dacv_request_duration_seconds',
+            time.perf_counter() - g.request_started,
+            endpoint=request.endpoint or 'unknown'
+        )
+
+@app.after_request
+def add_server_timing(response):
+    timings = g.get('server_timing')
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(f'{stage};dur={elapsed * 1000:.1f}' for stage, elapsed in timings)
+    return response
+
+@app.errorhandler(429)
+def rate_limit_exceeded(e):
+    metrics.inc('dacv_rate_limit_rejections_total', endpoint=request.endpoint or 'unknown')
+    return jsonify({"error": "Rate limit exceeded", "message": str(e.description)}), 429
+
+# Storage backends
+def connect_sqlite(path):
+    """Open a SQLite connection in WAL mode, tuned for many concurrent readers"""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+class SQLiteStore:
+    """Base for SQLite-backed stores: a connection per thread and process, and the schema created on first use"""
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _create_schema(self, conn):
+        raise NotImplementedError
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():  # Never reuse a connection inherited across fork
+            conn = self._local.conn = connect_sqlite(self.path)
+            self._local.pid = os.getpid()
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    with conn:
+                        self._create_schema(conn)
+                    self._schema_ready = True
+        return conn
+
+def refill_bucket(state, capacity, rate, now):
+    """Token count of a bucket stored as (tokens, updated_at), topped up for the time elapsed"""
+    if state is None:
+        return capacity
+    tokens, updated_at = state
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+def check_buckets(buckets, levels):
+    """Return the index of the first bucket short of its cost and the seconds until it refills, or (None, 0)"""
+    for index, ((key, capacity, rate, cost), tokens) in enumerate(zip(buckets, levels)):
+        if tokens < cost:
+            return index, (cost - tokens) / rate if rate > 0 and cost <= capacity else None
+    return None, 0
+
+class MemoryBackend:
+    """In-process key/value store; state is private to each worker"""
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at)
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._data[key]
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def add(self, key, value, ttl=None):
+        """Set key only if it is absent or expired; True when this call set it"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.time()):
+                return False
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            return True
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            value = int(self._data.get(key, (0, None))[0]) + amount
+            self._data[key] = (value, None)
+            return value
+
+    def take_tokens(self, buckets):
+        """Atomically take each (key, capacity, refill_per_second, cost) bucket's cost, or none of them"""
+        now = time.time()
+        with self._lock:
+            levels = [refill_bucket(self._buckets.get(key), capacity, rate, now) for key, capacity, rate, cost in buckets]
+            failed, retry_after = check_buckets(buckets, levels)
+            if failed is None:
+                for (key, capacity, rate, cost), tokens in zip(buckets, levels):
+                    self._buckets[key] = (tokens - cost, now)
+            return failed, retry_after
+
+class SQLiteBackend(SQLiteStore):
+    """File-backed key/value store shared by every worker on the node"""
+    PRUNE_EVERY = 1000  # Writes between sweeps of expired rows
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._writes = 0
+
+    def _create_schema(self, conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS kv ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS buckets ('
+            'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL) WITHOUT ROWID'
+        )
+
+    def get(self, key):
+        row = self._conn().execute(
+            'SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        conn = self._conn()
+        conn.execute(
+            'INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value, default=str), time.time() + ttl if ttl else None)
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            conn.execute('DELETE FROM kv WHERE expires_at <= ?', (time.time(),))
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        cursor = self._conn().execute(
+            'INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at '
+            'WHERE kv.expires_at IS NOT NULL AND kv.expires_at <= ?',
+            (key, json.dumps(value, default=str), now + ttl if ttl else None, now)
+        )
+        return cursor.rowcount == 1
+
+    def incr(self, key, amount=1):
+        row = self._conn().execute(
+            'INSERT INTO kv (key, value, expires_at) VALUES (?, ?, NULL) '
+            'ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value '
+            'RETURNING value',
+            (key, amount)
+        ).fetchone()
+        return int(row[0])
+
+    def take_tokens(self, buckets):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')  # Serializes bucket updates across workers
+        try:
+            now = time.time()
+            rows = conn.execute(
+                f'SELECT key, tokens, updated_at FROM buckets WHERE key IN ({", ".join("?" * len(buckets))})',
+                [bucket[0] for bucket in buckets]
+            ).fetchall()
+            states = {row[0]: (row[1], row[2]) for row in rows}
+            levels = [refill_bucket(states.get(key), capacity, rate, now) for key, capacity, rate, cost in buckets]
+            failed, retry_after = check_buckets(buckets, levels)
+            if failed is None:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                    [(key, tokens - cost, now) for (key, capacity, rate, cost), tokens in zip(buckets, levels)]
+                )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return failed, retry_after
+
+class RedisBackend:
+    """Redis-protocol key/value store (Redis, Valkey, KeyDB or any local stand-in)"""
+    # KEYS: bucket keys; ARGV: now, then capacity, refill per second and cost per bucket.
+    # Returns {0} when every bucket paid its cost, else {1-based index of the short bucket, seconds to wait or -1}.
+    TAKE_TOKENS = """
+    local now = tonumber(ARGV[1])
+    local levels = {}
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[i * 3 - 1])
+        local rate = tonumber(ARGV[i * 3])
+        local cost = tonumber(ARGV[i * 3 + 1])
+        local state = redis.call('HMGET', key, 'tokens', 'updated_at')
+        local tokens = capacity
+        if state[1] then
+            tokens = math.min(capacity, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) * rate)
+        end
+        if tokens < cost then
+            if rate > 0 and cost <= capacity then
+                return {i, tostring((cost - tokens) / rate)}
+            end
+            return {i, '-1'}
+        end
+        levels[i] = tokens
+    end
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[i * 3 - 1])
+        local rate = tonumber(ARGV[i * 3])
+        redis.call('HSET', key, 'tokens', tostring(levels[i] - tonumber(ARGV[i * 3 + 1])), 'updated_at', ARGV[1])
+        if rate > 0 then
+            redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+        end
+    end
+    return {0}
+    """
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self._take_tokens = self.client.register_script(self.TAKE_TOKENS)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value, default=str), px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, json.dumps(value, default=str), px=int(ttl * 1000) if ttl else None, nx=True))
+
+    def incr(self, key, amount=1):
+        return self.client.incrby(key, amount)
+
+    def take_tokens(self, buckets):
+        args = [repr(time.time())]
+        for key, capacity, rate, cost in buckets:
+            args += [capacity, repr(float(rate)), cost]
+        result = self._take_tokens(keys=[bucket[0] for bucket in buckets], args=args)
+        if result[0] == 0:
+            return None, 0
+        retry_after = float(result[1])
+        return result[0] - 1, retry_after if retry_after >= 0 else None
+
+def create_backend(url):
+    """Build a storage backend from a memory://, sqlite:/// or redis:// URL"""
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    raise ValueError(f'Unsupported storage URL: {url}')
+
+storage = create_backend(app.config['STORAGE_URL'])
+
+# Real-time data cache
+CACHE_EXPIRY = 3600  # 1 hour
+
+class TTLCache:
+    """Thread-safe LRU cache with per-namespace TTLs and entry/byte bounds"""
+    def __init__(self, ttls=None, default_ttl=CACHE_EXPIRY, max_entries=10000, max_bytes=64 * 1024 * 1024, stale_ttl=0):
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (namespace, value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0})
+
+    @staticmethod
+    def _sizeof(value):
+        try:
+            return len(json.dumps(value, default=str))
+        except (TypeError, ValueError):
+            return 1024
+
+    def get(self, namespace, key, default=None):
+        value, fresh = self.lookup(namespace, key)
+        return value if fresh else default
+
+    def lookup(self, namespace, key):
+        """Return (value, fresh); expired values stay readable for stale_ttl seconds"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats[namespace]['misses'] += 1
+                return None, False
+            if entry[2] + self.stale_ttl <= now:
+                self._remove(key)
+                self._stats[namespace]['expirations'] += 1
+                self._stats[namespace]['misses'] += 1
+                return None, False
+            self._entries.move_to_end(key)
+            if entry[2] <= now:
+                self._stats[namespace]['stale_hits'] += 1
+                return entry[1], False
+            self._stats[namespace]['hits'] += 1
+            return entry[1], True
+
+    def peek(self, key):
+        """Cached value, fresh or stale, without counting a lookup or refreshing its recency"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry and entry[2] + self.stale_ttl > time.monotonic() else None
+
+    def set(self, namespace, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttls.get(namespace, self.default_ttl)
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (namespace, value, time.monotonic() + ttl, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                evicted_key = next(iter(self._entries))
+                self._stats[self._entries[evicted_key][0]]['evictions'] += 1
+                self._remove(evicted_key)
+
+    def expires_in(self, key):
+        """Seconds until key stops being fresh, or None if it is not cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[2] - time.monotonic() if entry else None
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[3]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            namespaces = {ns: dict(counters) for ns, counters in self._stats.items()}
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": sum(c['hits'] for c in namespaces.values()),
+                "misses": sum(c['misses'] for c in namespaces.values()),
+                "evictions": sum(c['evictions'] for c in namespaces.values()),
+                "namespaces": namespaces
+            }
+
+class SharedCache:
+    """TTLCache-compatible cache stored in a shared backend so all workers share hits"""
+    def __init__(self, backend, ttls=None, default_ttl=CACHE_EXPIRY, stale_ttl=0, prefix='cache:'):
+        self.backend = backend
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0})
+
+    def _count(self, namespace, counter):
+        with self._lock:
+            self._stats[namespace][counter] += 1
+
+    def get(self, namespace, key, default=None):
+        value, fresh = self.lookup(namespace, key)
+        return value if fresh else default
+
+    def lookup(self, namespace, key):
+        """Return (value, fresh); the backend keeps values stale_ttl seconds past expiry"""
+        try:
+            entry = self.backend.get(self.prefix + key)
+        except Exception:
+            entry = None
+        if entry is None:
+            self._count(namespace, 'misses')
+            return None, False
+        if entry['expires_at'] <= time.time():
+            self._count(namespace, 'stale_hits')
+            return entry['value'], False
+        self._count(namespace, 'hits')
+        return entry['value'], True
+
+    def peek(self, key):
+        try:
+            entry = self.backend.get(self.prefix + key)
+        except Exception:
+            return None
+        return entry['value'] if entry else None
+
+    def set(self, namespace, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttls.get(namespace, self.default_ttl)
+        entry = {'value': value, 'expires_at': time.time() + ttl}
+        try:
+            self.backend.set(self.prefix + key, entry, ttl=ttl + self.stale_ttl)
+        except Exception:
+            pass  # A cache write failure must not fail the request
+
+    def expires_in(self, key):
+        """Seconds until key stops being fresh, or None if it is not cached"""
+        try:
+            entry = self.backend.get(self.prefix + key)
+        except Exception:
+            return None
+        return entry['expires_at'] - time.time() if entry else None
+
+    def delete(self, key):
+        self.backend.delete(self.prefix + key)
+
+    def stats(self):
+        with self._lock:
+            namespaces = {ns: dict(counters) for ns, counters in self._stats.items()}
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": sum(c['hits'] for c in namespaces.values()),
+            "misses": sum(c['misses'] for c in namespaces.values()),
+            "evictions": 0,
+            "namespaces": namespaces
+        }
+
+def create_cache(ttls, max_entries, max_bytes, stale_ttl=0, prefix='cache:'):
+    """In-process LRU cache by default, or a SharedCache when a shared backend is configured"""
+    if isinstance(storage, MemoryBackend):
+        return TTLCache(ttls=ttls, max_entries=max_entries, max_bytes=max_bytes, stale_ttl=stale_ttl)
+    return SharedCache(storage, ttls=ttls, stale_ttl=stale_ttl, prefix=prefix)
+
+real_time_cache = create_cache(
+    app.config['CACHE_TTLS'],
+    app.config['CACHE_MAX_ENTRIES'],
+    app.config['CACHE_MAX_BYTES'],
+    stale_ttl=app.config['CACHE_STALE_TTL']
+)
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one in-flight call"""
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _claim(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return call, False
+            call = self._calls[key] = Future()
+            return call, True
+
+    def _run(self, key, call, fn):
+        try:
+            call.set_result(fn())
+        except BaseException as e:
+            call.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def do(self, key, fn):
+        """Run fn for key, or wait for the call already in flight and share its result"""
+        call, leader = self._claim(key)
+        if leader:
+            self._run(key, call, fn)
+        return call.result()
+
+    def do_async(self, key, fn, executor):
+        """Start fn for key on executor unless a call is already in flight"""
+        call, leader = self._claim(key)
+        if leader:
+            executor.submit(self._run, key, call, fn)
+        return call
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+provider_flight = SingleFlight()
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets one probe through after the reset timeout"""
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """Count a half-open probe that ended without an outcome (e.g. cancelled) as failed"""
+        if self._probing:
+            self.record_failure()
+
+class ProviderClient:
+    """Shared keep-alive HTTP session for market-data and sentiment providers"""
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, config):
+        self.config = config
+        self._session = None
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Keep-alive session, created on the first provider call"""
+        if self._session is None:
+            requests = sdk('requests')
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=self.config['PROVIDER_HTTP_POOL_SIZE'],
+                        pool_maxsize=self.config['PROVIDER_HTTP_POOL_SIZE'],
+                        max_retries=0
+                    )
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def breaker(self, provider):
+        with self._lock:
+            if provider not in self.breakers:
+                self.breakers[provider] = CircuitBreaker(
+                    self.config['CIRCUIT_FAILURE_THRESHOLD'],
+                    self.config['CIRCUIT_RESET_TIMEOUT']
+                )
+            return self.breakers[provider]
+
+    def request(self, provider, method, url, **kwargs):
+        """Send a request with timeouts, jittered retries and a per-provider circuit breaker"""
+        requests = sdk('requests')
+        breaker = self.breaker(provider)
+        if not breaker.allow():
+            raise CircuitOpenError(f'{provider} circuit is open')
+        
+        kwargs.setdefault('timeout', (self.config['PROVIDER_CONNECT_TIMEOUT'], self.config['PROVIDER_READ_TIMEOUT']))
+        attempts = self.config['PROVIDER_MAX_RETRIES'] + 1
+        for attempt in range(attempts):
+            try:
+                response = self.session.request(method, url, **kwargs)
+                response.raise_for_status()
+                data = response.json()
+            except requests.HTTPError as e:
+                if e.response.status_code not in self.RETRY_STATUSES:
+                    breaker.record_success()  # The provider is up, it rejected this request
+                    raise
+                error = e
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except Exception:
+                # Invalid JSON or any other request error; recording it also ends a half-open probe
+                breaker.record_failure()
+                raise
+            else:
+                breaker.record_success()
+                return data
+            
+            if attempt == attempts - 1:
+                breaker.record_failure()
+                raise error
+            time.sleep(random.uniform(0, self.config['PROVIDER_RETRY_BACKOFF'] * 2 ** attempt))
+
+    def get(self, provider, url, **kwargs):
+        return self.request(provider, 'GET', url, **kwargs)
+
+    def post(self, provider, url, **kwargs):
+        return self.request(provider, 'POST', url, **kwargs)
+
+provider_client = ProviderClient(app.config)
+
+provider_pool = ThreadPoolExecutor(max_workers=app.config['PROVIDER_POOL_SIZE'], thread_name_prefix='provider')
+
+# Competitor and keyword index
+STOPWORDS = frozenset('a an and are as at be by for from in into is it of on or our the to with your'.split())
+
+def tokenize(text):
+    return [token for token in re.findall(r'[a-z0-9]+', str(text).lower()) if len(token) > 1 and token not in STOPWORDS]
+
+class MarketIndex:
+    """Read-only competitor profiles and keyword stats searched through a memory-mapped index file
+
+    Layout: MAGIC, a little-endian u32 header length, a JSON header of {section: [offset, dtype, count]}, then the
+    sections, 8-byte aligned and offset from the first aligned byte after the header. The vocabulary is sorted, so the tokens under any prefix form one contiguous range
+    (a flattened prefix trie). Per-token posting lists hold competitor and keyword ids; records are JSON blobs
+    decoded only when they are returned. Pages are shared by every worker that maps the same file.
+    """
+    MAGIC = b'DACVIDX1'
+    PREFIX_MATCH_WEIGHT = 0.5  # Relative weight of tokens matched only by prefix, e.g. "wallet" -> "wallets"
+    PREFIX_LIMIT = 50  # Vocabulary tokens one query token may expand to
+
+    def __init__(self, path=None):
+        self.tokens = []
+        self.identity = None
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._mm[:len(self.MAGIC)] != self.MAGIC:
+                raise ValueError(f'{path} is not a market index')
+            (length,) = struct.unpack_from('<I', self._mm, len(self.MAGIC))
+            start = len(self.MAGIC) + 4
+            self.layout = json.loads(self._mm[start:start + length])
+            self.base = -(-(start + length) // 8) * 8
+            np = sdk('numpy')
+            self.sections = {
+                name: np.frombuffer(self._mm, dtype=dtype, count=count, offset=self.base + offset)
+                for name, (offset, dtype, count) in self.layout.items()
+            }
+            self.tokens = self.sections['tokens'].tobytes().decode().split('\n')
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def _record(self, kind, doc):
+        offsets = self.sections[f'{kind}_record_offsets']
+        base = self.base + self.layout[f'{kind}_records'][0]
+        return json.loads(self._mm[base + int(offsets[doc]):base + int(offsets[doc + 1])])
+
+    def _match(self, kind, text):
+        """Vocabulary ids matched by the text's tokens, exactly or else by prefix, with their weights.
+
+        Competitors and keywords share the vocabulary, so an exact match only counts when the token has postings
+        of the kind searched; otherwise the token is expanded by prefix, e.g. "wallet" -> "wallets".
+        """
+        offsets = self.sections[f'{kind}_offsets']
+        matches = {}
+        for token in set(tokenize(text)):
+            start = bisect.bisect_left(self.tokens, token)
+            if start < len(self.tokens) and self.tokens[start] == token and offsets[start + 1] > offsets[start]:
+                matches[start] = 1.0
+            elif len(token) >= 3:
+                end = bisect.bisect_left(self.tokens, token + '\uffff', start, min(len(self.tokens), start + self.PREFIX_LIMIT))
+                for token_id in range(start, end):
+                    matches.setdefault(token_id, self.PREFIX_MATCH_WEIGHT)
+        return matches
+
+    def search(self, kind, text, limit):
+        """Top records of a kind ('competitor' or 'keyword') by summed IDF of matched tokens, as (record, score)"""
+        if not self.tokens:
+            return []
+        offsets = self.sections[f'{kind}_offsets']
+        postings = self.sections[f'{kind}_postings']
+        matches = self._match(kind, text)
+        if not matches:
+            return []
+        np = sdk('numpy')
+        token_ids = np.fromiter(matches, dtype=np.int64, count=len(matches))
+        counts = (offsets[token_ids + 1] - offsets[token_ids]).astype(np.int64)
+        if not counts.any():
+            return []
+        docs = np.concatenate([postings[offsets[token_id]:offsets[token_id + 1]] for token_id in token_ids.tolist()])
+        weights = np.repeat(np.fromiter(matches.values(), dtype=np.float32, count=len(matches)) * self.sections['idf'][token_ids], counts)
+        scores = np.bincount(docs, weights=weights)
+        top = np.argpartition(-scores, limit - 1)[:limit] if len(scores) > limit else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self._record(kind, doc), float(scores[doc])) for doc in top.tolist() if scores[doc] > 0]
+
+    def competitors(self, text, limit=5):
+        return self.search('competitor', text, limit)
+
+    def related_keywords(self, text, limit=10):
+        return self.search('keyword', text, limit)
+
+    @classmethod
+    def build(cls, competitors, keywords, path):
+        """Write an index of competitor profiles and keyword stats, atomically replacing the file at path"""
+        documents = {
+            'competitor': [
+                tokenize(' '.join([c.get('name', ''), c.get('category', ''), ' '.join(c.get('keywords', []))]))
+                for c in competitors
+            ],
+            'keyword': [tokenize(k['keyword']) for k in keywords]
+        }
+        postings = defaultdict(lambda: {'competitor': [], 'keyword': []})
+        for kind, docs in documents.items():
+            for doc, doc_tokens in enumerate(docs):
+                for token in dict.fromkeys(doc_tokens):
+                    postings[token][kind].append(doc)
+        tokens = sorted(postings)
+        total = len(competitors) + len(keywords)
+        
+        np = sdk('numpy')
+        sections = {
+            'tokens': np.frombuffer('\n'.join(tokens).encode(), dtype=np.uint8),
+            'idf': np.array([math.log(1 + total / (len(postings[t]['competitor']) + len(postings[t]['keyword']))) for t in tokens], dtype=np.float32)
+        }
+        for kind, records in (('competitor', competitors), ('keyword', keywords)):
+            lists = [postings[token][kind] for token in tokens]
+            sections[f'{kind}_offsets'] = np.concatenate([[0], np.cumsum([len(docs) for docs in lists])]).astype(np.uint32)
+            sections[f'{kind}_postings'] = np.array([doc for docs in lists for doc in docs], dtype=np.uint32)
+            blobs = [json.dumps(record, separators=(',', ':')).encode() for record in records]
+            sections[f'{kind}_record_offsets'] = np.concatenate([[0], np.cumsum([len(blob) for blob in blobs])]).astype(np.uint64)
+            sections[f'{kind}_records'] = np.frombuffer(b''.join(blobs), dtype=np.uint8)
+        
+        layout, offset = {}, 0
+        for name, array in sections.items():
+            layout[name] = [offset, array.dtype.str, len(array)]
+            offset += -(-array.nbytes // 8) * 8
+        header = json.dumps(layout).encode()
+        base = -(-(len(cls.MAGIC) + 4 + len(header)) // 8) * 8
+        
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(cls.MAGIC + struct.pack('<I', len(header)) + header)
+            for name, array in sections.items():
+                f.seek(base + layout[name][0])
+                f.write(array.tobytes())
+            f.truncate(base + offset)
+        os.replace(temp_path, path)  # Readers keep their mapping of the old file until they reload
+
+class MarketIndexLoader:
+    """Holds the current MarketIndex and swaps in a new one when the file is replaced on disk"""
+    def __init__(self, path, check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self.index = MarketIndex()
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if time.monotonic() - self._checked >= self.check_interval:
+            self.reload()
+        return self.index
+
+    def reload(self, force=False):
+        """Load the index file if it changed; a bad file leaves the current index in place"""
+        if not self._lock.acquire(blocking=False):
+            return self.index  # Another thread is already checking
+        try:
+            self._checked = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return self.index
+            if force or (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self.index.identity:
+                try:
+                    self.index = MarketIndex(self.path)
+                    metrics.inc('dacv_market_index_reloads_total', outcome='loaded')
+                except Exception:
+                    metrics.inc('dacv_market_index_reloads_total', outcome='failed')
+            return self.index
+        finally:
+            self._lock.release()
+
+market_index = MarketIndexLoader(app.config['MARKET_INDEX_PATH'], app.config['MARKET_INDEX_CHECK_INTERVAL'])
+
+@app.cli.command('build-market-index')
+@click.argument('source')
+@click.argument('output', required=False)
+def build_market_index(source, output=None):
+    """Build the market index from a JSON file of {"competitors": [...], "keywords": [...]}"""
+    with open(source) as f:
+        data = json.load(f)
+    output = output or app.config['MARKET_INDEX_PATH']
+    MarketIndex.build(data.get('competitors', []), data.get('keywords', []), output)
+    click.echo(f"Indexed {len(data.get('competitors', []))} competitors and {len(data.get('keywords', []))} keywords into {output}")
+
+class RealTimeData:
+    @staticmethod
+    def get_social_media_trends(refresh=False):
+        """Get real-time social media trends"""
+        cache_key = RealTimeData.cache_key('social_trends')
+        # Mock API - replace with actual API
+        return RealTimeData._cached('social_trends', cache_key, lambda: provider_client.get(
+            'market_data',
+            f'{app.config["MARKET_DATA_API_URL"]}/social/trends',
+            headers={'Authorization': f'Bearer {app.config["MARKET_DATA_API_KEY"]}'}
+        ), RealTimeData.social_trends_fallback, refresh)
+
+    @staticmethod
+    def get_seo_data(keyword, refresh=False):
+        """Get real-time SEO data"""
+        cache_key = RealTimeData.cache_key('seo', keyword)
+        # Mock API - replace with actual API
+        return RealTimeData._cached('seo', cache_key, lambda: provider_client.get(
+            'market_data',
+            f'{app.config["MARKET_DATA_API_URL"]}/seo/{keyword}',
+            headers={'Authorization': f'Bearer {app.config["MARKET_DATA_API_KEY"]}'}
+        ), lambda: RealTimeData.seo_fallback(keyword), refresh)
+
+    @staticmethod
+    def get_market_sentiment(product, refresh=False):
+        """Get market sentiment"""
+        cache_key = RealTimeData.cache_key('sentiment', product)
+        # Mock API - replace with actual API
+        return RealTimeData._cached('sentiment', cache_key, lambda: provider_client.post(
+            'sentiment',
+            f'{app.config["SENTIMENT_API_URL"]}/sentiment',
+            headers={'Authorization': f'Bearer {app.config["SENTIMENT_API_KEY"]}'},
+            json={'text': product}
+        ), RealTimeData.sentiment_fallback, refresh)
+
+    @staticmethod
+    def cache_key(namespace, arg=None):
+        """md5 cache key for a provider lookup: social_trends, seo_<keyword> or sentiment_<product>"""
+        name = namespace if arg is None else f'{namespace}_{arg}'
+        return hashlib.md5(name.encode()).hexdigest()
+
+    @staticmethod
+    def _cached(namespace, cache_key, fetch, fallback, refresh=False):
+        """Serve from cache; misses share one upstream fetch and stale hits refresh in the background"""
+        cached, fresh = (None, False) if refresh else real_time_cache.lookup(namespace, cache_key)
+        if fresh:
+            return cached
+        
+        def load():
+            with metrics.timer(f'provider_{namespace}'):
+                data = fetch()
+            real_time_cache.set(namespace, cache_key, data)
+            return data
+        
+        if cached is not None:
+            provider_flight.do_async(cache_key, load, provider_pool)
+            return cached
+        try:
+            return provider_flight.do(cache_key, load)
+        except:
+            return fallback()
+
+    @staticmethod
+    def peek(product, keyword):
+        """Cached sentiment and SEO data for a request, else their local fallbacks; never calls a provider"""
+        sentiment = real_time_cache.peek(RealTimeData.cache_key('sentiment', product))
+        seo_data = real_time_cache.peek(RealTimeData.cache_key('seo', keyword))
+        return sentiment or RealTimeData.sentiment_fallback(), seo_data or RealTimeData.seo_fallback(keyword, product)
+
+    @staticmethod
+    def get_all(product, keyword):
+        """Fetch trends, sentiment and SEO data concurrently within their deadlines"""
+        with metrics.timer('real_time_data'):
+            results = RealTimeData.get_many([product], [keyword])
+        return {
+            'social_trends': results['social_trends'],
+            'sentiment': results['sentiment'][product],
+            'seo': results['seo'][keyword]
+        }
+
+    @staticmethod
+    def get_many(products, keywords):
+        """Fetch trends once, sentiment per unique product and SEO data per unique keyword, concurrently"""
+        deadlines = app.config['PROVIDER_DEADLINES']
+        start = time.monotonic()
+        cache_warmer.record_many(products, keywords)
+        descriptions = {}
+        for product, keyword in zip(products, keywords):
+            descriptions.setdefault(keyword, product)
+        calls = [('social_trends', None, RealTimeData.get_social_media_trends, (), RealTimeData.social_trends_fallback)]
+        calls += [
+            ('sentiment', product, RealTimeData.get_market_sentiment, (product,), RealTimeData.sentiment_fallback)
+            for product in dict.fromkeys(products)
+        ]
+        calls += [
+            ('seo', keyword, RealTimeData.get_seo_data, (keyword,), lambda keyword=keyword: RealTimeData.seo_fallback(keyword, descriptions[keyword]))
+            for keyword in dict.fromkeys(keywords)
+        ]
+        futures = [provider_pool.submit(fetch, *args) for _, _, fetch, args, _ in calls]
+        
+        # Calls beyond the pool size queue behind earlier ones, so deadlines stretch by one per wave of calls
+        pool_size = app.config['PROVIDER_POOL_SIZE']
+        total_deadline = start + app.config['PROVIDER_TOTAL_DEADLINE'] * -(-len(calls) // pool_size)
+        results = {'social_trends': None, 'sentiment': {}, 'seo': {}}
+        for index, ((name, key, _, _, fallback), future) in enumerate(zip(calls, futures)):
+            wave = index // pool_size + 1
+            deadline = min(start + deadlines.get(name, app.config['PROVIDER_TOTAL_DEADLINE']) * wave, total_deadline)
+            try:
+                value = future.result(timeout=max(0, deadline - time.monotonic()))
+            except (FutureTimeoutError, Exception):
+                # A late call keeps running and still populates the cache for the next request
+                value = fallback()
+            if key is None:
+                results[name] = value
+            else:
+                results[name][key] = value
+        return results
+
+    @staticmethod
+    def social_trends_fallback():
+        return {
+            "trending_platforms": ["TikTok", "Instagram Reels", "LinkedIn"],
+            "popular_content_types": ["Short Videos", "Live Streams", "Interactive Polls"],
+            "engagement_tips": ["Use trending audio", "Post during peak hours", "Engage with comments"]
+        }
+
+    @staticmethod
+    def seo_fallback(keyword, product=None):
+        """Stats of the best-matching indexed keyword for the product description, else a template"""
+        matches = market_index.get().related_keywords(product or keyword, 6)
+        if matches:
+            stats = matches[0][0]
+            return {
+                "keyword_difficulty": stats.get('keyword_difficulty', 'Medium'),
+                "search_volume": stats.get('search_volume', 5000),
+                "cpc": stats.get('cpc', 1.25),
+                "related_keywords": [record['keyword'] for record, _ in matches]
+            }
+        return {
+            "keyword_difficulty": "Medium",
+            "search_volume": 5000,
+            "cpc": 1.25,
+            "related_keywords": [f"{keyword} tips", f"best {keyword}", f"{keyword} guide"]
+        }
+
+    @staticmethod
+    def sentiment_fallback():
+        return {
+            "sentiment": "neutral",
+            "confidence": 0.75,
+            "keywords": ["innovative", "competitive", "emerging"]
+        }
+
+class CacheWarmer:
+    """Re-fetches popular SEO and sentiment keys before they expire and refreshes trends on a schedule.
+
+    Every worker runs a warmer; a lease taken in the shared backend before each refresh makes sure only one
+    of them refreshes a given key per interval.
+    """
+    def __init__(self, config, backend):
+        self.config = config
+        self.backend = backend
+        self.scores = {'seo': {}, 'sentiment': {}}  # Decayed request counts per lookup argument
+        self.refreshes = 0
+        self._last_trends_refresh = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def record_many(self, products, keywords):
+        if not self.config['CACHE_WARM_ENABLED']:
+            return
+        self.start()
+        with self._lock:
+            for namespace, args in (('sentiment', products), ('seo', keywords)):
+                scores = self.scores[namespace]
+                for arg in args:
+                    scores[arg] = scores.get(arg, 0) + 1
+                if len(scores) > self.config['CACHE_WARM_TRACKED_KEYS']:
+                    # Drop the colder half at once so tracking stays amortized O(1) per request
+                    for arg in sorted(scores, key=scores.get)[:len(scores) // 2]:
+                        del scores[arg]
+
+    def start(self):
+        """Start the warmer thread on first use, after any pre-fork"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='cache-warmer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.config['CACHE_WARM_INTERVAL'])
+            try:
+                self.warm()
+            except Exception:
+                pass
+
+    def hot_keys(self):
+        """Most popular (namespace, arg) pairs; decays every score so popularity tracks recent traffic"""
+        with self._lock:
+            ranked = sorted(
+                ((score, namespace, arg) for namespace, scores in self.scores.items() for arg, score in scores.items()),
+                reverse=True
+            )[:self.config['CACHE_WARM_MAX_KEYS']]
+            for scores in self.scores.values():
+                for arg in list(scores):
+                    scores[arg] /= 2
+                    if scores[arg] < 0.25:
+                        del scores[arg]
+        return [(namespace, arg) for _, namespace, arg in ranked]
+
+    def warm(self):
+        """One pass: refresh trends when due, then hot keys close to expiry, within the refresh budget"""
+        budget = self.config['CACHE_WARM_MAX_REFRESHES']
+        now = time.monotonic()
+        if now - self._last_trends_refresh >= self.config['CACHE_WARM_TRENDS_INTERVAL']:
+            self._last_trends_refresh = now
+            if self._lease('social_trends', self.config['CACHE_WARM_TRENDS_INTERVAL']):
+                RealTimeData.get_social_media_trends(refresh=True)
+                self.refreshes += 1
+                budget -= 1
+        
+        for namespace, arg in self.hot_keys():
+            if budget <= 0:
+                break
+            remaining = real_time_cache.expires_in(RealTimeData.cache_key(namespace, arg))
+            if remaining is not None and remaining > self.config['CACHE_WARM_LEAD']:
+                continue
+            if not self._lease(RealTimeData.cache_key(namespace, arg), self.config['CACHE_WARM_LEAD']):
+                continue  # Another worker is refreshing this key
+            if namespace == 'seo':
+                RealTimeData.get_seo_data(arg, refresh=True)
+            else:
+                RealTimeData.get_market_sentiment(arg, refresh=True)
+            self.refreshes += 1
+            budget -= 1
+
+    def _lease(self, key, ttl):
+        """Claim the refresh of key for ttl seconds across every worker sharing the backend"""
+        return self.backend.add(f'warm-lease:{key}', os.getpid(), ttl=ttl)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "refreshes": self.refreshes,
+                "tracked_keys": sum(len(scores) for scores in self.scores.values())
+            }
+
+cache_warmer = CacheWarmer(app.config, storage)
+
+class AsyncProviderClient:
+    """Non-blocking counterpart of ProviderClient for the async serving mode; shares its circuit breakers"""
+    def __init__(self, config, sync_client):
+        self.config = config
+        self.sync_client = sync_client
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.config['ASYNC_MAX_CONNECTIONS'],
+                    max_keepalive_connections=self.config['PROVIDER_HTTP_POOL_SIZE']
+                ),
+                timeout=httpx.Timeout(self.config['PROVIDER_READ_TIMEOUT'], connect=self.config['PROVIDER_CONNECT_TIMEOUT'])
+            )
+        return self._client
+
+    async def request(self, provider, method, url, **kwargs):
+        """Send a request with timeouts, jittered retries and the provider's circuit breaker"""
+        import httpx
+        breaker = self.sync_client.breaker(provider)
+        if not breaker.allow():
+            raise CircuitOpenError(f'{provider} circuit is open')
+        
+        attempts = self.config['PROVIDER_MAX_RETRIES'] + 1
+        try:
+            for attempt in range(attempts):
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                    response.raise_for_status()
+                    data = response.json()
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code not in ProviderClient.RETRY_STATUSES:
+                        breaker.record_success()  # The provider is up, it rejected this request
+                        raise
+                    error = e
+                except httpx.TransportError as e:
+                    error = e
+                except Exception:
+                    # Invalid JSON or any other request error; recording it also ends a half-open probe
+                    breaker.record_failure()
+                    raise
+                else:
+                    breaker.record_success()
+                    return data
+                
+                if attempt == attempts - 1:
+                    breaker.record_failure()
+                    raise error
+                await asyncio.sleep(random.uniform(0, self.config['PROVIDER_RETRY_BACKOFF'] * 2 ** attempt))
+        except BaseException:
+            breaker.release_probe()  # Deadline cancellations arrive as CancelledError
+            raise
+
+    async def get(self, provider, url, **kwargs):
+        return await self.request(provider, 'GET', url, **kwargs)
+
+    async def post(self, provider, url, **kwargs):
+        return await self.request(provider, 'POST', url, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+async_provider_client = AsyncProviderClient(app.config, provider_client)
+
+class AsyncRealTimeData:
+    """Async counterparts of RealTimeData sharing its cache keys, cache and fallbacks"""
+    _inflight = {}  # cache_key -> asyncio.Task
+
+    @staticmethod
+    async def get_social_media_trends():
+        cache_key = RealTimeData.cache_key('social_trends')
+        return await AsyncRealTimeData._cached('social_trends', cache_key, lambda: async_provider_client.get(
+            'market_data',
+            f'{app.config["MARKET_DATA_API_URL"]}/social/trends',
+            headers={'Authorization': f'Bearer {app.config["MARKET_DATA_API_KEY"]}'}
+        ), RealTimeData.social_trends_fallback)
+
+    @staticmethod
+    async def get_seo_data(keyword):
+        cache_key = RealTimeData.cache_key('seo', keyword)
+        return await AsyncRealTimeData._cached('seo', cache_key, lambda: async_provider_client.get(
+            'market_data',
+            f'{app.config["MARKET_DATA_API_URL"]}/seo/{keyword}',
+            headers={'Authorization': f'Bearer {app.config["MARKET_DATA_API_KEY"]}'}
+        ), lambda: RealTimeData.seo_fallback(keyword))
+
+    @staticmethod
+    async def get_market_sentiment(product):
+        cache_key = RealTimeData.cache_key('sentiment', product)
+        return await AsyncRealTimeData._cached('sentiment', cache_key, lambda: async_provider_client.post(
+            'sentiment',
+            f'{app.config["SENTIMENT_API_URL"]}/sentiment',
+            headers={'Authorization': f'Bearer {app.config["SENTIMENT_API_KEY"]}'},
+            json={'text': product}
+        ), RealTimeData.sentiment_fallback)
+
+    @staticmethod
+    async def _cached(namespace, cache_key, fetch, fallback):
+        """Same policy as RealTimeData._cached, coalescing misses on one task per key"""
+        cached, fresh = real_time_cache.lookup(namespace, cache_key)
+        if fresh:
+            return cached
+        
+        task = AsyncRealTimeData._inflight.get(cache_key)
+        if task is None:
+            async def load():
+                try:
+                    with metrics.timer(f'provider_{namespace}'):
+                        data = await fetch()
+                    real_time_cache.set(namespace, cache_key, data)
+                    return data
+                finally:
+                    AsyncRealTimeData._inflight.pop(cache_key, None)
+            task = AsyncRealTimeData._inflight[cache_key] = asyncio.ensure_future(load())
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        
+        if cached is not None:
+            return cached
+        try:
+            # Shielded so a caller hitting its deadline does not cancel the fetch other callers share
+            return await asyncio.shield(task)
+        except Exception:
+            return fallback()
+
+    @staticmethod
+    async def get_all(product, keyword):
+        """Fetch trends, sentiment and SEO data concurrently within their deadlines"""
+        cache_warmer.record_many([product], [keyword])
+        deadlines = app.config['PROVIDER_DEADLINES']
+        total_deadline = app.config['PROVIDER_TOTAL_DEADLINE']
+        
+        async def bounded(name, lookup, fallback):
+            try:
+                return await asyncio.wait_for(lookup, min(deadlines.get(name, total_deadline), total_deadline))
+            except Exception:
+                return fallback()
+        
+        social_trends, sentiment, seo = await asyncio.gather(
+            bounded('social_trends', AsyncRealTimeData.get_social_media_trends(), RealTimeData.social_trends_fallback),
+            bounded('sentiment', AsyncRealTimeData.get_market_sentiment(product), RealTimeData.sentiment_fallback),
+            bounded('seo', AsyncRealTimeData.get_seo_data(keyword), lambda: RealTimeData.seo_fallback(keyword, product))
+        )
+        return {'social_trends': social_trends, 'sentiment': sentiment, 'seo': seo}
+
+_async_openai_client = None
+
+def async_openai():
+    global _async_openai_client
+    if _async_openai_client is None:
+        _async_openai_client = sdk('openai').AsyncOpenAI(api_key=app.config['OPENAI_API_KEY'], base_url=app.config['OPENAI_BASE_URL'])
+    return _async_openai_client
+
+class UserManager:
+    def __init__(self, backend):
+        self.backend = backend  # Shared backend so usage counts hold across workers
+        
+    def check_user(self, user_id):
+        user = self.backend.get(f'user:{user_id}') or {
+            'paid': False,
+            'plan': None,
+            'customer_id': None,
+            'subscription_id': None
+        }
+        return {**user, 'uses': int(self.backend.get(f'user_uses:{user_id}') or 0)}
+    
+    def charge_uses(self, user_id, count=1, limit=None):
+        """Count strategies to the user unless that takes them past limit; True when charged"""
+        uses = self.backend.incr(f'user_uses:{user_id}', count)
+        if limit is not None and uses > limit:
+            self.backend.incr(f'user_uses:{user_id}', -count)
+            return False
+        return True
+    
+    def refund_uses(self, user_id, count=1):
+        self.backend.incr(f'user_uses:{user_id}', -count)
+    
+    def increment_use(self, user_id):
+        return self.charge_uses(user_id, 1)
+    
+    def set_paid(self, user_id, customer_id, subscription_id, plan=None):
+        self.backend.set(f'user:{user_id}', {
+            'paid': True,
+            'plan': plan,
+            'customer_id': customer_id,
+            'subscription_id': subscription_id
+        })
+        self.backend.set(f'customer:{customer_id}', user_id)
+        return True
+    
+    def set_customer(self, user_id, customer_id):
+        user = self.check_user(user_id)
+        self.backend.set(f'user:{user_id}', {
+            'paid': user['paid'],
+            'plan': user['plan'],
+            'customer_id': customer_id,
+            'subscription_id': user['subscription_id']
+        })
+        self.backend.set(f'customer:{customer_id}', user_id)
+    
+    def find_by_customer(self, customer_id):
+        user_id = self.backend.get(f'customer:{customer_id}')
+        return (user_id, self.check_user(user_id)) if user_id else (None, None)
+    
+    def update_subscriptions(self, updates):
+        """Apply (action, customer_id, subscription_id, plan) updates in order; action is 'activate' or 'revoke'"""
+        for action, customer_id, subscription_id, plan in updates:
+            user_id, user = self.find_by_customer(customer_id)
+            if user_id is None:
+                continue
+            record = {key: user[key] for key in ('paid', 'plan', 'customer_id', 'subscription_id')}
+            if action == 'activate':
+                record.update(paid=True, plan=plan or record['plan'], subscription_id=subscription_id or record['subscription_id'])
+            elif record['subscription_id'] == subscription_id:  # A newer subscription stays active
+                record.update(paid=False, plan=None)
+            self.backend.set(f'user:{user_id}', record)
+
+class SQLiteUserManager(SQLiteStore, UserManager):
+    """Durable user store: one WAL-mode SQLite row per user, indexed by user_id and customer_id"""
+    COLUMNS = 'uses, paid, customer_id, subscription_id, plan'
+
+    def _create_schema(self, conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS users ('
+            'user_id TEXT PRIMARY KEY, '
+            'uses INTEGER NOT NULL DEFAULT 0, '
+            'paid INTEGER NOT NULL DEFAULT 0, '
+            'customer_id TEXT, '
+            'subscription_id TEXT, '
+            'plan TEXT, '
+            'updated_at TEXT NOT NULL'
+            ') WITHOUT ROWID'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS users_customer_id ON users (customer_id)')
+        if 'plan' not in [column[1] for column in conn.execute('PRAGMA table_info(users)')]:
+            conn.execute('ALTER TABLE users ADD COLUMN plan TEXT')
+
+    @staticmethod
+    def _to_user(row):
+        if row is None:
+            return {'uses': 0, 'paid': False, 'customer_id': None, 'subscription_id': None, 'plan': None}
+        return {'uses': row[0], 'paid': bool(row[1]), 'customer_id': row[2], 'subscription_id': row[3], 'plan': row[4]}
+
+    def check_user(self, user_id):
+        row = self._conn().execute(
+            f'SELECT {self.COLUMNS} FROM users WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        return self._to_user(row)
+
+    def find_by_customer(self, customer_id):
+        row = self._conn().execute(
+            f'SELECT user_id, {self.COLUMNS} FROM users WHERE customer_id = ?', (customer_id,)
+        ).fetchone()
+        return (row[0], self._to_user(row[1:])) if row else (None, None)
+
+    def charge_uses(self, user_id, count=1, limit=None):
+        if limit is not None and count > limit:
+            return False
+        # The limit is checked in the same statement that adds the uses, so concurrent charges cannot overshoot it
+        row = self._conn().execute(
+            'INSERT INTO users (user_id, uses, updated_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (user_id) DO UPDATE SET uses = uses + excluded.uses, updated_at = excluded.updated_at '
+            'WHERE ? IS NULL OR users.uses + excluded.uses <= ? '
+            'RETURNING uses',
+            (user_id, count, datetime.now().isoformat(), limit, limit)
+        ).fetchone()
+        return row is not None
+
+    def refund_uses(self, user_id, count=1):
+        self._conn().execute(
+            'UPDATE users SET uses = MAX(0, uses - ?), updated_at = ? WHERE user_id = ?',
+            (count, datetime.now().isoformat(), user_id)
+        )
+
+    def set_paid(self, user_id, customer_id, subscription_id, plan=None):
+        self._conn().execute(
+            'INSERT INTO users (user_id, paid, customer_id, subscription_id, plan, updated_at) VALUES (?, 1, ?, ?, ?, ?) '
+            'ON CONFLICT (user_id) DO UPDATE SET paid = 1, customer_id = excluded.customer_id, '
+            'subscription_id = excluded.subscription_id, plan = excluded.plan, updated_at = excluded.updated_at',
+            (user_id, customer_id, subscription_id, plan, datetime.now().isoformat())
+        )
+        return True
+
+    def set_customer(self, user_id, customer_id):
+        self._conn().execute(
+            'INSERT INTO users (user_id, customer_id, updated_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (user_id) DO UPDATE SET customer_id = excluded.customer_id, updated_at = excluded.updated_at',
+            (user_id, customer_id, datetime.now().isoformat())
+        )
+
+    def update_subscriptions(self, updates):
+        conn = self._conn()
+        now = datetime.now().isoformat()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for action, customer_id, subscription_id, plan in updates:
+                if action == 'activate':
+                    conn.execute(
+                        'UPDATE users SET paid = 1, plan = COALESCE(?, plan), '
+                        'subscription_id = COALESCE(?, subscription_id), updated_at = ? WHERE customer_id = ?',
+                        (plan, subscription_id, now, customer_id)
+                    )
+                else:
+                    conn.execute(
+                        'UPDATE users SET paid = 0, plan = NULL, updated_at = ? WHERE customer_id = ? AND subscription_id = ?',
+                        (now, customer_id, subscription_id)
+                    )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+if app.config['USER_DB_PATH']:
+    user_manager = SQLiteUserManager(app.config['USER_DB_PATH'])
+else:
+    user_manager = UserManager(storage)
+
+class QuotaManager:
+    """Per-user request rate and plan quota, enforced with token buckets in the shared store so limits hold across workers"""
+    QUOTA_PERIOD = 30 * 86400  # Monthly quotas refill continuously over this many seconds
+
+    def __init__(self, backend, users):
+        self.backend = backend
+        self.users = users
+
+    @staticmethod
+    def plan_for(user):
+        if user.get('plan'):
+            return user['plan']
+        return 'professional' if user['paid'] else 'free'  # Subscriptions predating plan tiers were unlimited
+
+    def buckets(self, user_id, plan, count=1):
+        limits = app.config['PLANS'][plan]
+        per_minute = limits['requests_per_minute']
+        buckets = [(f'bucket:rate:{user_id}', per_minute, per_minute / 60.0, 1)]
+        if limits['monthly_quota'] is not None:
+            quota = limits['monthly_quota']
+            buckets.append((f'bucket:quota:{plan}:{user_id}', quota, quota / self.QUOTA_PERIOD, count))
+        return buckets
+
+    def acquire(self, user_id, user, count=1):
+        """Charge one request and count strategies to the user, or return an error payload"""
+        plan = self.plan_for(user)
+        if not self.users.charge_uses(user_id, count, app.config['MAX_FREE_USES'] if plan == 'free' else None):
+            return {"error": "Payment required", "payment_required": True}
+        
+        failed, retry_after = self.backend.take_tokens(self.buckets(user_id, plan, count))
+        if failed is None:
+            return None
+        self.users.refund_uses(user_id, count)
+        if failed == 0:
+            metrics.inc('dacv_quota_rejections_total', plan=plan, reason='rate')
+            return {
+                "error": "Rate limit exceeded",
+                "rate_limited": True,
+                "retry_after": math.ceil(retry_after) if retry_after is not None else None
+            }
+        metrics.inc('dacv_quota_rejections_total', plan=plan, reason='quota')
+        return {"error": "Payment required", "payment_required": True, "quota_exceeded": True, "plan": plan}
+
+    def refund(self, user_id, count=1):
+        """Give back uses and plan quota charged by acquire for strategies that were never delivered"""
+        plan = self.plan_for(self.users.check_user(user_id))
+        self.users.refund_uses(user_id, count)
+        # The rate bucket counts attempts, so only the quota bucket is refilled; a negative cost adds tokens
+        quota = [(key, capacity, rate, -cost) for key, capacity, rate, cost in self.buckets(user_id, plan, count)[1:]]
+        if quota:
+            self.backend.take_tokens(quota)
+
+# Quota buckets live with the users, so a durable user store gets durable quotas rather than per-worker memory
+quota_manager = QuotaManager(
+    SQLiteBackend(app.config['USER_DB_PATH']) if app.config['USER_DB_PATH'] else storage,
+    user_manager
+)
+
+class HistoryStore:
+    """In-process strategy history, indexed per user and kept in insertion (timestamp) order"""
+    SUMMARY_FIELDS = ('id', 'timestamp', 'product', 'audience', 'budget')
+
+    def __init__(self, max_per_user, retention_days):
+        self.max_per_user = max_per_user
+        self.retention_days = retention_days
+        self._entries = defaultdict(list)  # user_id -> entries with ascending ids
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        with self._lock:
+            entries = self._entries[record['user_id']]
+            entries.append({**record, 'id': next(self._ids)})
+            cutoff = (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+            expired = bisect.bisect_left([e['timestamp'] for e in entries], cutoff)
+            del entries[:max(expired, len(entries) - self.max_per_user)]
+
+    def page(self, user_id, cursor=None, limit=20, full=False):
+        """Return newest-first entries older than cursor, plus the cursor for the next page"""
+        with self._lock:
+            entries = self._entries.get(user_id, [])
+            end = len(entries) if cursor is None else bisect.bisect_left([e['id'] for e in entries], cursor)
+            items = entries[max(0, end - limit):end][::-1]
+        fields = self.SUMMARY_FIELDS + ('strategy',) if full else self.SUMMARY_FIELDS
+        items = [{field: e[field] for field in fields} for e in items]
+        next_cursor = items[-1]['id'] if len(items) == limit and end > limit else None
+        return {"items": items, "next_cursor": next_cursor}
+
+class SQLiteHistoryStore(SQLiteStore):
+    """Durable strategy history with an index on (user_id, id) for cursor pagination"""
+    def __init__(self, path, max_per_user, retention_days):
+        super().__init__(path)
+        self.max_per_user = max_per_user
+        self.retention_days = retention_days
+
+    def _create_schema(self, conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS history ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'user_id TEXT NOT NULL, '
+            'timestamp TEXT NOT NULL, '
+            'product TEXT NOT NULL, '
+            'audience TEXT NOT NULL, '
+            'budget REAL, '
+            'strategy TEXT NOT NULL'
+            ')'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS history_user_id ON history (user_id, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS history_timestamp ON history (timestamp)')
+
+    def append(self, record):
+        conn = self._conn()
+        conn.execute(
+            'INSERT INTO history (user_id, timestamp, product, audience, budget, strategy) VALUES (?, ?, ?, ?, ?, ?)',
+            (record['user_id'], record['timestamp'], record['product'], record['audience'],
+             record['budget'], json.dumps(record['strategy'], default=str))
+        )
+        conn.execute(
+            'DELETE FROM history WHERE user_id = ? AND id <= ('
+            'SELECT id FROM history WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+            (record['user_id'], record['user_id'], self.max_per_user)
+        )
+        conn.execute(
+            'DELETE FROM history WHERE user_id = ? AND timestamp < ?',
+            (record['user_id'], (datetime.now() - timedelta(days=self.retention_days)).isoformat())
+        )
+
+    def prune(self):
+        """Drop every user's entries past the retention window"""
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+        return self._conn().execute('DELETE FROM history WHERE timestamp < ?', (cutoff,)).rowcount
+
+    def page(self, user_id, cursor=None, limit=20, full=False):
+        """Return newest-first entries older than cursor, plus the cursor for the next page"""
+        columns = 'id, timestamp, product, audience, budget' + (', strategy' if full else '')
+        rows = self._conn().execute(
+            f'SELECT {columns} FROM history WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+            (user_id, cursor if cursor is not None else 2 ** 63 - 1, limit + 1)
+        ).fetchall()
+        items = []
+        for row in rows[:limit]:
+            item = {'id': row[0], 'timestamp': row[1], 'product': row[2], 'audience': row[3], 'budget': row[4]}
+            if full:
+                item['strategy'] = json.loads(row[5])
+            items.append(item)
+        return {"items": items, "next_cursor": items[-1]['id'] if len(rows) > limit else None}
+
+class PromptBuilder:
+    """Compact prompts for the AI strategy call.
+
+    Provider payloads are projected to the fields the prompt uses, over-long product and audience texts are
+    summarized to a token budget, and the model is asked for a terse JSON object in SCHEMA, which maps
+    straight onto the social_media, seo and content sections.
+    """
+    SCHEMA = {
+        'social_media': {'platforms': list, 'content_ideas': list, 'posting_frequency': str},
+        'seo': {'focus_keywords': list, 'content_pillars': list},
+        'content': {'themes': list, 'formats': list, 'tone': str}
+    }
+    OUTPUT_LIST_ITEMS = 3
+    MESSAGE_OVERHEAD = 4  # Tokens the chat format adds per message
+
+    def __init__(self, config):
+        self.config = config
+        self._encodings = {}
+        self._lock = threading.Lock()
+        template = {section: {field: [] if kind is list else '' for field, kind in fields.items()} for section, fields in self.SCHEMA.items()}
+        self.system_prompt = (
+            "You are an expert marketing strategist. Reply with only a JSON object shaped like "
+            f"{json.dumps(template, separators=(',', ':'))}. "
+            f"At most {self.OUTPUT_LIST_ITEMS} items per list, each under 10 words. No other keys or prose."
+        )
+
+    def _encoding(self, model):
+        """tiktoken encoding for the model, or None when tiktoken is not installed"""
+        if model not in self._encodings:
+            with self._lock:
+                if model not in self._encodings:
+                    try:
+                        import tiktoken
+                        try:
+                            encoding = tiktoken.encoding_for_model(model)
+                        except KeyError:
+                            encoding = tiktoken.get_encoding('o200k_base')
+                    except Exception:
+                        encoding = None
+                    self._encodings[model] = encoding
+        return self._encodings[model]
+
+    def count_tokens(self, text, model=None):
+        encoding = self._encoding(model or self.config['OPENAI_MODEL'])
+        if encoding is None:
+            return -(-len(text) // 4)  # About 4 characters per token for English text
+        return len(encoding.encode(text))
+
+    def _items(self, values):
+        return [str(value) for value in values[:self.config['AI_PROMPT_LIST_ITEMS']]] if isinstance(values, list) else []
+
+    def project_trends(self, social_trends):
+        social_trends = social_trends if isinstance(social_trends, dict) else {}
+        return {
+            'platforms': self._items(social_trends.get('trending_platforms')),
+            'content_types': self._items(social_trends.get('popular_content_types'))
+        }
+
+    def project_sentiment(self, sentiment):
+        sentiment = sentiment if isinstance(sentiment, dict) else {}
+        return {'sentiment': str(sentiment.get('sentiment', 'neutral')), 'keywords': self._items(sentiment.get('keywords'))}
+
+    def fit(self, text, budget, model=None):
+        """Text within budget tokens: its most informative sentences in their original order, else cut at a word"""
+        text = ' '.join(str(text).split())
+        if self.count_tokens(text, model) <= budget:
+            return text
+        sentences = re.split(r'(?<=[.!?;])\s+', text)
+        if self.count_tokens(sentences[0], model) < budget:
+            # Keep the lead sentence, then the ones densest in the description's recurring terms
+            weights = Counter(tokenize(text))
+            def density(i):
+                words = tokenize(sentences[i])
+                return sum(weights[word] for word in set(words)) / (len(words) + 1)
+            kept, used = [], 0
+            for i in [0] + sorted(range(1, len(sentences)), key=density, reverse=True):
+                cost = self.count_tokens(sentences[i], model) + 1
+                if used + cost <= budget:
+                    kept.append(i)
+                    used += cost
+            return ' '.join(sentences[i] for i in sorted(kept))
+        words = text.split()
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(' '.join(words[:middle]), model) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return ' '.join(words[:low])
+
+    def build(self, product, audience, budget, social_trends, sentiment, model=None):
+        """Return (messages, prompt token count)"""
+        trends = self.project_trends(social_trends)
+        mood = self.project_sentiment(sentiment)
+        user = '\n'.join([
+            f"Product: {self.fit(product, self.config['AI_PRODUCT_TOKEN_BUDGET'], model)}",
+            f"Audience: {self.fit(audience, self.config['AI_AUDIENCE_TOKEN_BUDGET'], model)}",
+            f"Monthly budget: ${budget}",
+            f"Trending platforms: {', '.join(trends['platforms'])}",
+            f"Popular formats: {', '.join(trends['content_types'])}",
+            f"Market sentiment: {mood['sentiment']} ({', '.join(mood['keywords'])})"
+        ])
+        messages = [{"role": "system", "content": self.system_prompt}, {"role": "user", "content": user}]
+        return messages, sum(self.count_tokens(m['content'], model) + self.MESSAGE_OVERHEAD for m in messages)
+
+    def parse(self, content):
+        """SCHEMA sections of a model reply, with unknown fields dropped and lists capped"""
+        data = json.loads(content)
+        result = {}
+        for section, fields in self.SCHEMA.items():
+            value = data.get(section) if isinstance(data, dict) else None
+            if not isinstance(value, dict):
+                continue
+            result[section] = {
+                field: [str(item) for item in value[field][:self.OUTPUT_LIST_ITEMS]] if kind is list else value[field]
+                for field, kind in fields.items() if isinstance(value.get(field), kind)
+            }
+        return result
+
+    def record_usage(self, model, prompt_tokens, usage, elapsed):
+        """Token counts and latency of one call; the provider's usage wins over our own prompt count"""
+        if usage is not None and getattr(usage, 'prompt_tokens', None):
+            prompt_tokens = usage.prompt_tokens
+        completion_tokens = getattr(usage, 'completion_tokens', None) or 0
+        metrics.observe('dacv_llm_tokens', prompt_tokens, buckets=Metrics.TOKEN_BUCKETS, model=model, kind='prompt')
+        metrics.observe('dacv_llm_tokens', completion_tokens, buckets=Metrics.TOKEN_BUCKETS, model=model, kind='completion')
+        metrics.observe('dacv_llm_duration_seconds', elapsed, model=model)
+
+prompt_builder = PromptBuilder(app.config)
+
+class LLMRouter:
+    """Model and completion cap per plan and prompt size, with hedged requests for slow calls.
+
+    A call still running past LLM_HEDGE_PERCENTILE of its model's recent latencies, or one that fails, is
+    raced against the route's hedge_model and the first usable reply wins. Async losers are cancelled; sync
+    ones cannot be and finish in the background.
+    """
+    def __init__(self, config):
+        self.config = config
+        self._latencies = defaultdict(lambda: deque(maxlen=config['LLM_LATENCY_WINDOW']))
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=config['LLM_POOL_SIZE'], thread_name_prefix='llm')
+
+    def route(self, plan, prompt_tokens):
+        routes = self.config['LLM_ROUTES']
+        route = dict(routes.get(plan, routes['free']))
+        large = route.pop('large', None)
+        if large and prompt_tokens > self.config['LLM_LARGE_PROMPT_TOKENS']:
+            route.update(large)
+        return route
+
+    def hedge_delay(self, model):
+        with self._lock:
+            latencies = sorted(self._latencies[model])
+        if len(latencies) < self.config['LLM_HEDGE_MIN_SAMPLES']:
+            return self.config['LLM_HEDGE_DELAY']
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.config['LLM_HEDGE_PERCENTILE']))]
+
+    def record(self, model, prompt_tokens, usage, elapsed):
+        with self._lock:
+            self._latencies[model].append(elapsed)
+        prompt_builder.record_usage(model, prompt_tokens, usage, elapsed)
+
+    @staticmethod
+    def _parse(response):
+        result = prompt_builder.parse(response.choices[0].message.content)
+        if not result:
+            raise ValueError('Reply has no strategy sections')
+        return result
+
+    def _call(self, request, prompt_tokens, model):
+        started = time.perf_counter()
+        response = sdk('openai').chat.completions.create(**request, model=model, timeout=self.config['LLM_TIMEOUT'])
+        self.record(model, prompt_tokens, response.usage, time.perf_counter() - started)
+        return self._parse(response)
+
+    async def _acall(self, request, prompt_tokens, model):
+        started = time.perf_counter()
+        response = await async_openai().chat.completions.create(**request, model=model, timeout=self.config['LLM_TIMEOUT'])
+        self.record(model, prompt_tokens, response.usage, time.perf_counter() - started)
+        return self._parse(response)
+
+    def _hedged(self, route, model):
+        if model != route['model']:
+            metrics.inc('dacv_llm_hedge_wins_total', model=model)
+
+    def complete(self, request, prompt_tokens, route):
+        """Parsed strategy sections from the first usable reply of the route's model or its hedge"""
+        started = time.monotonic()
+        deadline = started + self.config['LLM_TIMEOUT']
+        hedge_at = started + self.hedge_delay(route['model'])
+        models = {self._pool.submit(self._call, request, prompt_tokens, route['model']): route['model']}
+        pending, hedged, error = set(models), not route.get('hedge_model'), None
+        while pending:
+            until = deadline if hedged else min(hedge_at, deadline)
+            done, pending = wait(pending, timeout=max(0, until - time.monotonic()), return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                self._hedged(route, models[future])
+                return result
+            if not hedged:
+                hedged = True
+                future = self._pool.submit(self._call, request, prompt_tokens, route['hedge_model'])
+                models[future] = route['hedge_model']
+                pending.add(future)
+                metrics.inc('dacv_llm_hedges_total', model=route['model'])
+            elif not done:
+                raise FutureTimeoutError(f"{route['model']} gave no reply within {self.config['LLM_TIMEOUT']}s")
+        raise error
+
+    async def acomplete(self, request, prompt_tokens, route):
+        """Async counterpart of complete"""
+        started = time.monotonic()
+        deadline = started + self.config['LLM_TIMEOUT']
+        hedge_at = started + self.hedge_delay(route['model'])
+        models = {asyncio.ensure_future(self._acall(request, prompt_tokens, route['model'])): route['model']}
+        pending, hedged, error = set(models), not route.get('hedge_model'), None
+        try:
+            while pending:
+                until = deadline if hedged else min(hedge_at, deadline)
+                done, pending = await asyncio.wait(pending, timeout=max(0, until - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    self._hedged(route, models[task])
+                    return task.result()
+                if not hedged:
+                    hedged = True
+                    task = asyncio.ensure_future(self._acall(request, prompt_tokens, route['hedge_model']))
+                    models[task] = route['hedge_model']
+                    pending.add(task)
+                    metrics.inc('dacv_llm_hedges_total', model=route['model'])
+                elif not done:
+                    raise FutureTimeoutError(f"{route['model']} gave no reply within {self.config['LLM_TIMEOUT']}s")
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+llm_router = LLMRouter(app.config)
+
+class StrategyCache:
+    """Response cache for _generate_ai_strategy keyed on normalized inputs, with optional near-duplicate matching"""
+    NUM_HASHES = 32
+    MAX_CANDIDATES = 256  # Near-duplicate signatures kept per audience/budget/provider group
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, cache, near_duplicates=False, similarity=0.85):
+        self.cache = cache
+        self.near_duplicates = near_duplicates
+        self.similarity = similarity
+        self._groups = defaultdict(OrderedDict)  # group key -> {exact key: signature}
+        self._lock = threading.Lock()
+        rng = random.Random(0)
+        self._perms = [(rng.randrange(1, self._PRIME), rng.randrange(self._PRIME)) for _ in range(self.NUM_HASHES)]
+
+    @staticmethod
+    def normalize(text):
+        return ' '.join(re.findall(r'[a-z0-9]+', str(text).lower()))
+
+    @staticmethod
+    def budget_bucket(budget):
+        """Log-scale buckets, each 25% wider than the last"""
+        try:
+            return int(math.log(max(float(budget), 1.0), 1.25))
+        except (TypeError, ValueError):
+            return -1
+
+    @staticmethod
+    def fingerprint(payload):
+        return hashlib.md5(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+    def keys(self, product, audience, budget, social_trends, sentiment, model=''):
+        """Return (exact key, group key, normalized product)"""
+        product = self.normalize(product)
+        group = '|'.join([
+            model,
+            self.normalize(audience),
+            str(self.budget_bucket(budget)),
+            self.fingerprint(prompt_builder.project_trends(social_trends)),
+            self.fingerprint(prompt_builder.project_sentiment(sentiment))
+        ])
+        return hashlib.md5(f'{product}|{group}'.encode()).hexdigest(), group, product
+
+    def signature(self, text):
+        """MinHash signature over word 3-shingles (single words for very short texts)"""
+        words = text.split()
+        shingles = {' '.join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'big') for s in shingles]
+        return tuple(min((a * h + b) % self._PRIME for h in hashes) for a, b in self._perms)
+
+    def get(self, product, audience, budget, social_trends, sentiment, model=''):
+        key, group, text = self.keys(product, audience, budget, social_trends, sentiment, model)
+        result = self.cache.get('ai_strategy', key)
+        if result is not None or not self.near_duplicates:
+            return result
+        
+        signature = self.signature(text)
+        with self._lock:
+            candidates = list(self._groups.get(group, {}).items())
+        best_key, best_score = None, 0.0
+        for candidate_key, candidate in candidates:
+            score = sum(1 for x, y in zip(signature, candidate) if x == y) / self.NUM_HASHES
+            if score > best_score:
+                best_key, best_score = candidate_key, score
+        if best_key is None or best_score < self.similarity:
+            return None
+        result = self.cache.get('ai_strategy', best_key)
+        if result is None:
+            with self._lock:
+                self._groups.get(group, {}).pop(best_key, None)
+        return result
+
+    def set(self, product, audience, budget, social_trends, sentiment, result, model=''):
+        key, group, text = self.keys(product, audience, budget, social_trends, sentiment, model)
+        self.cache.set('ai_strategy', key, result)
+        if self.near_duplicates:
+            signature = self.signature(text)
+            with self._lock:
+                candidates = self._groups[group]
+                candidates[key] = signature
+                candidates.move_to_end(key)
+                while len(candidates) > self.MAX_CANDIDATES:
+                    candidates.popitem(last=False)
+
+ai_strategy_cache = StrategyCache(
+    create_cache(
+        {'ai_strategy': app.config['AI_CACHE_TTL']},
+        app.config['AI_CACHE_MAX_ENTRIES'],
+        app.config['AI_CACHE_MAX_BYTES'],
+        prefix='ai:'
+    ),
+    near_duplicates=app.config['AI_CACHE_NEAR_DUPLICATES'],
+    similarity=app.config['AI_CACHE_SIMILARITY']
 )
+ai_strategy_flight = SingleFlight()
+
+# Budget allocation
+class AllocationEngine:
+    """Vectorized search over candidate budget splits against saturating per-channel response curves
 
-# Initialize services
-openai.api_key = app.config['OPENAI_API_KEY']
-stripe.api_key = app.config['STRIPE_SECRET_KEY']
-limiter = Limiter(app=app, key_func=get_remote_address)
+    Spending x on a channel is expected to bring efficiency * saturation * (1 - exp(-x / saturation)) conversions.
+    Every candidate split is scored in one NumPy pass per batch of requests. Channel efficiencies are lognormal
+    around their estimates, widening as sentiment confidence drops: channel intervals are its exact quantiles,
+    the total's come from Monte Carlo draws.
+    """
+    CHANNELS = ('social_media', 'seo', 'content', 'paid_advertising')
+    PLATFORMS = ('google_search', 'meta', 'tiktok', 'linkedin')
+    PLATFORM_CPC = (1.0, 0.6, 0.4, 3.0)  # Relative to the keyword CPC
+    PLATFORM_CONVERSION = (1.0, 0.7, 0.5, 1.6)  # Relative to BASE_CONVERSION_RATE
+    PLATFORM_REACH = (0.4, 0.3, 0.2, 0.1)  # Share of the paid saturation spend
+    BASE_CONVERSION_RATE = 0.03
+    SENTIMENT_LIFT = {'positive': 1.2, 'neutral': 1.0, 'negative': 0.8}
+    DIFFICULTY_LIFT = {'low': 1.3, 'medium': 1.0, 'high': 0.6}
 
-# Real-time data cache
-real_time_cache = {}
-CACHE_EXPIRY = 3600  # 1 hour
+    def __init__(self, candidates, draws, interval, seed=7):
+        self.candidates = candidates
+        self.draws = draws
+        self.seed = seed
+        self.interval = interval
+        self.z = NormalDist().inv_cdf(1 - (1 - interval) / 2)
+        self._tables = None
 
-class RealTimeData:
-    @staticmethod
-    def get_social_media_trends():
-        """Get real-time social media trends"""
-        cache_key = hashlib.md5('social_trends'.encode()).hexdigest()
-        if cache_key in real_time_cache:
-            return real_time_cache[cache_key]
-        
-        try:
-            # Mock API - replace with actual API
-            response = requests.get(
-                'https://api.example.com/social/trends',
-                headers={'Authorization': f'Bearer {app.config["MARKET_DATA_API_KEY"]}'}
-            )
-            data = response.json()
-            real_time_cache[cache_key] = data
-            return data
-        except:
-            return {
-                "trending_platforms": ["TikTok", "Instagram Reels", "LinkedIn"],
-                "popular_content_types": ["Short Videos", "Live Streams", "Interactive Polls"],
-                "engagement_tips": ["Use trending audio", "Post during peak hours", "Engage with comments"]
+    def tables(self):
+        """Candidate splits and efficiency noise draws, built on first use so importing the app does not load NumPy"""
+        if self._tables is None:
+            np = sdk('numpy')
+            rng = np.random.default_rng(self.seed)  # Fixed seed: the same inputs always get the same plan
+            splits = {  # Single-channel, even and random splits; float32 halves the memory traffic of scoring
+                count: np.vstack([np.eye(count), np.full((1, count), 1.0 / count), rng.dirichlet(np.ones(count), self.candidates)]).astype(np.float32)
+                for count in {len(self.CHANNELS), len(self.PLATFORMS)}
             }
+            noise = rng.standard_normal((self.draws, max(len(self.CHANNELS), len(self.PLATFORMS))))
+            self._tables = splits, noise  # Racing first calls draw the same tables, so the last one wins harmlessly
+        return self._tables
 
     @staticmethod
-    def get_seo_data(keyword):
-        """Get real-time SEO data"""
-        cache_key = hashlib.md5(f'seo_{keyword}'.encode()).hexdigest()
-        if cache_key in real_time_cache:
-            return real_time_cache[cache_key]
-        
+    def _budget(value):
         try:
-            # Mock API - replace with actual API
-            response = requests.get(
-                f'https://api.example.com/seo/{keyword}',
-                headers={'Authorization': f'Bearer {app.config["MARKET_DATA_API_KEY"]}'}
-            )
-            data = response.json()
-            real_time_cache[cache_key] = data
-            return data
-        except:
-            return {
-                "keyword_difficulty": "Medium",
-                "search_volume": 5000,
-                "cpc": 1.25,
-                "related_keywords": [f"{keyword} tips", f"best {keyword}", f"{keyword} guide"]
-            }
+            value = float(value)
+        except (TypeError, ValueError):
+            return 0.0
+        return value if math.isfinite(value) and value > 0 else 0.0
 
-    @staticmethod
-    def get_market_sentiment(product):
-        """Get market sentiment"""
-        cache_key = hashlib.md5(f'sentiment_{product}'.encode()).hexdigest()
-        if cache_key in real_time_cache:
-            return real_time_cache[cache_key]
+    def _market(self, sentiment, seo_data):
+        """CPC, sentiment lift, keyword difficulty lift, paid saturation spend and efficiency spread for one request"""
+        sentiment, seo_data = sentiment or {}, seo_data or {}
+        cpc = self._budget(seo_data.get('cpc')) or 1.25
+        confidence = min(1.0, self._budget(sentiment.get('confidence')) or 0.5)
+        lift = 1 + (self.SENTIMENT_LIFT.get(str(sentiment.get('sentiment')).lower(), 1.0) - 1) * confidence
+        difficulty = self.DIFFICULTY_LIFT.get(str(seo_data.get('keyword_difficulty')).lower(), 1.0)
+        paid_saturation = max(100.0, (self._budget(seo_data.get('search_volume')) or 5000) * cpc * 0.5)
+        sigma = 0.15 + 0.5 * (1 - confidence)
+        return cpc, lift, difficulty, paid_saturation, sigma
+
+    def _optimize(self, budgets, efficiency, saturation, sigma):
+        """Best split per request: shares, expected conversions and interval bounds per channel and in total"""
+        np = sdk('numpy')
+        channels = efficiency.shape[1]
+        splits, noise = self.tables()
+        splits = splits[channels]
+        scale = (budgets[:, None] / saturation).astype(np.float32)
+        missed = np.expm1(splits[None] * -scale[:, None, :])  # (requests, candidates, channels): -(share of peak reached)
+        totals = missed @ -(efficiency * saturation).astype(np.float32)[:, :, None]
+        shares = splits[totals[:, :, 0].argmax(axis=1)].astype(np.float64)
+        expected = efficiency * saturation * -np.expm1(-budgets[:, None] * shares / saturation)
         
-        try:
-            # Mock API - replace with actual API
-            response = requests.post(
-                'https://api.example.com/sentiment',
-                headers={'Authorization': f'Bearer {app.config["SENTIMENT_API_KEY"]}'},
-                json={'text': product}
-            )
-            data = response.json()
-            real_time_cache[cache_key] = data
-            return data
-        except:
-            return {
-                "sentiment": "neutral",
-                "confidence": 0.75,
-                "keywords": ["innovative", "competitive", "emerging"]
+        spread = sigma[:, None]
+        channel_bounds = np.stack([
+            expected * np.exp(-self.z * spread - spread ** 2 / 2),
+            expected * np.exp(self.z * spread - spread ** 2 / 2)
+        ])
+        draws = np.exp(sigma[:, None, None] * noise[None, :, :channels] - sigma[:, None, None] ** 2 / 2)
+        tail = (1 - self.interval) / 2
+        total_bounds = np.quantile((draws @ expected[:, :, None])[:, :, 0], [tail, 1 - tail], axis=1)
+        return shares, expected, channel_bounds, total_bounds
+
+    def _summary(self, names, budget, shares, expected, channel_bounds, total_bounds, index, extra=None):
+        breakdown = {}
+        for column, name in enumerate(names):
+            breakdown[name] = {
+                "amount": round(float(budget * shares[index, column]), 2),
+                "share": round(float(shares[index, column]), 4),
+                "expected_conversions": round(float(expected[index, column]), 2),
+                "conversions_interval": [round(float(channel_bounds[0, index, column]), 2), round(float(channel_bounds[1, index, column]), 2)]
             }
+            breakdown[name].update((extra or {}).get(name, {}))
+        return breakdown, {
+            "total_budget": round(budget, 2),
+            "expected_conversions": round(float(expected[index].sum()), 2),
+            "conversions_interval": [round(float(total_bounds[0, index]), 2), round(float(total_bounds[1, index]), 2)],
+            "confidence_level": self.interval,
+            "candidates_evaluated": len(self.tables()[0][len(names)])
+        }
 
-class UserManager:
-    def __init__(self):
-        self.user_data = {}  # In production, use a database
+    def allocate_channels(self, requests):
+        """Split each (budget, sentiment, seo_data) request's budget across marketing channels"""
+        np = sdk('numpy')
+        budgets = np.array([self._budget(budget) for budget, _, _ in requests])
+        efficiency, saturation, sigma = [], [], []
+        for budget, sentiment, seo_data in requests:
+            cpc, lift, difficulty, paid_saturation, spread = self._market(sentiment, seo_data)
+            paid = self.BASE_CONVERSION_RATE / cpc
+            efficiency.append([0.012 * lift, 1.5 * paid * difficulty, 0.01 * lift, paid])
+            saturation.append([3000.0, 5000.0 / difficulty, 4000.0, paid_saturation])
+            sigma.append(spread)
+        shares, expected, channel_bounds, total_bounds = self._optimize(budgets, np.array(efficiency), np.array(saturation), np.array(sigma))
         
-    def check_user(self, user_id):
-        if user_id not in self.user_data:
-            self.user_data[user_id] = {
-                'uses': 0,
-                'paid': False,
-                'customer_id': None,
-                'subscription_id': None
+        allocations = []
+        for index, budget in enumerate(budgets):
+            breakdown, summary = self._summary(self.CHANNELS, float(budget), shares, expected, channel_bounds, total_bounds, index)
+            allocations.append({"allocations": breakdown, **summary})
+        return allocations
+
+    def allocate_platforms(self, requests):
+        """Split each (paid_budget, sentiment, seo_data) request's paid budget across ad platforms"""
+        np = sdk('numpy')
+        budgets = np.array([self._budget(budget) for budget, _, _ in requests])
+        efficiency, saturation, sigma, cpcs = [], [], [], []
+        for budget, sentiment, seo_data in requests:
+            cpc, lift, difficulty, paid_saturation, spread = self._market(sentiment, seo_data)
+            platform_cpc = cpc * np.array(self.PLATFORM_CPC)
+            social = np.array([1.0, lift, lift, 1.0])  # Sentiment moves social platforms only
+            efficiency.append(self.BASE_CONVERSION_RATE * np.array(self.PLATFORM_CONVERSION) * social / platform_cpc)
+            saturation.append(paid_saturation * np.array(self.PLATFORM_REACH))
+            sigma.append(spread)
+            cpcs.append(platform_cpc)
+        shares, expected, channel_bounds, total_bounds = self._optimize(budgets, np.array(efficiency), np.array(saturation), np.array(sigma))
+        
+        strategies = []
+        for index, budget in enumerate(budgets):
+            extra = {
+                name: {"cpc": round(float(cpcs[index][column]), 2), "estimated_clicks": int(budget * shares[index, column] / cpcs[index][column])}
+                for column, name in enumerate(self.PLATFORMS)
             }
-        return self.user_data[user_id]
-    
-    def increment_use(self, user_id):
-        user = self.check_user(user_id)
-        user['uses'] += 1
-        return user['uses']
-    
-    def set_paid(self, user_id, customer_id, subscription_id):
-        user = self.check_user(user_id)
-        user['paid'] = True
-        user['customer_id'] = customer_id
-        user['subscription_id'] = subscription_id
-        return True
+            breakdown, summary = self._summary(self.PLATFORMS, float(budget), shares, expected, channel_bounds, total_bounds, index, extra)
+            strategies.append({
+                "platforms": breakdown,
+                "estimated_clicks": sum(platform['estimated_clicks'] for platform in breakdown.values()),
+                **summary
+            })
+        return strategies
 
-user_manager = UserManager()
+allocation_engine = AllocationEngine(
+    app.config['ALLOCATION_CANDIDATES'],
+    app.config['ALLOCATION_DRAWS'],
+    app.config['ALLOCATION_INTERVAL']
+)
 
 class AdvancedMarketingStrategist:
+    TONES = {'positive': 'enthusiastic', 'negative': 'reassuring'}  # Content tone by market sentiment; otherwise informative
+
     def __init__(self):
-        self.history = []
+        if app.config['USER_DB_PATH']:
+            self.history = SQLiteHistoryStore(
+                app.config['USER_DB_PATH'],
+                app.config['HISTORY_MAX_PER_USER'],
+                app.config['HISTORY_RETENTION_DAYS']
+            )
+        else:
+            self.history = HistoryStore(app.config['HISTORY_MAX_PER_USER'], app.config['HISTORY_RETENTION_DAYS'])
+        self._ai_inflight = {}  # Async mode: cache key -> asyncio.Task
     
-    def generate_strategy(self, product, audience, budget, user_id):
-        user = user_manager.check_user(user_id)
-        if user['uses'] >= app.config['MAX_FREE_USES'] and not user['paid']:
-            return {"error": "Payment required", "payment_required": True}
+    def generate_strategy(self, product, audience, budget, user_id, check_access=True):
+        if check_access:
+            denied = self._check_access(user_id)
+            if denied:
+                return denied
+        
+        try:
+            real_time = RealTimeData.get_all(product, product.split()[0])
+            social_trends = real_time['social_trends']
+            sentiment = real_time['sentiment']
+            seo_data = real_time['seo']
+            
+            ai_strategy = self._cached_ai_strategy(product, audience, budget, social_trends, sentiment, self._plan(user_id))
+            
+            strategy = self._assemble_strategy(product, budget, ai_strategy, social_trends, sentiment, seo_data)
+            self._record(user_id, product, audience, budget, strategy)
+        except BaseException:
+            self._refund(user_id)  # Access was charged up front, by this call or by whoever queued it
+            raise
+        return strategy
+    
+    def generate_strategies(self, items, user_id):
+        """Generate a strategy per item, sharing provider lookups across the batch; only valid items are charged"""
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            missing = missing_fields(item)
+            error = f"Missing fields: {', '.join(missing)}" if missing else budget_error(item['budget'])
+            if error:
+                results[index] = {"index": index, "error": error}
+            else:
+                valid.append((index, item))
+        if not valid:
+            return {"results": results}
         
-        social_trends = RealTimeData.get_social_media_trends()
-        sentiment = RealTimeData.get_market_sentiment(product)
-        seo_data = RealTimeData.get_seo_data(product.split()[0])
+        denied = self._check_access(user_id, count=len(valid))
+        if denied:
+            return denied
         
-        ai_strategy = self._generate_ai_strategy(product, audience, budget, social_trends, sentiment)
+        try:
+            real_time = RealTimeData.get_many(
+                [item['product'] for _, item in valid],
+                [item['product'].split()[0] for _, item in valid]
+            )
+            social_trends = real_time['social_trends']
+            budget_plans = dict(zip(
+                [index for index, _ in valid],
+                self._plan_budgets([
+                    (item['budget'], real_time['sentiment'][item['product']], real_time['seo'][item['product'].split()[0]])
+                    for _, item in valid
+                ])
+            ))
+            plan = self._plan(user_id)
+            
+            def generate(index, item):
+                product, audience, budget = item['product'], item['audience'], item['budget']
+                sentiment = real_time['sentiment'][product]
+                seo_data = real_time['seo'][product.split()[0]]
+                try:
+                    ai_strategy = self._cached_ai_strategy(product, audience, budget, social_trends, sentiment, plan)
+                    strategy = self._assemble_strategy(product, budget, ai_strategy, social_trends, sentiment, seo_data, budget_plans[index])
+                    self._record(user_id, product, audience, budget, strategy)
+                    return {"index": index, "strategy": strategy}
+                except Exception as e:
+                    return {"index": index, "error": str(e)}
+            
+            with ThreadPoolExecutor(max_workers=app.config['BATCH_LLM_CONCURRENCY']) as llm_pool:
+                for result in llm_pool.map(lambda entry: generate(*entry), valid):
+                    results[result['index']] = result
+        except BaseException:
+            self._refund(user_id, len(valid))
+            raise
+        failed = sum(1 for index, _ in valid if 'error' in results[index])
+        if failed:
+            self._refund(user_id, failed)
+        return {"results": results}
+    
+    async def agenerate_strategy(self, product, audience, budget, user_id):
+        """Async counterpart of generate_strategy for the ASGI serving mode"""
+        denied = await asyncio.to_thread(self._check_access, user_id)
+        if denied:
+            return denied
         
-        strategy = {
-            "social_media": self._enhance_social_strategy(ai_strategy.get('social_media', {}), social_trends),
-            "seo": self._enhance_seo_strategy(ai_strategy.get('seo', {}), seo_data),
-            "content": self._enhance_content_strategy(ai_strategy.get('content', {}), sentiment),
-            "paid_advertising": self._generate_paid_ad_strategy(budget, sentiment),
-            "budget_allocation": self._allocate_budget(budget),
+        try:
+            plan = await asyncio.to_thread(self._plan, user_id)
+            real_time = await AsyncRealTimeData.get_all(product, product.split()[0])
+            social_trends = real_time['social_trends']
+            sentiment = real_time['sentiment']
+            seo_data = real_time['seo']
+            
+            ai_strategy = await self._acached_ai_strategy(product, audience, budget, social_trends, sentiment, plan)
+            
+            strategy = self._assemble_strategy(product, budget, ai_strategy, social_trends, sentiment, seo_data)
+            await asyncio.to_thread(self._record, user_id, product, audience, budget, strategy)
+        except BaseException:
+            # Also covers client disconnects, which cancel the request task
+            await asyncio.to_thread(self._refund, user_id)
+            raise
+        return strategy
+    
+    def _assemble_strategy(self, product, budget, ai_strategy, social_trends, sentiment, seo_data, budget_plan=None):
+        budget_allocation, paid_advertising = budget_plan or self._plan_budget(budget, sentiment, seo_data)
+        return {
+            "social_media": self._timed('enhance_social_strategy', self._enhance_social_strategy, ai_strategy.get('social_media', {}), social_trends),
+            "seo": self._timed('enhance_seo_strategy', self._enhance_seo_strategy, ai_strategy.get('seo', {}), seo_data),
+            "content": self._timed('enhance_content_strategy', self._enhance_content_strategy, ai_strategy.get('content', {}), sentiment),
+            "paid_advertising": paid_advertising,
+            "budget_allocation": budget_allocation,
             "real_time_insights": {
                 "market_sentiment": sentiment,
                 "trending_content": social_trends.get('popular_content_types', []),
-                "competitor_analysis": self._get_competitor_analysis(product)
+                "competitor_analysis": self._timed('get_competitor_analysis', self._get_competitor_analysis, product)
             },
             "timestamp": datetime.now().isoformat()
         }
+    
+    @staticmethod
+    def _timed(stage, fn, *args):
+        with metrics.timer(stage):
+            return fn(*args)
+    
+    def _get_competitor_analysis(self, product):
+        """Closest competitor profiles and keywords from the local market index, matched over the whole description"""
+        index = market_index.get()
+        return {
+            "competitors": [
+                {**profile, "relevance": round(score, 3)}
+                for profile, score in index.competitors(product, app.config['COMPETITOR_LIMIT'])
+            ],
+            "related_keywords": [record['keyword'] for record, _ in index.related_keywords(product, 5)]
+        }
+    
+    def _allocate_budget(self, budget, sentiment, seo_data):
+        """Best split of the budget across channels, with conversion confidence intervals"""
+        return allocation_engine.allocate_channels([(budget, sentiment, seo_data)])[0]
+    
+    def _generate_paid_ad_strategy(self, paid_budget, sentiment, seo_data):
+        """Best split of the paid advertising budget across ad platforms"""
+        return allocation_engine.allocate_platforms([(paid_budget, sentiment, seo_data)])[0]
+    
+    def _plan_budget(self, budget, sentiment, seo_data):
+        allocation = self._timed('allocate_budget', self._allocate_budget, budget, sentiment, seo_data)
+        paid_budget = allocation['allocations']['paid_advertising']['amount']
+        return allocation, self._timed('generate_paid_ad_strategy', self._generate_paid_ad_strategy, paid_budget, sentiment, seo_data)
+    
+    def _plan_budgets(self, entries):
+        """_plan_budget for many (budget, sentiment, seo_data) entries in one vectorized pass per stage"""
+        if not entries:
+            return []
+        allocations = self._timed('allocate_budget', allocation_engine.allocate_channels, entries)
+        paid = self._timed('generate_paid_ad_strategy', allocation_engine.allocate_platforms, [
+            (allocation['allocations']['paid_advertising']['amount'], sentiment, seo_data)
+            for allocation, (_, sentiment, seo_data) in zip(allocations, entries)
+        ])
+        return list(zip(allocations, paid))
+    
+    def stream_strategy(self, product, audience, budget, user_id, check_access=True):
+        """Yield strategy sections as events as soon as each one is ready, relaying LLM tokens as they arrive"""
+        if check_access:
+            denied = self._check_access(user_id)
+            if denied:
+                yield {"event": "error", **denied}
+                return
+        
+        strategy = {}
+        def section(name, data):
+            strategy[name] = data
+            return {"event": "section", "section": name, "data": data}
+        
+        try:
+            # The budget is planned from cached or local market data so it streams before the provider fan-out
+            keyword = product.split()[0]
+            budget_allocation, paid_advertising = self._plan_budget(budget, *RealTimeData.peek(product, keyword))
+            yield section("budget_allocation", budget_allocation)
+            yield section("paid_advertising", paid_advertising)
+            
+            real_time = RealTimeData.get_all(product, keyword)
+            social_trends = real_time['social_trends']
+            sentiment = real_time['sentiment']
+            seo_data = real_time['seo']
+            
+            yield section("real_time_insights", {
+                "market_sentiment": sentiment,
+                "trending_content": social_trends.get('popular_content_types', []),
+                "competitor_analysis": self._timed('get_competitor_analysis', self._get_competitor_analysis, product)
+            })
+            
+            args = (product, audience, budget, social_trends, sentiment)
+            request, prompt_tokens, route = self._ai_request(*args, self._plan(user_id))
+            ai_strategy = ai_strategy_cache.get(*args, model=route['model'])
+            if ai_strategy is None:
+                ai_strategy = {}
+                for event in self._stream_ai_strategy(request, prompt_tokens, route):
+                    if event['event'] == 'token':
+                        yield event
+                    else:
+                        ai_strategy = event['data']
+                if ai_strategy:
+                    ai_strategy_cache.set(*args, ai_strategy, model=route['model'])
+                else:
+                    ai_strategy = self._template_ai_strategy(product, social_trends, sentiment)
+            
+            yield section("social_media", self._timed('enhance_social_strategy', self._enhance_social_strategy, ai_strategy.get('social_media', {}), social_trends))
+            yield section("seo", self._timed('enhance_seo_strategy', self._enhance_seo_strategy, ai_strategy.get('seo', {}), seo_data))
+            yield section("content", self._timed('enhance_content_strategy', self._enhance_content_strategy, ai_strategy.get('content', {}), sentiment))
+            
+            strategy = {
+                name: strategy[name]
+                for name in ("social_media", "seo", "content", "paid_advertising", "budget_allocation", "real_time_insights")
+            }
+            strategy["timestamp"] = datetime.now().isoformat()
+            self._record(user_id, product, audience, budget, strategy)
+        except BaseException:
+            self._refund(user_id)  # Includes the client going away (GeneratorExit) before the strategy was recorded
+            raise
+        yield {"event": "done", "timestamp": strategy["timestamp"]}
+    
+    async def _acached_ai_strategy(self, product, audience, budget, social_trends, sentiment, plan='free'):
+        """Async counterpart of _cached_ai_strategy"""
+        args = (product, audience, budget, social_trends, sentiment)
+        request, prompt_tokens, route = self._ai_request(*args, plan)
+        cached = ai_strategy_cache.get(*args, model=route['model'])
+        if cached is not None:
+            return cached
         
+        key = ai_strategy_cache.keys(*args, model=route['model'])[0]
+        task = self._ai_inflight.get(key)
+        if task is None:
+            async def generate():
+                try:
+                    with metrics.timer('generate_ai_strategy'):
+                        result = await self._agenerate_ai_strategy(request, prompt_tokens, route)
+                    if result:
+                        ai_strategy_cache.set(*args, result, model=route['model'])
+                    return result
+                finally:
+                    self._ai_inflight.pop(key, None)
+            task = self._ai_inflight[key] = asyncio.ensure_future(generate())
+        return await asyncio.shield(task) or self._template_ai_strategy(product, social_trends, sentiment)
+    
+    def _generate_ai_strategy(self, request, prompt_tokens, route):
+        try:
+            return llm_router.complete(request, prompt_tokens, route)
+        except Exception:
+            return {}
+    
+    async def _agenerate_ai_strategy(self, request, prompt_tokens, route):
+        try:
+            return await llm_router.acomplete(request, prompt_tokens, route)
+        except Exception:
+            return {}
+    
+    def _stream_ai_strategy(self, request, prompt_tokens, route):
+        """Stream the AI strategy as token events followed by one result event with the parsed JSON"""
+        parts = []
+        usage = None
+        try:
+            with metrics.timer('generate_ai_strategy'):
+                started = time.perf_counter()
+                stream = sdk('openai').chat.completions.create(
+                    **request,
+                    model=route['model'],
+                    timeout=app.config['LLM_TIMEOUT'],
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                for chunk in stream:
+                    usage = getattr(chunk, 'usage', None) or usage
+                    token = chunk.choices[0].delta.content if chunk.choices else None
+                    if token:
+                        parts.append(token)
+                        yield {"event": "token", "text": token}
+                llm_router.record(route['model'], prompt_tokens, usage, time.perf_counter() - started)
+            result = prompt_builder.parse(''.join(parts))
+        except Exception:
+            result = {}
+        yield {"event": "result", "data": result}
+    
+    @staticmethod
+    def _ai_request(product, audience, budget, social_trends, sentiment, plan='free'):
+        """Chat completion arguments for a compact prompt, its token count and the plan's LLM route"""
+        messages, prompt_tokens = prompt_builder.build(product, audience, budget, social_trends, sentiment)
+        route = llm_router.route(plan, prompt_tokens)
+        return {
+            "messages": messages,
+            "response_format": {"type": "json_object"},
+            "max_tokens": route['max_tokens']
+        }, prompt_tokens, route
+    
+    @staticmethod
+    def _template_ai_strategy(product, social_trends, sentiment):
+        """Deterministic strategy sections from provider data, for when the LLM gives nothing usable"""
+        metrics.inc('dacv_llm_fallbacks_total')
+        trends = prompt_builder.project_trends(social_trends)
+        mood = prompt_builder.project_sentiment(sentiment)
+        terms = [term for term, _ in Counter(tokenize(product)).most_common(3)] or ['product']
+        return {
+            'social_media': {
+                'platforms': trends['platforms'][:3],
+                'content_ideas': [f'{kind} about {terms[0]}' for kind in trends['content_types'][:3]],
+                'posting_frequency': '3x per week'
+            },
+            'seo': {
+                'focus_keywords': terms,
+                'content_pillars': [f'{terms[0]} guides', f'{terms[0]} comparisons', f'{terms[0]} reviews']
+            },
+            'content': {
+                'themes': mood['keywords'][:3],
+                'formats': trends['content_types'][:3],
+                'tone': AdvancedMarketingStrategist.TONES.get(mood['sentiment'], 'informative')
+            }
+        }
+    
+    def _check_access(self, user_id, count=1):
+        """Return an error payload if the user may not generate count more strategies"""
+        return quota_manager.acquire(user_id, user_manager.check_user(user_id), count)
+    
+    def _plan(self, user_id):
+        return quota_manager.plan_for(user_manager.check_user(user_id))
+    
+    def _record(self, user_id, product, audience, budget, strategy):
         self.history.append({
             "user_id": user_id,
             "timestamp": strategy["timestamp"],
@@ -170,14 +2692,613 @@ class AdvancedMarketingStrategist:
             "budget": budget,
             "strategy": strategy
         })
+    
+    def _refund(self, user_id, count=1):
+        """Return access charged for strategies that failed before they were delivered"""
+        quota_manager.refund(user_id, count)
+    
+    def _cached_ai_strategy(self, product, audience, budget, social_trends, sentiment, plan='free'):
+        """Reuse a cached AI strategy for matching inputs and model; identical concurrent misses share one LLM call.
+
+        Falls back to the (uncached) template strategy when the LLM gives nothing usable.
+        """
+        args = (product, audience, budget, social_trends, sentiment)
+        request, prompt_tokens, route = self._ai_request(*args, plan)
+        cached = ai_strategy_cache.get(*args, model=route['model'])
+        if cached is not None:
+            return cached
         
-        user_manager.increment_use(user_id)
-        return strategy
+        def generate():
+            with metrics.timer('generate_ai_strategy'):
+                result = self._generate_ai_strategy(request, prompt_tokens, route)
+            if result:
+                ai_strategy_cache.set(*args, result, model=route['model'])
+            return result
+        
+        result = ai_strategy_flight.do(ai_strategy_cache.keys(*args, model=route['model'])[0], generate)
+        return result or self._template_ai_strategy(product, social_trends, sentiment)
+    
+    def get_user_history(self, user_id, cursor=None, limit=None, full=False):
+        """One page of a user's history; summaries omit the strategy payload unless full is set"""
+        limit = max(1, min(limit or app.config['HISTORY_PAGE_SIZE'], app.config['HISTORY_MAX_PAGE_SIZE']))
+        return self.history.page(user_id, cursor=cursor, limit=limit, full=full)
+    
+    @staticmethod
+    def _merge(primary, extra, limit):
+        """Items of primary then extra, without case-insensitive repeats, at most limit of them"""
+        merged, seen = [], set()
+        for item in list(primary or []) + list(extra or []):
+            item = str(item).strip()
+            if item and item.lower() not in seen:
+                seen.add(item.lower())
+                merged.append(item)
+        return merged[:limit]
+    
+    def _enhance_social_strategy(self, ai_social, social_trends):
+        """AI social plan topped up with trending platforms and formats, plus the trend feed's engagement tips"""
+        trends = prompt_builder.project_trends(social_trends)
+        tips = social_trends.get('engagement_tips') if isinstance(social_trends, dict) else None
+        return {
+            "platforms": self._merge(ai_social.get('platforms'), trends['platforms'], 5),
+            "content_ideas": self._merge(ai_social.get('content_ideas'), [f'{kind} series' for kind in trends['content_types']], 5),
+            "posting_frequency": ai_social.get('posting_frequency') or '3x per week',
+            "trending_content_types": trends['content_types'],
+            "engagement_tips": [str(tip) for tip in tips] if isinstance(tips, list) else []
+        }
     
-    # ... [keep all the other methods unchanged] ...
+    def _enhance_seo_strategy(self, ai_seo, seo_data):
+        """AI keywords and pillars joined with the keyword's related searches and market metrics"""
+        seo_data = seo_data if isinstance(seo_data, dict) else {}
+        related = seo_data.get('related_keywords')
+        return {
+            "focus_keywords": self._merge(ai_seo.get('focus_keywords'), related if isinstance(related, list) else [], 8),
+            "content_pillars": self._merge(ai_seo.get('content_pillars'), [], 5),
+            "keyword_difficulty": seo_data.get('keyword_difficulty', 'Medium'),
+            "search_volume": seo_data.get('search_volume'),
+            "cpc": seo_data.get('cpc')
+        }
+    
+    def _enhance_content_strategy(self, ai_content, sentiment):
+        """AI content plan with themes from the market's sentiment keywords and a tone that suits its mood"""
+        mood = prompt_builder.project_sentiment(sentiment)
+        return {
+            "themes": self._merge(ai_content.get('themes'), mood['keywords'], 5),
+            "formats": self._merge(ai_content.get('formats'), [], 5),
+            "tone": ai_content.get('tone') or self.TONES.get(mood['sentiment'], 'informative'),
+            "market_mood": mood['sentiment']
+        }
 
 strategist = AdvancedMarketingStrategist()
 
+# Background strategy generation jobs
+class JobStore:
+    """In-process job records"""
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job['id']] = dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def claim(self, job_id):
+        """Atomically move a queued job to running; None if someone else has it"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != 'queued':
+                return None
+            job.update(status='running', updated_at=datetime.now().isoformat())
+            return dict(job)
+
+    def finish(self, job_id, status, result):
+        with self._lock:
+            self._jobs[job_id].update(status=status, result=result, updated_at=datetime.now().isoformat())
+
+    def recoverable(self, stale_before):
+        return []  # In-process jobs do not outlive the process
+
+class SQLiteJobStore(SQLiteStore):
+    """Durable job records shared by every worker; claims are atomic so each job runs once"""
+    COLUMNS = 'id, user_id, status, priority, payload, result, callback_url, created_at, updated_at'
+
+    def _create_schema(self, conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, '
+            'user_id TEXT NOT NULL, '
+            'status TEXT NOT NULL, '
+            'priority INTEGER NOT NULL, '
+            'payload TEXT NOT NULL, '
+            'result TEXT, '
+            'callback_url TEXT, '
+            'created_at TEXT NOT NULL, '
+            'updated_at TEXT NOT NULL'
+            ')'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated_at)')
+
+    def _to_job(self, row):
+        if row is None:
+            return None
+        job = dict(zip([column.strip() for column in self.COLUMNS.split(',')], row))
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def create(self, job):
+        self._conn().execute(
+            f'INSERT INTO jobs ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job['id'], job['user_id'], job['status'], job['priority'], json.dumps(job['payload']),
+             None, job['callback_url'], job['created_at'], job['updated_at'])
+        )
+
+    def get(self, job_id):
+        return self._to_job(self._conn().execute(f'SELECT {self.COLUMNS} FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def claim(self, job_id):
+        """Atomically move a queued job to running; None if someone else has it"""
+        row = self._conn().execute(
+            f"UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued' RETURNING {self.COLUMNS}",
+            (datetime.now().isoformat(), job_id)
+        ).fetchone()
+        return self._to_job(row)
+
+    def finish(self, job_id, status, result):
+        self._conn().execute(
+            'UPDATE jobs SET status = ?, result = ?, updated_at = ? WHERE id = ?',
+            (status, json.dumps(result, default=str), datetime.now().isoformat(), job_id)
+        )
+
+    def recoverable(self, stale_before):
+        """Queued jobs, plus running jobs whose worker stopped updating them, reset to queued"""
+        conn = self._conn()
+        conn.execute(
+            "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ?",
+            (stale_before,)
+        )
+        rows = conn.execute(f"SELECT {self.COLUMNS} FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+        return [self._to_job(row) for row in rows]
+
+class JobQueue:
+    """Local worker pool for strategy jobs; paid users are scheduled ahead of the free tier"""
+    PRIORITY_PAID = 0
+    PRIORITY_FREE = 1
+
+    def __init__(self, store, workers):
+        self.store = store
+        self.workers = workers
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._threads = []
+        self._callbacks = ThreadPoolExecutor(max_workers=2, thread_name_prefix='job-callback')
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the workers once per process and pick up jobs left by earlier processes"""
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            stale_before = (datetime.now() - timedelta(seconds=app.config['JOB_STALE_AFTER'])).isoformat()
+            for job in self.store.recoverable(stale_before):
+                self._queue.put((job['priority'], next(self._sequence), job['id']))
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, user_id, payload, paid, callback_url=None):
+        self.start()
+        now = datetime.now().isoformat()
+        job = {
+            'id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'status': 'queued',
+            'priority': self.PRIORITY_PAID if paid else self.PRIORITY_FREE,
+            'payload': payload,
+            'result': None,
+            'callback_url': callback_url,
+            'created_at': now,
+            'updated_at': now
+        }
+        self.store.create(job)
+        self._queue.put((job['priority'], next(self._sequence), job['id']))
+        return job['id']
+
+    def depth(self):
+        """Jobs waiting for a worker in this process"""
+        return self._queue.qsize()
+
+    def _work(self):
+        while True:
+            _, _, job_id = self._queue.get()
+            try:
+                job = self.store.claim(job_id)
+                if job is None:
+                    continue
+                try:
+                    payload = job['payload']
+                    result = strategist.generate_strategy(
+                        payload['product'],
+                        payload['audience'],
+                        payload['budget'],
+                        job['user_id'],
+                        check_access=False  # Charged when the job was submitted
+                    )
+                    status = 'failed' if 'error' in result else 'done'
+                except Exception as e:
+                    result, status = {"error": "Server error", "message": str(e)}, 'failed'
+                self.store.finish(job_id, status, result)
+                if job['callback_url']:
+                    self._callbacks.submit(self._deliver, job['callback_url'], {"job_id": job_id, "status": status, "result": result})
+            except Exception:
+                pass  # Keep the worker alive; the job stays visible through /jobs/<id>
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, url, body):
+        """POST the result to the job's callback URL with bounded, jittered retries"""
+        requests = sdk('requests')
+        for attempt in range(app.config['JOB_CALLBACK_RETRIES']):
+            if callback_url_error(url):
+                return  # Checked again at delivery: the host may resolve elsewhere than it did at submit
+            try:
+                response = provider_client.session.post(
+                    url,
+                    json=body,
+                    timeout=app.config['JOB_CALLBACK_TIMEOUT'],
+                    allow_redirects=False  # A redirect could point at an internal host
+                )
+                if response.status_code < 500:
+                    return
+            except requests.RequestException:
+                pass
+            if attempt < app.config['JOB_CALLBACK_RETRIES'] - 1:
+                time.sleep(random.uniform(0, 2 ** attempt))
+
+def callback_url_error(url):
+    """Why url may not receive job callbacks, or None.
+
+    Unless JOB_CALLBACK_ALLOWED_HOSTS lists the host, it must resolve only to public addresses, so callbacks
+    cannot reach loopback, private, link-local (cloud metadata) or other internal services.
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        return 'Callback URL is malformed'
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return 'Callback URL must be an http(s) URL'
+    allowed = app.config['JOB_CALLBACK_ALLOWED_HOSTS']
+    if allowed is not None:
+        return None if parts.hostname in allowed else 'Callback host is not allowed'
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, UnicodeError):
+        return 'Callback host does not resolve'
+    for address in addresses:
+        address = ipaddress.ip_address(address.split('%')[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            return 'Callback host resolves to a non-public address'
+    return None
+
+job_queue = JobQueue(
+    SQLiteJobStore(app.config['USER_DB_PATH']) if app.config['USER_DB_PATH'] else JobStore(),
+    app.config['JOB_WORKERS']
+)
+
+# Stripe webhook events
+class WebhookEventStore:
+    """In-process queue of verified Stripe events"""
+    def __init__(self):
+        self._events = OrderedDict()  # Event id -> record, in arrival order
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        """Queue an event; False if its id has been seen before"""
+        with self._lock:
+            if event['id'] in self._events:
+                return False
+            self._events[event['id']] = {**event, 'status': 'pending', 'updated_at': time.time()}
+            return True
+
+    def claim(self, limit, stale_before):
+        """Pending events, oldest first, of customers with no events in progress"""
+        with self._lock:
+            busy = set()
+            for record in self._events.values():
+                if record['status'] == 'processing':
+                    if record['updated_at'] < stale_before:
+                        record['status'] = 'pending'
+                    else:
+                        busy.add(record['customer_id'])
+            pending = [r for r in self._events.values() if r['status'] == 'pending' and r['customer_id'] not in busy]
+            claimed = sorted(pending, key=lambda r: r['created'])[:limit]
+            for record in claimed:
+                record.update(status='processing', updated_at=time.time())
+            return [dict(record) for record in claimed]
+
+    def latest_processed(self, customer_ids):
+        with self._lock:
+            latest = {}
+            for record in self._events.values():
+                if record['status'] == 'processed' and record['customer_id'] in customer_ids:
+                    latest[record['customer_id']] = max(latest.get(record['customer_id'], 0), record['created'])
+            return latest
+
+    def finish(self, event_ids, retention):
+        with self._lock:
+            now = time.time()
+            for event_id in event_ids:
+                self._events[event_id].update(status='processed', updated_at=now)
+            for event_id in [i for i, r in self._events.items() if r['status'] == 'processed' and r['updated_at'] < now - retention]:
+                del self._events[event_id]
+
+class SQLiteWebhookEventStore(SQLiteStore):
+    """Durable queue of verified Stripe events shared by every worker; the event id primary key de-duplicates retries"""
+    COLUMNS = 'id, type, customer_id, created, payload'
+
+    def _create_schema(self, conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS webhook_events ('
+            'id TEXT NOT NULL UNIQUE, '
+            'type TEXT NOT NULL, '
+            'customer_id TEXT NOT NULL, '
+            'created INTEGER NOT NULL, '
+            'payload TEXT NOT NULL, '
+            'status TEXT NOT NULL, '
+            'updated_at REAL NOT NULL'
+            ')'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS webhook_events_status ON webhook_events (status, created)')
+        conn.execute('CREATE INDEX IF NOT EXISTS webhook_events_customer ON webhook_events (customer_id, status)')
+
+    def add(self, event):
+        cursor = self._conn().execute(
+            f"INSERT OR IGNORE INTO webhook_events ({self.COLUMNS}, status, updated_at) VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+            (event['id'], event['type'], event['customer_id'], event['created'], json.dumps(event['payload']), time.time())
+        )
+        return cursor.rowcount == 1
+
+    def claim(self, limit, stale_before):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                "UPDATE webhook_events SET status = 'pending' WHERE status = 'processing' AND updated_at < ?",
+                (stale_before,)
+            )
+            rows = conn.execute(
+                f"SELECT {self.COLUMNS} FROM webhook_events WHERE status = 'pending' AND customer_id NOT IN "
+                "(SELECT customer_id FROM webhook_events WHERE status = 'processing') "
+                'ORDER BY created, rowid LIMIT ?',
+                (limit,)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE webhook_events SET status = 'processing', updated_at = ? WHERE id = ?",
+                [(time.time(), row[0]) for row in rows]
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return [dict(zip(('id', 'type', 'customer_id', 'created'), row[:4]), payload=json.loads(row[4])) for row in rows]
+
+    def latest_processed(self, customer_ids):
+        customer_ids = list(customer_ids)
+        rows = self._conn().execute(
+            f"SELECT customer_id, MAX(created) FROM webhook_events WHERE status = 'processed' "
+            f"AND customer_id IN ({', '.join('?' * len(customer_ids))}) GROUP BY customer_id",
+            customer_ids
+        ).fetchall()
+        return dict(rows)
+
+    def finish(self, event_ids, retention):
+        conn = self._conn()
+        now = time.time()
+        conn.executemany(
+            "UPDATE webhook_events SET status = 'processed', updated_at = ? WHERE id = ?",
+            [(now, event_id) for event_id in event_ids]
+        )
+        conn.execute("DELETE FROM webhook_events WHERE status = 'processed' AND updated_at < ?", (now - retention,))
+
+class WebhookProcessor:
+    """Applies queued Stripe events in the background, in order per customer, as batched user store updates"""
+    HANDLED_TYPES = ('invoice.payment_succeeded', 'customer.subscription.deleted')
+
+    def __init__(self, store):
+        self.store = store
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='webhook-worker', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, event):
+        """Durably queue a verified event; returns False for duplicates and events we do not act on"""
+        self.start()
+        customer_id = event['data']['object'].get('customer')
+        if event['type'] not in self.HANDLED_TYPES or not customer_id:
+            metrics.inc('dacv_webhook_events_total', type=event['type'], outcome='ignored')
+            return False
+        added = self.store.add({
+            'id': event['id'],
+            'type': event['type'],
+            'customer_id': customer_id,
+            'created': event['created'],
+            'payload': event['data']['object']
+        })
+        metrics.inc('dacv_webhook_events_total', type=event['type'], outcome='queued' if added else 'duplicate')
+        if added:
+            self._wake.set()
+        return added
+
+    def _work(self):
+        while True:
+            self._wake.wait(app.config['WEBHOOK_POLL_INTERVAL'])
+            self._wake.clear()
+            try:
+                while self.process_batch():
+                    pass
+            except Exception:
+                pass  # Claimed events are retried once they go stale
+
+    def process_batch(self):
+        """Apply the next batch of queued events; returns how many were claimed"""
+        events = self.store.claim(
+            app.config['WEBHOOK_BATCH_SIZE'],
+            time.time() - app.config['WEBHOOK_STALE_AFTER']
+        )
+        if not events:
+            return 0
+        
+        latest = self.store.latest_processed({event['customer_id'] for event in events})
+        updates = []
+        for event in events:
+            if event['created'] < latest.get(event['customer_id'], 0):
+                metrics.inc('dacv_webhook_events_total', type=event['type'], outcome='superseded')
+                continue  # A newer event for this customer has already been applied
+            latest[event['customer_id']] = event['created']
+            updates.append(self.to_update(event))
+        with metrics.timer('webhook_apply'):
+            user_manager.update_subscriptions(updates)
+        self.store.finish([event['id'] for event in events], app.config['WEBHOOK_RETENTION_DAYS'] * 86400)
+        for event in events:
+            metrics.inc('dacv_webhook_events_total', type=event['type'], outcome='processed')
+        return len(events)
+
+    @staticmethod
+    def to_update(event):
+        obj = event['payload']
+        if event['type'] == 'customer.subscription.deleted':
+            return 'revoke', event['customer_id'], obj.get('id'), None
+        
+        lines = (obj.get('lines') or {}).get('data') or [{}]
+        price = lines[0].get('price') or {}
+        price_id = price.get('id') if isinstance(price, dict) else price
+        return 'activate', event['customer_id'], obj.get('subscription'), app.config['PRICE_PLANS'].get(price_id)
+
+webhook_processor = WebhookProcessor(
+    SQLiteWebhookEventStore(app.config['USER_DB_PATH']) if app.config['USER_DB_PATH'] else WebhookEventStore()
+)
+
+# Subscription checkout
+_stripe_clients = {}
+
+def stripe_client(call):
+    """StripeClient with the timeouts configured for one kind of call (see STRIPE_TIMEOUTS)"""
+    client = _stripe_clients.get(call)
+    if client is None:
+        stripe = sdk('stripe')
+        client = _stripe_clients[call] = stripe.StripeClient(
+            app.config['STRIPE_SECRET_KEY'],
+            http_client=stripe.RequestsClient(timeout=(app.config['STRIPE_CONNECT_TIMEOUT'], app.config['STRIPE_TIMEOUTS'][call])),
+            base_addresses={'api': app.config['STRIPE_API_BASE']} if app.config['STRIPE_API_BASE'] else None,
+            max_network_retries=app.config['STRIPE_MAX_NETWORK_RETRIES']
+        )
+    return client
+
+class SubscriptionFlow:
+    """Resumable checkout per user and price: new -> customer -> awaiting_payment -> active
+
+    Progress is kept in the shared store and every Stripe write carries an idempotency key, so retried or
+    concurrent requests resume the same checkout instead of creating duplicate customers and subscriptions.
+    The browser confirms the payment; the Stripe webhook or the browser's follow-up request activates the plan.
+    """
+    ACTIVE_STATUSES = ('active', 'trialing')
+    FAILED_STATUSES = ('incomplete_expired', 'canceled', 'unpaid')
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def idempotency_key(step, user_id, price_id, attempt=0):
+        return hashlib.sha256(f'{step}:{user_id}:{price_id}:{attempt}'.encode()).hexdigest()
+
+    def get(self, user_id, price_id):
+        return self.backend.get(f'checkout:{user_id}:{price_id}') or {'state': 'new', 'attempt': 0}
+
+    def save(self, user_id, price_id, flow):
+        self.backend.set(f'checkout:{user_id}:{price_id}', flow, ttl=app.config['CHECKOUT_TTL'])
+        return flow
+
+    def advance(self, user_id, price_id, email):
+        """Run the checkout as far as it goes without waiting for the payment; returns its state"""
+        flow = self.get(user_id, price_id)
+        if flow['state'] == 'active':
+            user = user_manager.check_user(user_id)
+            if not user['paid'] or user['subscription_id'] != flow['subscription_id']:
+                flow = {**flow, 'state': 'customer', 'attempt': flow['attempt'] + 1}  # Cancelled or replaced since; subscribe again
+        
+        if flow['state'] == 'new':
+            customer_id = user_manager.check_user(user_id)['customer_id']
+            if not customer_id:
+                with metrics.timer('stripe_customer_create'):
+                    customer = stripe_client('customer').customers.create(
+                        params={'email': email, 'metadata': {'user_id': user_id}},
+                        options={'idempotency_key': self.idempotency_key('customer', user_id, price_id)}
+                    )
+                customer_id = customer.id
+                user_manager.set_customer(user_id, customer_id)  # Lets webhooks find the user before the payment completes
+            flow = self.save(user_id, price_id, {**flow, 'state': 'customer', 'customer_id': customer_id})
+        
+        if flow['state'] == 'customer':
+            with metrics.timer('stripe_subscription_create'):
+                subscription = stripe_client('subscription').subscriptions.create(
+                    params={
+                        'customer': flow['customer_id'],
+                        'items': [{'price': price_id}],
+                        'expand': ['latest_invoice.payment_intent'],
+                        'payment_behavior': 'default_incomplete',
+                        'payment_settings': {'save_default_payment_method': 'on_subscription'},
+                        'metadata': {'user_id': user_id}
+                    },
+                    options={'idempotency_key': self.idempotency_key('subscription', user_id, price_id, flow['attempt'])}
+                )
+            flow = self.save(user_id, price_id, {
+                **flow,
+                'state': 'awaiting_payment',
+                'subscription_id': subscription.id,
+                'client_secret': subscription.latest_invoice.payment_intent.client_secret
+            })
+            return flow
+        
+        if flow['state'] == 'awaiting_payment':
+            flow = self.sync(user_id, price_id, flow)
+        return flow
+
+    def sync(self, user_id, price_id, flow):
+        """Check whether the browser's payment confirmation has gone through"""
+        user = user_manager.check_user(user_id)
+        if user['paid'] and user['subscription_id'] == flow['subscription_id']:
+            return self.save(user_id, price_id, {**flow, 'state': 'active'})  # Already applied by the webhook worker
+        
+        with metrics.timer('stripe_subscription_retrieve'):
+            subscription = stripe_client('retrieve').subscriptions.retrieve(flow['subscription_id'])
+        if subscription.status in self.ACTIVE_STATUSES:
+            user_manager.set_paid(user_id, flow['customer_id'], subscription.id, plan=app.config['PRICE_PLANS'].get(price_id))
+            return self.save(user_id, price_id, {**flow, 'state': 'active'})
+        if subscription.status in self.FAILED_STATUSES:
+            # Start a fresh subscription on the next request
+            return self.save(user_id, price_id, {**flow, 'state': 'customer', 'attempt': flow['attempt'] + 1})
+        return flow
+
+subscription_flow = SubscriptionFlow(storage)
+
 # HTML Template with Payment UI
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -185,11 +3306,10 @@ HTML_TEMPLATE = """
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <meta name="stripe-public-key" content="{{ STRIPE_PUBLIC_KEY }}">
     <title>DACV Pro Marketing Strategist</title>
     <script src="https://js.stripe.com/v3/"></script>
-    <style>
-        /* [keep all the CSS unchanged] */
-    </style>
+    <link rel="stylesheet" href="/assets/{{ css_filename }}">
 </head>
 <body>
     <header>
@@ -301,242 +3421,1019 @@ HTML_TEMPLATE = """
         </div>
     </div>
     
-    <div id="paymentModal" class="payment-modal">
-        <div class="modal-content">
-            <span class="close-modal" onclick="hidePaymentForm()">&times;</span>
-            <h2>Complete Your Subscription</h2>
-            <p>Enter your payment details to get started</p>
-            
-            <form id="payment-form">
-                <div class="form-group">
-                    <label for="email">Email</label>
-                    <input type="email" id="email" required placeholder="your@email.com">
-                </div>
-                
-                <div class="form-group">
-                    <label for="card-element">Credit or Debit Card</label>
-                    <div id="card-element">
-                        <!-- Stripe Elements will be inserted here -->
-                    </div>
-                    <div id="card-errors" role="alert"></div>
-                </div>
-                
-                <input type="hidden" id="priceId">
-                <button type="submit" class="btn btn-block" id="submitBtn">
-                    <span id="submitBtnText">Subscribe Now</span>
-                </button>
-            </form>
-        </div>
-    </div>
+    <div id="paymentModal" class="payment-modal">
+        <div class="modal-content">
+            <span class="close-modal" onclick="hidePaymentForm()">&times;</span>
+            <h2>Complete Your Subscription</h2>
+            <p>Enter your payment details to get started</p>
+            
+            <form id="payment-form">
+                <div class="form-group">
+                    <label for="email">Email</label>
+                    <input type="email" id="email" required placeholder="your@email.com">
+                </div>
+                
+                <div class="form-group">
+                    <label for="card-element">Credit or Debit Card</label>
+                    <div id="card-element">
+                        <!-- Stripe Elements will be inserted here -->
+                    </div>
+                    <div id="card-errors" role="alert"></div>
+                </div>
+                
+                <input type="hidden" id="priceId">
+                <button type="submit" class="btn btn-block" id="submitBtn">
+                    <span id="submitBtnText">Subscribe Now</span>
+                </button>
+            </form>
+        </div>
+    </div>
+    
+    <script src="/assets/{{ js_filename }}"></script>
+</body>
+</html>
+"""
+
+APP_CSS = """
+:root {
+    --primary: #4361ee;
+    --primary-dark: #3a0ca3;
+    --text: #212529;
+    --muted: #6c757d;
+    --border: #dee2e6;
+    --background: #f5f7fb;
+    --warning-bg: #fff3cd;
+    --warning-text: #856404;
+    --info-bg: #e7f1ff;
+    --info-text: #084298;
+    --error: #dc3545;
+    --radius: 8px;
+}
+
+* {
+    box-sizing: border-box;
+    margin: 0;
+    padding: 0;
+}
+
+body {
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
+    line-height: 1.6;
+    color: var(--text);
+    background: var(--background);
+}
+
+.container {
+    max-width: 1100px;
+    margin: 0 auto;
+    padding: 0 20px;
+}
+
+header {
+    background: linear-gradient(135deg, var(--primary), var(--primary-dark));
+    color: #fff;
+    padding: 40px 0;
+    margin-bottom: 30px;
+    text-align: center;
+}
+
+header h1 {
+    font-size: 2.4rem;
+    margin-bottom: 8px;
+}
+
+.subtitle {
+    font-size: 1.1rem;
+    opacity: 0.9;
+}
+
+h2 {
+    margin-bottom: 16px;
+}
+
+.card {
+    background: #fff;
+    border-radius: var(--radius);
+    box-shadow: 0 4px 20px rgba(0, 0, 0, 0.08);
+    padding: 30px;
+    margin-bottom: 30px;
+}
+
+.tabs {
+    display: flex;
+    border-bottom: 1px solid var(--border);
+    margin-bottom: 24px;
+}
+
+.tab {
+    padding: 12px 20px;
+    cursor: pointer;
+    color: var(--muted);
+    border-bottom: 3px solid transparent;
+    transition: color 0.2s, border-color 0.2s;
+}
+
+.tab:hover {
+    color: var(--primary);
+}
+
+.tab.active {
+    color: var(--primary);
+    border-bottom-color: var(--primary);
+    font-weight: 600;
+}
+
+.tab-content {
+    display: none;
+}
+
+.tab-content.active {
+    display: block;
+}
+
+.form-group {
+    margin-bottom: 20px;
+}
+
+.form-group label {
+    display: block;
+    margin-bottom: 6px;
+    font-weight: 600;
+}
+
+.form-group input,
+.form-group textarea {
+    width: 100%;
+    padding: 12px;
+    border: 1px solid var(--border);
+    border-radius: var(--radius);
+    font: inherit;
+}
+
+.form-group textarea {
+    min-height: 120px;
+    resize: vertical;
+}
+
+.form-group input:focus,
+.form-group textarea:focus {
+    outline: none;
+    border-color: var(--primary);
+    box-shadow: 0 0 0 3px rgba(67, 97, 238, 0.15);
+}
+
+.btn {
+    display: inline-flex;
+    align-items: center;
+    justify-content: center;
+    gap: 8px;
+    padding: 12px 24px;
+    border: 2px solid var(--primary);
+    border-radius: var(--radius);
+    background: var(--primary);
+    color: #fff;
+    font: inherit;
+    font-weight: 600;
+    cursor: pointer;
+    transition: background 0.2s, border-color 0.2s;
+}
+
+.btn:hover {
+    background: var(--primary-dark);
+    border-color: var(--primary-dark);
+}
+
+.btn:disabled {
+    opacity: 0.7;
+    cursor: not-allowed;
+}
+
+.btn-block {
+    display: flex;
+    width: 100%;
+}
+
+.btn-outline {
+    background: transparent;
+    color: var(--primary);
+}
+
+.btn-outline:hover {
+    color: #fff;
+}
+
+.alert {
+    padding: 16px 20px;
+    border-radius: var(--radius);
+    margin: 20px 0;
+}
+
+.alert p {
+    margin-bottom: 10px;
+}
+
+.alert-warning {
+    background: var(--warning-bg);
+    color: var(--warning-text);
+}
+
+.alert-info {
+    background: var(--info-bg);
+    color: var(--info-text);
+}
+
+.hidden {
+    display: none;
+}
+
+.strategy-result {
+    margin-top: 30px;
+    padding-top: 24px;
+    border-top: 1px solid var(--border);
+}
+
+.loading {
+    display: inline-block;
+    width: 16px;
+    height: 16px;
+    border: 2px solid rgba(255, 255, 255, 0.4);
+    border-top-color: #fff;
+    border-radius: 50%;
+    animation: spin 0.8s linear infinite;
+}
+
+@keyframes spin {
+    to {
+        transform: rotate(360deg);
+    }
+}
+
+.pricing-plans {
+    display: grid;
+    grid-template-columns: repeat(auto-fit, minmax(260px, 1fr));
+    gap: 24px;
+    margin-top: 24px;
+}
+
+.plan {
+    display: flex;
+    flex-direction: column;
+    border: 1px solid var(--border);
+    border-radius: var(--radius);
+    padding: 24px;
+    transition: box-shadow 0.2s, transform 0.2s;
+}
+
+.plan:hover {
+    transform: translateY(-4px);
+    box-shadow: 0 8px 24px rgba(0, 0, 0, 0.1);
+}
+
+.plan-header {
+    text-align: center;
+    margin-bottom: 20px;
+}
+
+.plan-title {
+    font-size: 1.3rem;
+}
+
+.plan-price {
+    font-size: 2.2rem;
+    font-weight: 700;
+    color: var(--primary);
+}
+
+.plan-price span {
+    font-size: 1rem;
+    font-weight: 400;
+    color: var(--muted);
+}
+
+.plan-features {
+    list-style: none;
+    flex-grow: 1;
+    margin-bottom: 24px;
+}
+
+.plan-features li {
+    padding: 8px 0;
+    border-bottom: 1px solid var(--border);
+}
+
+.plan-features li::before {
+    content: '\\2713';
+    color: var(--primary);
+    margin-right: 8px;
+}
+
+.payment-modal {
+    display: none;
+    position: fixed;
+    inset: 0;
+    z-index: 1000;
+    align-items: center;
+    justify-content: center;
+    background: rgba(0, 0, 0, 0.5);
+}
+
+.payment-modal.active {
+    display: flex;
+}
+
+.modal-content {
+    position: relative;
+    width: 90%;
+    max-width: 480px;
+    background: #fff;
+    border-radius: var(--radius);
+    padding: 30px;
+}
+
+.modal-content p {
+    color: var(--muted);
+    margin-bottom: 20px;
+}
+
+.close-modal {
+    position: absolute;
+    top: 12px;
+    right: 18px;
+    font-size: 1.6rem;
+    color: var(--muted);
+    cursor: pointer;
+}
+
+#card-element {
+    padding: 12px;
+    border: 1px solid var(--border);
+    border-radius: var(--radius);
+}
+
+#card-errors {
+    color: var(--error);
+    margin-top: 8px;
+    font-size: 0.9rem;
+}
+
+.strategy-section {
+    margin-bottom: 24px;
+}
+
+.strategy-section h3 {
+    color: var(--primary);
+    margin-bottom: 8px;
+}
+
+.strategy-section ul {
+    list-style: none;
+    padding-left: 16px;
+}
+
+.strategy-section li {
+    padding: 2px 0;
+}
+
+.allocation-table {
+    width: 100%;
+    border-collapse: collapse;
+    margin-bottom: 12px;
+}
+
+.allocation-table th,
+.allocation-table td {
+    padding: 8px;
+    border-bottom: 1px solid var(--border);
+    text-align: left;
+}
+
+.strategy-timestamp,
+.history-meta {
+    color: var(--muted);
+    font-size: 0.9rem;
+}
+
+.history-item {
+    padding: 16px 0;
+    border-bottom: 1px solid var(--border);
+}
+
+.history-item .btn {
+    margin-top: 8px;
+}
+
+#loadMoreHistory {
+    margin-top: 16px;
+}
+
+@media (max-width: 600px) {
+    header h1 {
+        font-size: 1.8rem;
+    }
+
+    .card {
+        padding: 20px;
+    }
+
+    .tab {
+        padding: 10px 12px;
+        font-size: 0.9rem;
+    }
+}
+"""
+
+APP_JS = """
+// Initialize Stripe
+const stripe = Stripe(document.querySelector('meta[name="stripe-public-key"]').content);
+const elements = stripe.elements();
+const cardElement = elements.create('card');
+cardElement.mount('#card-element');
+
+// User session
+let userId = localStorage.getItem('marketingStrategistUserId');
+if (!userId) {
+    userId = 'user_' + Math.random().toString(36).substr(2, 9);
+    localStorage.setItem('marketingStrategistUserId', userId);
+}
+
+// Tab navigation
+function openTab(tabName) {
+    document.querySelectorAll('.tab-content').forEach(tab => tab.classList.remove('active'));
+    document.querySelectorAll('.tab').forEach(tab => tab.classList.remove('active'));
+    
+    document.getElementById(tabName).classList.add('active');
+    document.querySelector(`.tab[onclick="openTab('${tabName}')"]`).classList.add('active');
+    
+    if (tabName === 'history') loadUserHistory();
+}
+
+// Form submission
+document.getElementById('strategyForm').addEventListener('submit', function(e) {
+    e.preventDefault();
     
-    <script>
-        // Initialize Stripe
-        const stripe = Stripe('{{ STRIPE_PUBLIC_KEY }}');
-        const elements = stripe.elements();
-        const cardElement = elements.create('card');
-        cardElement.mount('#card-element');
-        
-        // User session
-        let userId = localStorage.getItem('marketingStrategistUserId');
-        if (!userId) {
-            userId = 'user_' + Math.random().toString(36).substr(2, 9);
-            localStorage.setItem('marketingStrategistUserId', userId);
+    const btn = document.getElementById('generateBtn');
+    const btnText = document.getElementById('btnText');
+    
+    btn.disabled = true;
+    btnText.innerHTML = '<div class="loading"></div> Generating Strategy...';
+    
+    fetch('/generate-strategy/stream', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({
+            product: document.getElementById('product').value,
+            audience: document.getElementById('audience').value,
+            budget: parseFloat(document.getElementById('budget').value),
+            user_id: userId
+        })
+    })
+    .then(async response => {
+        const isStream = (response.headers.get('Content-Type') || '').includes('application/x-ndjson');
+        if (!response.ok || !isStream) {
+            // Denials and validation errors arrive as one JSON object instead of a stream
+            let denial = {};
+            try {
+                denial = JSON.parse(await response.text());
+            } catch (e) {}
+            if (denial.payment_required) return showPaywall();
+            if (denial.rate_limited) {
+                const wait = response.headers.get('Retry-After') || denial.retry_after;
+                alert(wait ? `Too many requests. Please try again in ${wait} seconds.` : 'Too many requests. Please try again later.');
+                return;
+            }
+            throw new Error(denial.message || denial.error || 'Request failed: ' + response.status);
         }
         
-        // Tab navigation
-        function openTab(tabName) {
-            document.querySelectorAll('.tab-content').forEach(tab => tab.classList.remove('active'));
-            document.querySelectorAll('.tab').forEach(tab => tab.classList.remove('active'));
-            
-            document.getElementById(tabName).classList.add('active');
-            document.querySelector(`.tab[onclick="openTab('${tabName}')"]`).classList.add('active');
-            
-            if (tabName === 'history') loadUserHistory();
+        // Each line is one event: a finished section, an LLM token, an error or done
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const strategy = {};
+        let buffer = '';
+        
+        const handleEvent = event => {
+            if (event.payment_required) {
+                showPaywall();
+            } else if (event.event === 'section') {
+                strategy[event.section] = event.data;
+                document.getElementById('paymentAlert').classList.add('hidden');
+                displayStrategy(strategy);
+            } else if (event.event === 'done') {
+                strategy.timestamp = event.timestamp;
+                displayStrategy(strategy);
+            }
+        };
+        
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\\n');
+            buffer = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)));
+        }
+        if (buffer.trim()) handleEvent(JSON.parse(buffer));
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('Error generating strategy. Please try again.');
+    })
+    .finally(() => {
+        btn.disabled = false;
+        btnText.textContent = 'Generate Marketing Strategy';
+    });
+});
+
+function showPaywall() {
+    document.getElementById('paymentAlert').classList.remove('hidden');
+    document.getElementById('result').classList.add('hidden');
+}
+
+// Display strategy results
+const SECTION_TITLES = {
+    budget_allocation: 'Budget Allocation',
+    paid_advertising: 'Paid Advertising',
+    real_time_insights: 'Real-Time Market Insights',
+    social_media: 'Social Media Strategy',
+    seo: 'SEO Strategy',
+    content: 'Content Strategy'
+};
+
+function escapeHtml(value) {
+    const div = document.createElement('div');
+    div.textContent = String(value);
+    return div.innerHTML;
+}
+
+function formatLabel(key) {
+    return key.replace(/_/g, ' ').replace(/^./, c => c.toUpperCase());
+}
+
+function formatMoney(amount) {
+    return '$' + Number(amount || 0).toLocaleString(undefined, { maximumFractionDigits: 0 });
+}
+
+// Channel or platform splits: {name: {amount, share, expected_conversions, conversions_interval}}
+function renderAllocations(allocations) {
+    const rows = Object.entries(allocations).map(([name, split]) => `
+        <tr>
+            <td>${escapeHtml(formatLabel(name))}</td>
+            <td>${formatMoney(split.amount)}</td>
+            <td>${Math.round((split.share || 0) * 100)}%</td>
+            <td>${escapeHtml(split.expected_conversions)} (${escapeHtml((split.conversions_interval || []).join(' - '))})</td>
+        </tr>`).join('');
+    return `<table class="allocation-table">
+        <tr><th>Channel</th><th>Budget</th><th>Share</th><th>Expected conversions</th></tr>${rows}
+    </table>`;
+}
+
+function renderValue(value) {
+    if (Array.isArray(value)) {
+        if (value.length && typeof value[0] === 'object') {
+            return '<ul>' + value.map(item => `<li>${renderValue(item)}</li>`).join('') + '</ul>';
+        }
+        return escapeHtml(value.join(', '));
+    }
+    if (value && typeof value === 'object') {
+        return '<ul>' + Object.entries(value)
+            .filter(([, item]) => item !== null && item !== undefined)
+            .map(([key, item]) => `<li><strong>${escapeHtml(formatLabel(key))}:</strong> ${renderValue(item)}</li>`)
+            .join('') + '</ul>';
+    }
+    return escapeHtml(value);
+}
+
+function renderSection(name, data) {
+    let body;
+    if (name === 'budget_allocation' || name === 'paid_advertising') {
+        const { allocations, platforms, ...summary } = data;
+        body = renderAllocations(allocations || platforms || {}) + renderValue(summary);
+    } else {
+        body = renderValue(data);
+    }
+    return `<div class="strategy-section"><h3>${SECTION_TITLES[name]}</h3>${body}</div>`;
+}
+
+function displayStrategy(strategy) {
+    const resultDiv = document.getElementById('result');
+    const contentDiv = document.getElementById('strategyContent');
+    contentDiv.innerHTML = '';
+    
+    // Sections render as they stream in, in a fixed order
+    contentDiv.innerHTML = Object.keys(SECTION_TITLES)
+        .filter(name => strategy[name])
+        .map(name => renderSection(name, strategy[name]))
+        .join('');
+    if (strategy.timestamp) {
+        contentDiv.innerHTML += `<p class="strategy-timestamp">Generated ${escapeHtml(new Date(strategy.timestamp).toLocaleString())}</p>`;
+    }
+    
+    resultDiv.classList.remove('hidden');
+    openTab('strategy');
+}
+
+// Strategy history, newest first, a page at a time
+function loadUserHistory(cursor) {
+    const historyDiv = document.getElementById('historyContent');
+    const params = new URLSearchParams({ user_id: userId, limit: 10 });
+    if (cursor) params.set('cursor', cursor);
+    
+    fetch('/get-user-history?' + params)
+        .then(response => {
+            if (!response.ok) throw new Error('Request failed: ' + response.status);
+            return response.json();
+        })
+        .then(({ items, next_cursor }) => {
+            if (!cursor) historyDiv.innerHTML = '';
+            document.getElementById('loadMoreHistory')?.remove();
+            if (!cursor && !items.length) {
+                historyDiv.innerHTML = '<p>You have not generated any strategies yet.</p>';
+                return;
+            }
+            items.forEach(item => {
+                const entry = document.createElement('div');
+                entry.className = 'history-item';
+                entry.innerHTML = `
+                    <h3>${escapeHtml(item.product)}</h3>
+                    <p class="history-meta">${escapeHtml(item.audience)} &middot; ${formatMoney(item.budget)}/month &middot; ${escapeHtml(new Date(item.timestamp).toLocaleString())}</p>
+                    <button class="btn btn-outline">View Strategy</button>`;
+                entry.querySelector('button').addEventListener('click', () => viewHistoryItem(item.id));
+                historyDiv.appendChild(entry);
+            });
+            if (next_cursor) {
+                const more = document.createElement('button');
+                more.id = 'loadMoreHistory';
+                more.className = 'btn btn-outline btn-block';
+                more.textContent = 'Load More';
+                more.addEventListener('click', () => loadUserHistory(next_cursor));
+                historyDiv.appendChild(more);
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            historyDiv.innerHTML = '<p>Could not load your strategy history. Please try again.</p>';
+        });
+}
+
+// Summaries omit the strategy, so fetch the one entry in full: the page of one item just older than id + 1
+function viewHistoryItem(id) {
+    const params = new URLSearchParams({ user_id: userId, view: 'full', limit: 1, cursor: id + 1 });
+    fetch('/get-user-history?' + params)
+        .then(response => response.json())
+        .then(({ items }) => {
+            if (items.length && items[0].strategy) displayStrategy(items[0].strategy);
+        });
+}
+
+// Payment form handling
+function showPaymentForm(priceId) {
+    document.getElementById('priceId').value = priceId;
+    document.getElementById('paymentModal').classList.add('active');
+    document.getElementById('card-errors').textContent = '';
+}
+
+function hidePaymentForm() {
+    document.getElementById('paymentModal').classList.remove('active');
+}
+
+// Handle payment form submission
+const paymentForm = document.getElementById('payment-form');
+paymentForm.addEventListener('submit', async (e) => {
+    e.preventDefault();
+    
+    const submitBtn = document.getElementById('submitBtn');
+    const submitBtnText = document.getElementById('submitBtnText');
+    const email = document.getElementById('email').value;
+    
+    if (!email) {
+        document.getElementById('card-errors').textContent = 'Please enter your email';
+        return;
+    }
+    
+    submitBtn.disabled = true;
+    submitBtnText.innerHTML = '<div class="loading"></div> Processing...';
+    
+    try {
+        // Create payment method
+        const { paymentMethod, error: pmError } = await stripe.createPaymentMethod({
+            type: 'card',
+            card: cardElement,
+            billing_details: { email: email }
+        });
+        
+        if (pmError) throw pmError;
+        
+        // Create subscription
+        const response = await fetch('/create-subscription', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                payment_method_id: paymentMethod.id,
+                price_id: document.getElementById('priceId').value,
+                user_id: userId,
+                email: email
+            })
+        });
+        
+        const data = await response.json();
+        
+        if (!response.ok) {
+            throw new Error(data.error || 'Subscription creation failed');
         }
         
-        // Form submission
-        document.getElementById('strategyForm').addEventListener('submit', function(e) {
-            e.preventDefault();
-            
-            const btn = document.getElementById('generateBtn');
-            const btnText = document.getElementById('btnText');
+        // Confirm the payment
+        let subscription = data;
+        if (data.status === 'requires_payment') {
+            const { paymentIntent, error: confirmError } = await stripe.confirmCardPayment(
+                data.client_secret, {
+                    payment_method: paymentMethod.id
+                }
+            );
             
-            btn.disabled = true;
-            btnText.innerHTML = '<div class="loading"></div> Generating Strategy...';
+            if (confirmError) throw confirmError;
+            if (paymentIntent.status !== 'succeeded') throw new Error('Payment processing failed');
             
-            fetch('/generate-strategy', {
+            // Resume the checkout so the plan is active before the webhook arrives
+            const completed = await fetch('/create-subscription', {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
                 body: JSON.stringify({
-                    product: document.getElementById('product').value,
-                    audience: document.getElementById('audience').value,
-                    budget: parseFloat(document.getElementById('budget').value),
-                    user_id: userId
+                    price_id: document.getElementById('priceId').value,
+                    user_id: userId,
+                    email: email
                 })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.error === "Payment required") {
-                    document.getElementById('paymentAlert').classList.remove('hidden');
-                    document.getElementById('result').classList.add('hidden');
-                } else {
-                    document.getElementById('paymentAlert').classList.add('hidden');
-                    displayStrategy(data);
-                }
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                alert('Error generating strategy. Please try again.');
-            })
-            .finally(() => {
-                btn.disabled = false;
-                btnText.textContent = 'Generate Marketing Strategy';
             });
-        });
-        
-        // Display strategy results
-        function displayStrategy(strategy) {
-            const resultDiv = document.getElementById('result');
-            const contentDiv = document.getElementById('strategyContent');
-            contentDiv.innerHTML = '';
-            
-            // [Keep all the displayStrategy code unchanged]
-            
-            resultDiv.classList.remove('hidden');
-            openTab('strategy');
-        }
-        
-        // Payment form handling
-        function showPaymentForm(priceId) {
-            document.getElementById('priceId').value = priceId;
-            document.getElementById('paymentModal').classList.add('active');
-            document.getElementById('card-errors').textContent = '';
+            subscription = await completed.json();
         }
         
-        function hidePaymentForm() {
-            document.getElementById('paymentModal').classList.remove('active');
-        }
-        
-        // Handle payment form submission
-        const paymentForm = document.getElementById('payment-form');
-        paymentForm.addEventListener('submit', async (e) => {
-            e.preventDefault();
-            
-            const submitBtn = document.getElementById('submitBtn');
-            const submitBtnText = document.getElementById('submitBtnText');
-            const email = document.getElementById('email').value;
-            
-            if (!email) {
-                document.getElementById('card-errors').textContent = 'Please enter your email';
-                return;
-            }
+        if (subscription.success) {
+            hidePaymentForm();
             
-            submitBtn.disabled = true;
-            submitBtnText.innerHTML = '<div class="loading"></div> Processing...';
+            // Show success message
+            const alertDiv = document.createElement('div');
+            alertDiv.className = 'alert alert-info';
+            alertDiv.innerHTML = `
+                <p>Payment successful! You can now generate unlimited strategies.</p>
+                <p>Subscription ID: ${subscription.subscription_id}</p>
+            `;
+            document.getElementById('strategy').prepend(alertDiv);
             
-            try {
-                // Create payment method
-                const { paymentMethod, error: pmError } = await stripe.createPaymentMethod({
-                    type: 'card',
-                    card: cardElement,
-                    billing_details: { email: email }
-                });
-                
-                if (pmError) throw pmError;
-                
-                // Create subscription
-                const response = await fetch('/create-subscription', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        payment_method_id: paymentMethod.id,
-                        price_id: document.getElementById('priceId').value,
-                        user_id: userId,
-                        email: email
-                    })
-                });
-                
-                const data = await response.json();
-                
-                if (!response.ok) {
-                    throw new Error(data.error || 'Subscription creation failed');
-                }
-                
-                // Confirm the payment
-                const { paymentIntent, error: confirmError } = await stripe.confirmCardPayment(
-                    data.client_secret, {
-                        payment_method: paymentMethod.id
-                    }
-                );
-                
-                if (confirmError) throw confirmError;
-                
-                if (paymentIntent.status === 'succeeded') {
-                    hidePaymentForm();
-                    
-                    // Show success message
-                    const alertDiv = document.createElement('div');
-                    alertDiv.className = 'alert alert-info';
-                    alertDiv.innerHTML = `
-                        <p>Payment successful! You can now generate unlimited strategies.</p>
-                        <p>Subscription ID: ${data.subscription_id}</p>
-                    `;
-                    document.getElementById('strategy').prepend(alertDiv);
-                    
-                    document.getElementById('paymentAlert').classList.add('hidden');
-                    
-                    // Refresh user status
-                    fetch('/check-user-usage?user_id=' + userId)
-                        .then(response => response.json())
-                        .then(data => {
-                            if (data.paid) {
-                                document.getElementById('paymentAlert').classList.add('hidden');
-                            }
-                        });
-                } else {
-                    throw new Error('Payment processing failed');
-                }
-            } catch (error) {
-                console.error('Payment error:', error);
-                document.getElementById('card-errors').textContent = error.message || 'Payment failed. Please try again.';
-            } finally {
-                submitBtn.disabled = false;
-                submitBtnText.textContent = 'Subscribe Now';
-            }
-        });
-        
-        // Load history on page load
-        document.addEventListener('DOMContentLoaded', function() {
-            if (window.location.hash === '#history') openTab('history');
-            if (window.location.hash === '#pricing') openTab('pricing');
+            document.getElementById('paymentAlert').classList.add('hidden');
             
-            // Check user usage
+            // Refresh user status
             fetch('/check-user-usage?user_id=' + userId)
                 .then(response => response.json())
                 .then(data => {
-                    if (data.uses_left <= 0 && !data.paid) {
-                        document.getElementById('paymentAlert').classList.remove('hidden');
+                    if (data.paid) {
+                        document.getElementById('paymentAlert').classList.add('hidden');
                     }
                 });
+        } else {
+            throw new Error('Payment processing failed');
+        }
+    } catch (error) {
+        console.error('Payment error:', error);
+        document.getElementById('card-errors').textContent = error.message || 'Payment failed. Please try again.';
+    } finally {
+        submitBtn.disabled = false;
+        submitBtnText.textContent = 'Subscribe Now';
+    }
+});
+
+// Load history on page load
+document.addEventListener('DOMContentLoaded', function() {
+    if (window.location.hash === '#history') openTab('history');
+    if (window.location.hash === '#pricing') openTab('pricing');
+    
+    // Check user usage
+    fetch('/check-user-usage?user_id=' + userId)
+        .then(response => response.json())
+        .then(data => {
+            if (data.uses_left <= 0 && !data.paid) {
+                document.getElementById('paymentAlert').classList.remove('hidden');
+            }
         });
-    </script>
-</body>
-</html>
+});
 """
 
+# Landing page and static assets
+class StaticAsset:
+    """Prebuilt response body with a content hash, weak ETag and precompressed gzip/brotli variants"""
+    def __init__(self, name, body, mimetype):
+        self.body = body.encode()
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(self.body).hexdigest()[:16]
+        root, ext = name.rsplit('.', 1)
+        self.filename = f'{root}.{self.digest}.{ext}'
+        self.variants = {'gzip': gzip.compress(self.body, 9)}
+        try:
+            import brotli
+            self.variants['br'] = brotli.compress(self.body, quality=11)
+        except ImportError:
+            pass
+
+    def response(self, cache_control):
+        headers = {'Cache-Control': cache_control, 'ETag': f'W/"{self.digest}"', 'Vary': 'Accept-Encoding'}
+        if request.if_none_match.contains_weak(self.digest):
+            return Response(status=304, headers=headers)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and request.accept_encodings[encoding]:
+                headers['Content-Encoding'] = encoding
+                return Response(self.variants[encoding], mimetype=self.mimetype, headers=headers)
+        return Response(self.body, mimetype=self.mimetype, headers=headers)
+
+static_assets = {
+    asset.filename: asset
+    for asset in (StaticAsset('app.css', APP_CSS, 'text/css'), StaticAsset('app.js', APP_JS, 'application/javascript'))
+}
+landing_template = app.jinja_env.from_string(HTML_TEMPLATE)  # Compiled once; rendered once per Stripe key
+_landing_pages = {}
+
+def landing_page():
+    public_key = app.config['STRIPE_PUBLIC_KEY']
+    page = _landing_pages.get(public_key)
+    if page is None:
+        filenames = {asset.mimetype: asset.filename for asset in static_assets.values()}
+        page = _landing_pages[public_key] = StaticAsset('index.html', landing_template.render(
+            STRIPE_PUBLIC_KEY=public_key,
+            css_filename=filenames['text/css'],
+            js_filename=filenames['application/javascript']
+        ), 'text/html')
+    return page
+
+# Response encoding
+class ResponseEncoder:
+    """Negotiated API responses: JSON, MessagePack or CBOR by Accept, zstd/brotli/gzip by Accept-Encoding"""
+    def __init__(self, min_compress_bytes):
+        self.min_compress_bytes = min_compress_bytes
+        self.formats = {'application/json': self.dumps_json}
+        self.compressors = {'gzip': lambda body: gzip.compress(body, 6)}
+        try:
+            import msgpack
+            self.formats['application/msgpack'] = self.formats['application/x-msgpack'] = (
+                lambda payload: msgpack.packb(payload, default=str)
+            )
+        except ImportError:
+            pass
+        try:
+            import cbor2
+            self.formats['application/cbor'] = lambda payload: cbor2.dumps(
+                payload, default=lambda encoder, value: encoder.encode(str(value))
+            )
+        except ImportError:
+            pass
+        try:
+            import zstandard
+            self.compressors['zstd'] = lambda body: zstandard.compress(body, 3)
+        except ImportError:
+            pass
+        try:
+            import brotli
+            self.compressors['br'] = lambda body: brotli.compress(body, quality=5)
+        except ImportError:
+            pass
+
+    @staticmethod
+    def dumps_json(payload):
+        if orjson is not None:
+            return orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(payload, default=str, separators=(',', ':')).encode()
+
+    def response(self, payload, status=200):
+        mimetype = request.accept_mimetypes.best_match(list(self.formats), default='application/json')
+        with metrics.timer('encode_response'):
+            body = self.formats[mimetype](payload)
+        headers = {'Vary': 'Accept, Accept-Encoding'}
+        if len(body) >= self.min_compress_bytes:
+            for encoding in ('zstd', 'br', 'gzip'):
+                if encoding in self.compressors and request.accept_encodings[encoding]:
+                    with metrics.timer('compress_response'):
+                        body = self.compressors[encoding](body)
+                    headers['Content-Encoding'] = encoding
+                    break
+        return Response(body, status=status, mimetype=mimetype, headers=headers)
+
+response_encoder = ResponseEncoder(app.config['RESPONSE_COMPRESS_MIN_BYTES'])
+
+def dedupe_history(history):
+    """Replace strategy sections repeated across history items with {"$ref": i} pointing into a shared refs list"""
+    refs, seen = [], {}
+    
+    def share(value):
+        if not isinstance(value, (dict, list)) or not value:
+            return value
+        key = ResponseEncoder.dumps_json(value)
+        if key not in seen:
+            seen[key] = len(refs)
+            refs.append(value)
+        return {"$ref": seen[key]}
+    
+    items = []
+    for item in history['items']:
+        strategy = item.get('strategy')
+        if isinstance(strategy, dict):
+            shared = {}
+            for name, section in strategy.items():
+                if name == 'real_time_insights' and isinstance(section, dict):
+                    shared[name] = {key: share(value) for key, value in section.items()}
+                else:
+                    shared[name] = share(section)
+            item = {**item, 'strategy': shared}
+        items.append(item)
+    return {**history, 'items': items, 'refs': refs}
+
 # Flask Routes
+@app.before_request
+def start_background_workers():
+    """Start job and webhook workers once per process on its first request, after any pre-fork, so jobs and
+    events left behind by dead workers are recovered at boot rather than on the first submit"""
+    job_queue.start()
+    webhook_processor.start()
+
 @app.route('/')
 def home():
-    return render_template_string(HTML_TEMPLATE, STRIPE_PUBLIC_KEY=app.config['STRIPE_PUBLIC_KEY'])
+    return landing_page().response('no-cache')
+
+@app.route('/assets/<filename>')
+def static_asset(filename):
+    asset = static_assets.get(filename)
+    if asset is None:
+        return jsonify({"error": "Not found"}), 404
+    return asset.response(f"public, max-age={app.config['ASSET_MAX_AGE']}, immutable")
+
+def ip_rate_limit():
+    return app.config['IP_RATE_LIMIT']
+
+def missing_fields(data):
+    """Strategy request fields that are absent or empty; the product must also be a non-blank string"""
+    if not isinstance(data, dict):
+        return ['product', 'audience', 'budget']
+    missing = [field for field in ('product', 'audience', 'budget') if not data.get(field)]
+    if 'product' not in missing and not (isinstance(data['product'], str) and data['product'].split()):
+        missing.insert(0, 'product')
+    return missing
+
+def budget_error(budget):
+    """Why budget is not a usable amount, or None"""
+    try:
+        value = float(budget)
+    except (TypeError, ValueError):
+        return 'Budget must be a number'
+    if isinstance(budget, bool) or not math.isfinite(value) or value <= 0:
+        return 'Budget must be a positive, finite number'
+    return None
+
+def denied_response(denied):
+    """Serialize an access error, as 429 with Retry-After when the user is over their request rate"""
+    if not denied.get('rate_limited'):
+        return jsonify(denied)
+    response = jsonify(denied)
+    response.status_code = 429
+    if denied['retry_after'] is not None:
+        response.headers['Retry-After'] = str(denied['retry_after'])
+    return response
+
+def denied_stream_response(denied):
+    """An access error as the stream's one compact NDJSON error event: 402 when payment is required, else 429"""
+    response = Response(
+        json.dumps({"event": "error", **denied}) + '\n',
+        status=429 if denied.get('rate_limited') else 402,
+        mimetype='application/x-ndjson'
+    )
+    if denied.get('retry_after') is not None:
+        response.headers['Retry-After'] = str(denied['retry_after'])
+    return response
 
 @app.route('/generate-strategy', methods=['POST'])
-@limiter.limit("5 per minute")
+@limiter.limit(ip_rate_limit)
 def generate_strategy():
     data = request.json
     user_id = data.get('user_id')
     
     if not user_id:
         return jsonify({"error": "User ID required"}), 400
+    missing = missing_fields(data)
+    if missing:
+        return jsonify({"error": f"Missing fields: {', '.join(missing)}"}), 400
+    error = budget_error(data['budget'])
+    if error:
+        return jsonify({"error": "Invalid budget", "message": error}), 400
+    
+    if request.args.get('async') == '1':
+        callback_url = data.get('callback_url')
+        if callback_url:
+            error = callback_url_error(callback_url) if isinstance(callback_url, str) else 'Callback URL must be a string'
+            if error:
+                return jsonify({"error": "Invalid callback URL", "message": error}), 400
+        denied = strategist._check_access(user_id)
+        if denied:
+            return denied_response(denied)
+        job_id = job_queue.submit(
+            user_id,
+            {'product': data['product'], 'audience': data['audience'], 'budget': data['budget']},
+            paid=user_manager.check_user(user_id)['paid'],
+            callback_url=callback_url
+        )
+        return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}), 202
     
     strategy = strategist.generate_strategy(
         data['product'],
@@ -545,7 +4442,74 @@ def generate_strategy():
         user_id
     )
     
-    return jsonify(strategy)
+    if strategy.get('rate_limited'):
+        return denied_response(strategy)
+    return response_encoder.response(strategy)
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_queue.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    return response_encoder.response({
+        "job_id": job['id'],
+        "status": job['status'],
+        "result": job['result'],
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at']
+    })
+
+@app.route('/generate-strategy/stream', methods=['POST'])
+@limiter.limit(ip_rate_limit)
+def generate_strategy_stream():
+    data = request.json
+    user_id = data.get('user_id')
+    
+    if not user_id:
+        return jsonify({"error": "User ID required"}), 400
+    missing = missing_fields(data)
+    if missing:
+        return jsonify({"error": f"Missing fields: {', '.join(missing)}"}), 400
+    error = budget_error(data['budget'])
+    if error:
+        return jsonify({"error": "Invalid budget", "message": error}), 400
+    
+    # Denials get a real status code (402, or 429 with Retry-After) instead of an error event in a 200 stream
+    denied = strategist._check_access(user_id)
+    if denied:
+        return denied_stream_response(denied)
+    events = strategist.stream_strategy(
+        data['product'],
+        data['audience'],
+        data['budget'],
+        user_id,
+        check_access=False
+    )
+    return Response(
+        stream_with_context(json.dumps(event) + '\n' for event in events),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/generate-strategies/batch', methods=['POST'])
+@limiter.limit("10 per minute")
+def generate_strategies_batch():
+    data = request.json
+    user_id = data.get('user_id')
+    items = data.get('items')
+    
+    if not user_id:
+        return jsonify({"error": "User ID required"}), 400
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Items required"}), 400
+    if len(items) > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({"error": f"At most {app.config['BATCH_MAX_ITEMS']} items per batch"}), 400
+    
+    results = strategist.generate_strategies(items, user_id)
+    if results.get('rate_limited'):
+        return denied_response(results)
+    return response_encoder.response(results)
 
 @app.route('/get-user-history')
 def get_user_history():
@@ -553,8 +4517,17 @@ def get_user_history():
     if not user_id:
         return jsonify({"error": "User ID required"}), 400
     
-    history = strategist.get_user_history(user_id)
-    return jsonify(history)
+    paging = {}
+    for name in ('cursor', 'limit'):
+        value = request.args.get(name)
+        if value is not None and not value.isdecimal():
+            return jsonify({"error": f"Invalid {name}"}), 400
+        paging[name] = int(value) if value is not None else None
+    
+    history = strategist.get_user_history(user_id, full=request.args.get('view') == 'full', **paging)
+    if request.args.get('dedupe') == '1':
+        history = dedupe_history(history)
+    return response_encoder.response(history)
 
 @app.route('/check-user-usage')
 def check_user_usage():
@@ -565,60 +4538,73 @@ def check_user_usage():
     user = user_manager.check_user(user_id)
     return jsonify({
         "uses_left": max(0, app.config['MAX_FREE_USES'] - user['uses']),
-        "paid": user['paid']
+        "paid": user['paid'],
+        "plan": quota_manager.plan_for(user)
     })
 
+@app.route('/cache-stats')
+def cache_stats():
+    return jsonify({**real_time_cache.stats(), "warmer": cache_warmer.stats()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    extra = []
+    for name, cache in (('real_time', real_time_cache), ('ai_strategy', ai_strategy_cache.cache)):
+        for namespace, counters in cache.stats()['namespaces'].items():
+            lookups = counters['hits'] + counters['stale_hits'] + counters['misses']
+            for counter in ('hits', 'stale_hits', 'misses', 'evictions'):
+                extra.append(('counter', f'dacv_cache_{counter}_total', counters[counter], {'cache': name, 'namespace': namespace}))
+            extra.append(('gauge', 'dacv_cache_hit_ratio', counters['hits'] / lookups if lookups else 0, {'cache': name, 'namespace': namespace}))
+    for provider, breaker in list(provider_client.breakers.items()):
+        extra.append(('gauge', 'dacv_circuit_open', 0 if breaker.state == 'closed' else 1, {'provider': provider}))
+    extra.append(('counter', 'dacv_cache_warmer_refreshes_total', cache_warmer.refreshes, {}))
+    extra.append(('gauge', 'dacv_job_queue_depth', job_queue.depth(), {}))
+    for phase, seconds in list(startup_timings.items()):
+        extra.append(('gauge', 'dacv_startup_seconds', seconds, {'phase': phase}))
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
 @app.route('/create-subscription', methods=['POST'])
 def create_subscription():
     data = request.json
     user_id = data.get('user_id')
+    price_id = data.get('price_id')
     
+    if not user_id or price_id not in app.config['PRICE_PLANS']:
+        return jsonify({"error": "User ID and a valid price ID required"}), 400
+    
+    stripe = sdk('stripe')
     try:
-        # Create customer in Stripe
-        customer = stripe.Customer.create(
-            email=data['email'],
-            payment_method=data['payment_method_id'],
-            invoice_settings={
-                'default_payment_method': data['payment_method_id']
-            }
-        )
-        
-        # Create subscription
-        subscription = stripe.Subscription.create(
-            customer=customer.id,
-            items=[{'price': data['price_id']}],
-            expand=['latest_invoice.payment_intent'],
-            payment_behavior='default_incomplete',
-            payment_settings={
-                'save_default_payment_method': 'on_subscription'
-            }
-        )
+        flow = subscription_flow.advance(user_id, price_id, data.get('email'))
         
-        # Confirm the payment intent
-        payment_intent = stripe.PaymentIntent.confirm(
-            subscription.latest_invoice.payment_intent.id,
-            payment_method=data['payment_method_id']
-        )
-        
-        if payment_intent.status == 'succeeded':
-            # Mark user as paid
-            user_manager.set_paid(user_id, customer.id, subscription.id)
+        if flow['state'] == 'active':
             return jsonify({
                 "success": True,
-                "subscription_id": subscription.id,
-                "client_secret": payment_intent.client_secret
+                "status": "active",
+                "subscription_id": flow['subscription_id']
             })
-        else:
+        if flow['state'] == 'awaiting_payment':
+            # The browser confirms the payment, then calls again (or the webhook) to activate the plan
             return jsonify({
-                "error": "Payment failed",
-                "message": payment_intent.last_payment_error or "Payment could not be processed"
-            }), 400
+                "success": True,
+                "status": "requires_payment",
+                "subscription_id": flow['subscription_id'],
+                "client_secret": flow['client_secret']
+            }), 202
+        return jsonify({
+            "error": "Payment failed",
+            "message": "Payment could not be processed"
+        }), 400
             
     except stripe.error.CardError as e:
         return jsonify({
             "error": "Card error",
             "message": e.user_message
         }), 400
+    except stripe.error.APIConnectionError:
+        return jsonify({
+            "error": "Stripe unavailable",
+            "message": "Please retry; your checkout will resume where it stopped"
+        }), 503
     except stripe.error.StripeError as e:
         return jsonify({
             "error": "Stripe error",
@@ -637,6 +4623,7 @@ def stripe_webhook():
     sig_header = request.headers.get('Stripe-Signature')
     event = None
     
+    stripe = sdk('stripe')
     try:
         event = stripe.Webhook.construct_event(
             payload, sig_header, app.config['STRIPE_WEBHOOK_SECRET']
@@ -646,15 +4633,126 @@ def stripe_webhook():
     except stripe.error.SignatureVerificationError as e:
         return jsonify({'error': str(e)}), 400
     
-    # Handle subscription events
-    if event['type'] == 'invoice.payment_succeeded':
-        # Handle successful recurring payment
-        pass
-    elif event['type'] == 'customer.subscription.deleted':
-        # Handle subscription cancellation
-        pass
+    # Acknowledge once queued; subscription changes are applied by the webhook worker
+    webhook_processor.enqueue(event.to_dict())
     
     return jsonify({'success': True})
 
+# Async serving mode: uvicorn index:create_asgi_app --factory
+class AsyncApp:
+    """ASGI entry point: strategy generation runs natively async, every other route is served by the Flask app"""
+    def __init__(self, flask_app):
+        from asgiref.wsgi import WsgiToAsgi
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.routes = {('POST', '/generate-strategy'): self.generate_strategy}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        handler = self.routes.get((scope.get('method'), scope.get('path')))
+        if scope['type'] != 'http' or handler is None:
+            return await self.wsgi(scope, receive, send)
+        await handler(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                job_queue.start()
+                webhook_processor.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_provider_client.aclose()
+                if _async_openai_client is not None:
+                    await _async_openai_client.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def read_json(receive):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        return json.loads(body or b'null')
+
+    @staticmethod
+    async def send_json(send, payload, status=200):
+        body = ResponseEncoder.dumps_json(payload)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def generate_strategy(self, scope, receive, send):
+        started = time.perf_counter()
+        metrics.gauge_add('dacv_requests_in_flight', 1)
+        try:
+            await self._generate_strategy(scope, receive, send)
+        finally:
+            metrics.gauge_add('dacv_requests_in_flight', -1)
+            metrics.observe('dacv_request_duration_seconds', time.perf_counter() - started, endpoint='generate_strategy')
+
+    async def _generate_strategy(self, scope, receive, send):
+        client_ip = (scope.get('client') or ('127.0.0.1', 0))[0]
+        if app.config['RATELIMIT_ENABLED'] and not limiter.hit(ip_rate_limit(), 'generate_strategy', client_ip):
+            metrics.inc('dacv_rate_limit_rejections_total', endpoint='generate_strategy')
+            return await self.send_json(send, {"error": "Rate limit exceeded"}, 429)
+        
+        try:
+            data = await self.read_json(receive)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return await self.send_json(send, {"error": "JSON body required"}, 400)
+        
+        user_id = data.get('user_id')
+        if not user_id:
+            return await self.send_json(send, {"error": "User ID required"}, 400)
+        missing = missing_fields(data)
+        if missing:
+            return await self.send_json(send, {"error": f"Missing fields: {', '.join(missing)}"}, 400)
+        error = budget_error(data['budget'])
+        if error:
+            return await self.send_json(send, {"error": "Invalid budget", "message": error}, 400)
+        
+        strategy = await strategist.agenerate_strategy(
+            data['product'],
+            data['audience'],
+            data['budget'],
+            user_id
+        )
+        await self.send_json(send, strategy, 429 if strategy.get('rate_limited') else 200)
+
+def create_asgi_app():
+    return AsyncApp(app)
+
+# Application factory: gunicorn --preload 'index:create_app(warm=True)'
+def warm_up():
+    """Load SDKs, the landing page and the market index now instead of on first use.
+
+    Run in a preloading master, forked workers share all of it copy-on-write. Nothing here opens
+    connections or starts threads, since neither survives a fork.
+    """
+    started = time.perf_counter()
+    for name in SDK_SETUP:
+        sdk(name)
+    landing_page()
+    market_index.get()
+    allocation_engine.tables()
+    gc.freeze()  # Keep warmed objects out of the collector so its passes in workers do not copy their pages
+    startup_timings['warm_up'] = time.perf_counter() - started
+
+def create_app(warm=False):
+    if warm:
+        warm_up()
+    return app
+
+startup_timings['module_import'] = time.perf_counter() - _import_started
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+import sys
+
+os.environ.setdefault('USER_DB_PATH', '')  # Keep users in STORAGE_URL (memory) rather than a users.db in the cwd
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
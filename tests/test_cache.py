@@ -0,0 +1,160 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import index
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(index.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_their_namespace_ttl(clock):
+    cache = index.TTLCache(ttls={'seo': 10}, default_ttl=60)
+    cache.set('seo', 'boots', {'cpc': 1.5})
+    cache.set('sentiment', 'boots-sentiment', {'sentiment': 'positive'})
+    clock[0] += 9
+    assert cache.get('seo', 'boots') == {'cpc': 1.5}
+    assert cache.expires_in('boots') == pytest.approx(1)
+    clock[0] += 2
+    assert cache.get('seo', 'boots') is None
+    assert cache.get('sentiment', 'boots-sentiment') == {'sentiment': 'positive'}
+    assert cache.stats()['namespaces']['seo'] == {'hits': 1, 'stale_hits': 0, 'misses': 1, 'evictions': 0, 'expirations': 1}
+    assert len(cache) == 1
+
+
+def test_expired_entries_stay_readable_as_stale_for_stale_ttl(clock):
+    cache = index.TTLCache(default_ttl=10, stale_ttl=5)
+    cache.set('seo', 'boots', 1)
+    clock[0] += 12
+    assert cache.lookup('seo', 'boots') == (1, False)
+    assert cache.get('seo', 'boots') is None
+    assert cache.peek('boots') == 1
+    clock[0] += 4
+    assert cache.lookup('seo', 'boots') == (None, False)
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = index.TTLCache(max_entries=2)
+    cache.set('seo', 'a', 1)
+    cache.set('seo', 'b', 2)
+    assert cache.get('seo', 'a') == 1  # Now more recent than b
+    cache.set('seo', 'c', 3)
+    assert cache.get('seo', 'b') is None
+    assert (cache.get('seo', 'a'), cache.get('seo', 'c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_byte_bound_evicts_oldest_entries(clock):
+    cache = index.TTLCache(max_bytes=250)
+    for key in 'abc':
+        cache.set('seo', key, 'x' * 100)
+    assert cache.get('seo', 'a') is None
+    assert cache.stats()['bytes'] <= 250
+    cache.set('seo', 'b', 'y')  # Replacing an entry releases its old size
+    assert cache.stats()['bytes'] == 102 + 3
+
+
+def test_concurrent_calls_share_one_in_flight_call():
+    flight = index.SingleFlight()
+    release, calls = threading.Event(), []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'cpc': 1.5}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        leader = pool.submit(flight.do, 'seo_boots', fetch)
+        while not flight.in_flight('seo_boots'):
+            time.sleep(0.001)
+        followers = [pool.submit(flight.do, 'seo_boots', fetch) for _ in range(7)]
+        time.sleep(0.05)
+        release.set()
+        results = [leader.result()] + [follower.result() for follower in followers]
+    assert calls == [1]
+    assert results == [{'cpc': 1.5}] * 8
+    assert not flight.in_flight('seo_boots')
+
+
+def test_failed_call_is_shared_and_not_remembered():
+    flight = index.SingleFlight()
+
+    def fail():
+        raise ConnectionError('provider down')
+
+    with pytest.raises(ConnectionError):
+        flight.do('seo_boots', fail)
+    assert flight.do('seo_boots', lambda: 'recovered') == 'recovered'
+
+
+def test_stale_value_is_served_while_one_refresh_runs(clock, monkeypatch):
+    monkeypatch.setattr(index, 'real_time_cache', index.TTLCache(default_ttl=10, stale_ttl=60))
+    release, fetches = threading.Event(), []
+
+    def fetch():
+        fetches.append(1)
+        if len(fetches) > 1:
+            release.wait(5)
+        return len(fetches)
+
+    cached = lambda: index.RealTimeData._cached('seo', 'seo_boots', fetch, lambda: 'fallback')
+    assert cached() == 1
+    clock[0] += 15
+    assert [cached() for _ in range(5)] == [1] * 5  # Stale hits return at once; one refresh is started
+    release.set()
+    while index.provider_flight.in_flight('seo_boots'):
+        time.sleep(0.001)
+    assert fetches == [1, 1]
+    assert cached() == 2
+
+
+def test_miss_with_failing_provider_uses_the_fallback(clock, monkeypatch):
+    monkeypatch.setattr(index, 'real_time_cache', index.TTLCache(default_ttl=10))
+
+    def fail():
+        raise ConnectionError('provider down')
+
+    assert index.RealTimeData._cached('seo', 'seo_tents', fail, lambda: 'fallback') == 'fallback'
+    assert index.real_time_cache.peek('seo_tents') is None
+
+
+def strategy_cache(near_duplicates=False):
+    return index.StrategyCache(index.TTLCache(default_ttl=60), near_duplicates=near_duplicates, similarity=0.6)
+
+
+TRENDS = index.RealTimeData.social_trends_fallback()
+SENTIMENT = {'sentiment': 'positive', 'confidence': 0.9, 'keywords': ['durable']}
+
+
+def test_strategy_keys_ignore_case_punctuation_and_nearby_budgets():
+    cache = strategy_cache()
+    cache.set('Waterproof Trail-Boots!', 'Hikers', 500, TRENDS, SENTIMENT, {'seo': 1}, model='gpt-4o-mini')
+    assert cache.get('waterproof trail boots', ' hikers ', 510, TRENDS, SENTIMENT, model='gpt-4o-mini') == {'seo': 1}
+    assert cache.get('waterproof trail boots', 'hikers', 5000, TRENDS, SENTIMENT, model='gpt-4o-mini') is None
+    assert cache.get('waterproof trail boots', 'hikers', 500, TRENDS, SENTIMENT, model='gpt-4.1') is None
+    assert cache.get('waterproof trail boots', 'hikers', 500, TRENDS, {**SENTIMENT, 'sentiment': 'negative'}, model='gpt-4o-mini') is None
+
+
+def test_near_duplicate_products_share_a_strategy_when_enabled():
+    product = 'handmade full grain leather wallet with rfid blocking and coin pocket for men'
+    similar = 'handmade full grain leather wallet with rfid blocking and coin pocket for women'
+    for near_duplicates, expected in ((True, {'seo': 1}), (False, None)):
+        cache = strategy_cache(near_duplicates)
+        cache.set(product, 'commuters', 500, TRENDS, SENTIMENT, {'seo': 1})
+        assert cache.get(similar, 'commuters', 500, TRENDS, SENTIMENT) == expected
+        assert cache.get('insulated steel water bottle for hiking trips', 'commuters', 500, TRENDS, SENTIMENT) is None
+        assert cache.get(similar, 'gamers', 500, TRENDS, SENTIMENT) is None  # Only within the same group
+
+
+def test_near_duplicate_of_an_evicted_strategy_is_a_miss():
+    cache = strategy_cache(near_duplicates=True)
+    product = 'handmade full grain leather wallet with rfid blocking and coin pocket for men'
+    cache.set(product, 'commuters', 500, TRENDS, SENTIMENT, {'seo': 1})
+    cache.cache.clear()
+    assert cache.get(product + ' and women', 'commuters', 500, TRENDS, SENTIMENT) is None
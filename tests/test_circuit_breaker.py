@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+import index
+
+
+def half_open(breaker):
+    breaker.opened_at = 0  # Long past the reset timeout
+    breaker.failures = breaker.failure_threshold
+    return breaker
+
+
+def test_closes_after_successful_probe():
+    breaker = half_open(index.CircuitBreaker(2, 30))
+    assert breaker.allow()
+    assert not breaker.allow()  # One probe at a time
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_unexpected_request_error_ends_probe():
+    requests = index.sdk('requests')
+    client = index.ProviderClient({**index.app.config, 'PROVIDER_MAX_RETRIES': 0})
+    breaker = half_open(client.breaker('market_data'))
+
+    def redirect_loop(*args, **kwargs):
+        raise requests.TooManyRedirects  # Neither HTTPError, ConnectionError, Timeout nor ValueError
+
+    client._session = type('Session', (), {'request': staticmethod(redirect_loop)})()
+    with pytest.raises(requests.TooManyRedirects):
+        client.get('market_data', 'https://api.example.com/social/trends')
+    assert breaker.state == 'open'
+    assert not breaker._probing
+    breaker.opened_at = 0
+    assert breaker.allow()
+
+
+def test_cancelled_async_probe_is_released():
+    client = index.AsyncProviderClient(index.app.config, index.ProviderClient(index.app.config))
+    breaker = half_open(client.sync_client.breaker('market_data'))
+
+    async def cancelled_request(*args, **kwargs):
+        raise asyncio.CancelledError
+
+    client._client = type('Client', (), {'request': staticmethod(cancelled_request)})()
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(client.get('market_data', 'http://127.0.0.1:9/'))
+    assert not breaker._probing
+    assert breaker.state == 'open'
@@ -0,0 +1,56 @@
+import gzip
+import json
+
+import pytest
+
+import index
+
+LARGE = {'items': [{'product': f'trail boots {n}', 'audience': 'hikers'} for n in range(100)]}
+
+
+def encode(payload, min_compress_bytes=1024, **headers):
+    encoder = index.ResponseEncoder(min_compress_bytes)
+    with index.app.test_request_context(headers=headers):
+        return encoder.response(payload)
+
+
+def test_small_payloads_are_sent_uncompressed():
+    response = encode({'ok': True}, **{'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert json.loads(response.get_data()) == {'ok': True}
+    assert response.headers['Vary'] == 'Accept, Accept-Encoding'
+
+
+def test_large_payloads_are_compressed_when_the_client_accepts_it():
+    response = encode(LARGE, **{'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.get_data())) == LARGE
+    assert 'Content-Encoding' not in encode(LARGE).headers
+    assert 'Content-Encoding' not in encode(LARGE, **{'Accept-Encoding': 'gzip;q=0'}).headers
+
+
+def test_threshold_is_inclusive():
+    body = index.ResponseEncoder.dumps_json(LARGE)
+    assert encode(LARGE, min_compress_bytes=len(body), **{'Accept-Encoding': 'gzip'}).headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in encode(LARGE, min_compress_bytes=len(body) + 1, **{'Accept-Encoding': 'gzip'}).headers
+
+
+def test_stronger_codecs_are_preferred_over_gzip():
+    encoder = index.ResponseEncoder(0)
+    encoder.compressors['zstd'] = lambda body: b'zstd:' + body
+    with index.app.test_request_context(headers={'Accept-Encoding': 'gzip, zstd'}):
+        response = encoder.response(LARGE)
+    assert response.headers['Content-Encoding'] == 'zstd'
+    assert response.get_data().startswith(b'zstd:')
+
+
+def test_unknown_accept_falls_back_to_json():
+    response = encode({'ok': True}, Accept='application/xml')
+    assert response.mimetype == 'application/json'
+
+
+def test_msgpack_by_accept():
+    msgpack = pytest.importorskip('msgpack')
+    response = encode({'ok': True}, Accept='application/msgpack')
+    assert response.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(response.get_data()) == {'ok': True}
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import index
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def history(request, tmp_path):
+    if request.param == 'sqlite':
+        return index.SQLiteHistoryStore(str(tmp_path / 'history.db'), max_per_user=5, retention_days=30)
+    return index.HistoryStore(max_per_user=5, retention_days=30)
+
+
+def record(user_id, product, age_days=0):
+    timestamp = (datetime.now() - timedelta(days=age_days)).isoformat()
+    return {'user_id': user_id, 'timestamp': timestamp, 'product': product, 'audience': 'hikers', 'budget': 500,
+            'strategy': {'product': product}}
+
+
+def test_pages_walk_newest_first_without_gaps(history):
+    for n in range(5):
+        history.append(record('alice', f'p{n}'))
+    history.append(record('bob', 'other'))
+
+    first = history.page('alice', limit=2)
+    assert [item['product'] for item in first['items']] == ['p4', 'p3']
+    second = history.page('alice', cursor=first['next_cursor'], limit=2)
+    assert [item['product'] for item in second['items']] == ['p2', 'p1']
+    last = history.page('alice', cursor=second['next_cursor'], limit=2)
+    assert [item['product'] for item in last['items']] == ['p0']
+    assert last['next_cursor'] is None
+    assert history.page('alice', limit=5)['next_cursor'] is None
+
+
+def test_summaries_omit_the_strategy_unless_full(history):
+    history.append(record('alice', 'boots'))
+    (summary,) = history.page('alice')['items']
+    assert set(summary) == {'id', 'timestamp', 'product', 'audience', 'budget'}
+    (full,) = history.page('alice', cursor=summary['id'] + 1, limit=1, full=True)['items']
+    assert full['strategy'] == {'product': 'boots'}
+
+
+def test_retention_drops_old_and_excess_entries(history):
+    history.append(record('alice', 'ancient', age_days=31))
+    for n in range(7):
+        history.append(record('alice', f'p{n}'))
+    products = [item['product'] for item in history.page('alice', limit=10)['items']]
+    assert products == ['p6', 'p5', 'p4', 'p3', 'p2']
@@ -0,0 +1,71 @@
+import socket
+
+import pytest
+
+import index
+
+
+def resolves_to(monkeypatch, *addresses):
+    """Make every hostname resolve to the given addresses"""
+    def getaddrinfo(host, port, *args, **kwargs):
+        family = lambda address: socket.AF_INET6 if ':' in address else socket.AF_INET
+        return [(family(address), socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (address, port)) for address in addresses]
+    monkeypatch.setattr(index.socket, 'getaddrinfo', getaddrinfo)
+
+
+@pytest.mark.parametrize('address', [
+    '127.0.0.1', '10.1.2.3', '192.168.0.10', '172.16.5.5', '169.254.169.254', '::1', 'fe80::1', '::ffff:127.0.0.1'
+])
+def test_callback_to_internal_address_is_rejected(monkeypatch, address):
+    resolves_to(monkeypatch, '93.184.216.34', address)
+    assert index.callback_url_error('https://hooks.example.com/done') is not None
+
+
+def test_callback_to_public_address_is_allowed(monkeypatch):
+    resolves_to(monkeypatch, '93.184.216.34', '2606:2800:220:1:248:1893:25c8:1946')
+    assert index.callback_url_error('https://hooks.example.com/done') is None
+
+
+@pytest.mark.parametrize('url', ['ftp://hooks.example.com/done', 'https:///done', 'http://hooks.example.com:99999/'])
+def test_malformed_callback_is_rejected(url):
+    assert index.callback_url_error(url) is not None
+
+
+def test_allowlist_replaces_address_check(monkeypatch):
+    resolves_to(monkeypatch, '10.0.0.7')
+    monkeypatch.setitem(index.app.config, 'JOB_CALLBACK_ALLOWED_HOSTS', {'hooks.internal'})
+    assert index.callback_url_error('https://hooks.internal/done') is None
+    assert index.callback_url_error('https://hooks.example.com/done') is not None
+
+
+def test_async_route_rejects_metadata_callback(monkeypatch):
+    resolves_to(monkeypatch, '169.254.169.254')
+    response = index.app.test_client().post('/generate-strategy?async=1', json={
+        'user_id': 'test_callback', 'product': 'trail boots', 'audience': 'hikers', 'budget': 500,
+        'callback_url': 'http://metadata.example.com/latest'
+    })
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid callback URL'
+
+
+def test_stale_jobs_are_recovered_on_first_request(monkeypatch):
+    recovered = []
+
+    class Store(index.JobStore):
+        def recoverable(self, stale_before):
+            recovered.append(stale_before)
+            return []
+
+    monkeypatch.setattr(index, 'job_queue', index.JobQueue(Store(), workers=1))
+    client = index.app.test_client()
+    client.get('/jobs/unknown')
+    client.get('/jobs/unknown')
+    assert len(recovered) == 1
+
+
+def test_queue_depth_counts_jobs_waiting_for_a_worker():
+    jobs = index.JobQueue(index.JobStore(), workers=0)
+    assert jobs.depth() == 0
+    jobs.submit('test_depth', {'product': 'trail boots', 'audience': 'hikers', 'budget': 500}, paid=False)
+    jobs.submit('test_depth', {'product': 'tents', 'audience': 'campers', 'budget': 500}, paid=True)
+    assert jobs.depth() == 2
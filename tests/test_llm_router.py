@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+import uuid
+
+import pytest
+
+import index
+
+REPLY = {'seo': {'focus_keywords': ['boots'], 'content_pillars': ['guides']}}
+
+
+@pytest.fixture
+def router():
+    config = dict(index.app.config, LLM_HEDGE_DELAY=0.05, LLM_TIMEOUT=0.5, LLM_POOL_SIZE=4)
+    return index.LLMRouter(config)
+
+
+def replies(router, **behaviour):
+    """Stub the router's completion calls; behaviour maps model name to a reply dict, an exception or (delay, outcome)"""
+    calls = []
+
+    def outcome(model):
+        calls.append(model)
+        delay, result = behaviour[model] if isinstance(behaviour[model], tuple) else (0, behaviour[model])
+        return delay, result
+
+    def call(request, prompt_tokens, model):
+        delay, result = outcome(model)
+        time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def acall(request, prompt_tokens, model):
+        delay, result = outcome(model)
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    router._call, router._acall = call, acall
+    return calls
+
+
+@pytest.mark.parametrize('plan, prompt_tokens, expected', [
+    ('free', 50, {'model': 'gpt-4o-mini', 'max_tokens': 300, 'hedge_model': 'gpt-4.1-nano'}),
+    ('free', 5000, {'model': 'gpt-4o-mini', 'max_tokens': 300, 'hedge_model': 'gpt-4.1-nano'}),
+    ('starter', 401, {'model': 'gpt-4o-mini', 'max_tokens': 500, 'hedge_model': 'gpt-4.1-nano'}),
+    ('professional', 400, {'model': 'gpt-4.1-mini', 'max_tokens': 600, 'hedge_model': 'gpt-4o-mini'}),
+    ('professional', 401, {'model': 'gpt-4.1', 'max_tokens': 800, 'hedge_model': 'gpt-4o-mini'}),
+    ('unknown', 50, {'model': 'gpt-4o-mini', 'max_tokens': 300, 'hedge_model': 'gpt-4.1-nano'}),
+])
+def test_route_by_plan_and_prompt_size(router, plan, prompt_tokens, expected):
+    assert router.route(plan, prompt_tokens) == expected
+
+
+def test_slow_call_is_hedged(router):
+    calls = replies(router, **{'gpt-4o-mini': (0.4, {'slow': {}}), 'gpt-4.1-nano': REPLY})
+    started = time.monotonic()
+    assert router.complete({}, 10, router.route('free', 10)) == REPLY
+    assert time.monotonic() - started < 0.3
+    assert calls == ['gpt-4o-mini', 'gpt-4.1-nano']
+
+
+def test_fast_call_is_not_hedged(router):
+    calls = replies(router, **{'gpt-4o-mini': REPLY, 'gpt-4.1-nano': REPLY})
+    assert router.complete({}, 10, router.route('free', 10)) == REPLY
+    assert calls == ['gpt-4o-mini']
+
+
+def test_failed_call_is_hedged_at_once(router):
+    calls = replies(router, **{'gpt-4o-mini': RuntimeError('503'), 'gpt-4.1-nano': REPLY})
+    router.config['LLM_HEDGE_DELAY'] = 5
+    started = time.monotonic()
+    assert router.complete({}, 10, router.route('free', 10)) == REPLY
+    assert time.monotonic() - started < 1
+    assert calls == ['gpt-4o-mini', 'gpt-4.1-nano']
+
+
+def test_both_failing_raises_the_error(router):
+    replies(router, **{'gpt-4o-mini': RuntimeError('503'), 'gpt-4.1-nano': RuntimeError('overloaded')})
+    with pytest.raises(RuntimeError):
+        router.complete({}, 10, router.route('free', 10))
+
+
+def test_no_reply_within_timeout(router):
+    replies(router, **{'gpt-4o-mini': (1, REPLY), 'gpt-4.1-nano': (1, REPLY)})
+    started = time.monotonic()
+    with pytest.raises(index.FutureTimeoutError):
+        router.complete({}, 10, router.route('free', 10))
+    assert time.monotonic() - started < 0.8
+
+
+def test_async_slow_call_is_hedged_and_loser_cancelled(router):
+    replies(router, **{'gpt-4o-mini': (5, {'slow': {}}), 'gpt-4.1-nano': REPLY})
+
+    async def run():
+        started = time.monotonic()
+        result = await router.acomplete({}, 10, router.route('free', 10))
+        await asyncio.sleep(0)
+        leftover = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        return result, time.monotonic() - started, leftover
+
+    result, elapsed, leftover = asyncio.run(run())
+    assert result == REPLY
+    assert elapsed < 0.3
+    assert leftover == []
+
+
+def test_async_no_reply_within_timeout(router):
+    replies(router, **{'gpt-4o-mini': (5, REPLY), 'gpt-4.1-nano': (5, REPLY)})
+    with pytest.raises(index.FutureTimeoutError):
+        asyncio.run(router.acomplete({}, 10, router.route('free', 10)))
+
+
+def test_template_fallback_goes_through_enhancement(monkeypatch):
+    def down(request, prompt_tokens, model):
+        raise ConnectionError('completion server down')
+    monkeypatch.setattr(index.llm_router, '_call', down)
+    product = f'Waterproof trail boots {uuid.uuid4().hex[:8]}'
+    social_trends = index.RealTimeData.social_trends_fallback()
+    sentiment = {'sentiment': 'positive', 'confidence': 0.9, 'keywords': ['durable', 'comfortable']}
+    seo_data = {'keyword_difficulty': 'High', 'search_volume': 900, 'cpc': 2.5, 'related_keywords': ['hiking boots']}
+
+    ai_strategy = index.strategist._cached_ai_strategy(product, 'hikers', 500, social_trends, sentiment)
+    assert ai_strategy == index.strategist._template_ai_strategy(product, social_trends, sentiment)
+    strategy = index.strategist._assemble_strategy(product, 500, ai_strategy, social_trends, sentiment, seo_data)
+    assert strategy['social_media']['platforms'][:3] == social_trends['trending_platforms']
+    assert strategy['social_media']['engagement_tips'] == social_trends['engagement_tips']
+    assert 'hiking boots' in strategy['seo']['focus_keywords']
+    assert strategy['seo']['keyword_difficulty'] == 'High'
+    assert strategy['content']['tone'] == 'enthusiastic'
+    assert 'durable' in strategy['content']['themes']
+
+
+def test_generate_strategy_with_completion_server_down(monkeypatch):
+    benchmark = pytest.importorskip('benchmark')
+    openai = pytest.importorskip('openai')
+    monkeypatch.setattr(benchmark.FakeUpstream, 'profiles', {'openai': benchmark.LatencyProfile(1, 0, error_rate=1.0)})
+    upstream = benchmark.ThreadingHTTPServer(('127.0.0.1', 0), benchmark.FakeUpstream)
+    upstream.daemon_threads = True
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    try:
+        index.sdk('openai')
+        monkeypatch.setattr(openai, 'base_url', f'http://127.0.0.1:{upstream.server_address[1]}/v1/')
+        monkeypatch.setattr(openai, 'api_key', 'sk-test')
+        monkeypatch.setattr(openai, 'max_retries', 0)
+        monkeypatch.setattr(index.RealTimeData, 'get_all', staticmethod(lambda product, keyword: {
+            'social_trends': index.RealTimeData.social_trends_fallback(),
+            'sentiment': index.RealTimeData.sentiment_fallback(),
+            'seo': index.RealTimeData.seo_fallback(keyword, product)
+        }))
+
+        response = index.app.test_client().post('/generate-strategy', json={
+            'user_id': f'test_{uuid.uuid4().hex[:12]}',
+            'product': f'Handmade leather wallets {uuid.uuid4().hex[:8]}',
+            'audience': 'minimalists',
+            'budget': 800
+        })
+    finally:
+        upstream.shutdown()
+    assert response.status_code == 200
+    strategy = response.get_json()
+    # The template's sections, not the fake server's canned reply
+    assert strategy['social_media']['posting_frequency'] == '3x per week'
+    assert 'benchmark keyword' not in strategy['seo']['focus_keywords']
+    assert strategy['seo']['focus_keywords'][:2] == ['handmade', 'leather']
+    assert strategy['content']['tone'] == 'informative'
+    assert strategy['budget_allocation']['allocations']
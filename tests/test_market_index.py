@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+import index
+
+COMPETITORS = [
+    {'name': 'Bellroy', 'category': 'leather wallets', 'keywords': ['slim', 'minimalist']},
+    {'name': 'Ridge', 'category': 'metal wallets', 'keywords': ['rfid', 'minimalist']},
+    {'name': 'Hydro Flask', 'category': 'water bottles', 'keywords': ['insulated', 'outdoor']},
+]
+KEYWORDS = [
+    {'keyword': 'leather wallets', 'search_volume': 9000, 'cpc': 1.8, 'keyword_difficulty': 'High'},
+    {'keyword': 'minimalist wallet', 'search_volume': 4000, 'cpc': 1.2, 'keyword_difficulty': 'Medium'},
+    {'keyword': 'insulated water bottle', 'search_volume': 12000, 'cpc': 0.9, 'keyword_difficulty': 'Low'},
+]
+
+
+@pytest.fixture
+def market(tmp_path):
+    path = str(tmp_path / 'market.idx')
+    index.MarketIndex.build(COMPETITORS, KEYWORDS, path)
+    return index.MarketIndex(path)
+
+
+def names(results, field):
+    return [record[field] for record, _ in results]
+
+
+def test_search_ranks_records_of_each_kind(market):
+    assert names(market.competitors('minimalist leather wallet for men'), 'name')[:2] == ['Bellroy', 'Ridge']
+    assert names(market.related_keywords('insulated bottles for hiking'), 'keyword') == ['insulated water bottle']
+    assert market.related_keywords('leather')[0][0] == KEYWORDS[0]  # Records round-trip through the mapped file
+    assert market.competitors('spreadsheet software') == []
+
+
+def test_prefix_match_ranks_below_exact(market):
+    (record, score), = market.related_keywords('insul')
+    assert record['keyword'] == 'insulated water bottle'
+    assert score < market.related_keywords('insulated')[0][1]
+
+
+def test_exact_token_of_the_other_kind_still_expands_by_prefix(tmp_path):
+    path = str(tmp_path / 'market.idx')
+    index.MarketIndex.build([{'name': 'wallet'}], [{'keyword': 'leather wallets'}], path)
+    market = index.MarketIndex(path)
+    assert names(market.related_keywords('wallet'), 'keyword') == ['leather wallets']
+    assert names(market.competitors('wallet'), 'name') == ['wallet']
+
+
+def test_missing_file_is_an_empty_index(tmp_path):
+    market = index.MarketIndex(str(tmp_path / 'absent.idx'))
+    assert len(market) == 0
+    assert market.competitors('wallet') == []
+
+
+def test_loader_swaps_in_a_rebuilt_file_and_keeps_the_old_one_on_a_bad_file(tmp_path):
+    path = str(tmp_path / 'market.idx')
+    index.MarketIndex.build(COMPETITORS, KEYWORDS, path)
+    loader = index.MarketIndexLoader(path, check_interval=0)
+    assert names(loader.get().competitors('rfid'), 'name') == ['Ridge']
+
+    index.MarketIndex.build([{'name': 'Secrid', 'keywords': ['rfid']}], KEYWORDS, path)
+    old = loader.index
+    assert names(loader.get().competitors('rfid'), 'name') == ['Secrid']
+    assert names(old.competitors('rfid'), 'name') == ['Ridge']  # Earlier readers keep their mapping
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(b'not an index')
+    os.replace(path + '.tmp', path)
+    assert names(loader.get().competitors('rfid'), 'name') == ['Secrid']
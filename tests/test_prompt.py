@@ -0,0 +1,71 @@
+import json
+import re
+
+import pytest
+
+import index
+
+DESCRIPTION = (
+    'Handmade full grain leather wallets for minimalists. '
+    'Our family workshop has been open since 1952 and the founder liked sailing. '
+    'Each leather wallet holds six cards and folds flat in a front pocket. '
+    'Shipping is free on orders over fifty dollars. '
+    'The leather wallets are stitched by hand with waxed thread and age to a rich patina.'
+)
+
+
+@pytest.fixture
+def builder():
+    return index.PromptBuilder(dict(index.app.config))
+
+
+def test_text_within_budget_is_only_whitespace_normalised(builder):
+    assert builder.fit('  Trail   boots\nfor hikers ', 100) == 'Trail boots for hikers'
+
+
+@pytest.mark.parametrize('budget', [20, 35, 50])
+def test_summary_keeps_the_lead_and_densest_sentences_within_budget(builder, budget):
+    summary = builder.fit(DESCRIPTION, budget)
+    assert builder.count_tokens(summary) <= budget
+    assert summary.startswith('Handmade full grain leather wallets for minimalists.')
+    sentences = [sentence for sentence in re.split(r'(?<=[.!?;])\s+', DESCRIPTION) if sentence in summary]
+    assert ' '.join(sentences) == summary  # Whole sentences, in their original order
+
+
+def test_tight_budget_keeps_leather_sentences_over_filler(builder):
+    summary = builder.fit(DESCRIPTION, 35)
+    assert 'sailing' not in summary
+    assert 'leather' in summary.split('.', 1)[1]
+
+
+@pytest.mark.parametrize('budget', [1, 5, 12])
+def test_long_lead_sentence_is_cut_at_a_word(builder, budget):
+    text = ' '.join(f'word{n}' for n in range(200))
+    cut = builder.fit(text, budget)
+    assert builder.count_tokens(cut) <= budget
+    assert text.startswith(cut) and (cut == '' or text[len(cut)] == ' ')
+    assert builder.count_tokens(' '.join(text.split()[:len(cut.split()) + 1])) > budget
+
+
+def test_prompt_token_count_covers_every_message(builder):
+    messages, tokens = builder.build(DESCRIPTION * 10, 'hikers', 500, index.RealTimeData.social_trends_fallback(), {})
+    assert tokens == sum(builder.count_tokens(m['content']) + builder.MESSAGE_OVERHEAD for m in messages)
+    product_line = messages[1]['content'].splitlines()[0]
+    assert builder.count_tokens(product_line[len('Product: '):]) <= index.app.config['AI_PRODUCT_TOKEN_BUDGET']
+    assert 'Market sentiment: neutral' in messages[1]['content']
+
+
+def test_parse_keeps_schema_fields_and_caps_lists(builder):
+    reply = json.dumps({
+        'social_media': {'platforms': ['a', 'b', 'c', 'd'], 'posting_frequency': 'daily', 'extra': 'dropped'},
+        'seo': {'focus_keywords': [1, 2], 'content_pillars': 'not a list'},
+        'content': 'not an object',
+        'unknown': {}
+    })
+    assert builder.parse(reply) == {
+        'social_media': {'platforms': ['a', 'b', 'c'], 'posting_frequency': 'daily'},
+        'seo': {'focus_keywords': ['1', '2']}
+    }
+    assert builder.parse('[]') == {}
+    with pytest.raises(ValueError):
+        builder.parse('Sure! Here is your strategy')
@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import index
+
+
+@pytest.fixture(params=['kv', 'sqlite'])
+def users(request, tmp_path):
+    if request.param == 'sqlite':
+        return index.SQLiteUserManager(str(tmp_path / 'users.db'))
+    return index.UserManager(index.create_backend('memory://'))
+
+
+@pytest.fixture
+def user_id():
+    return f'test_{uuid.uuid4().hex[:12]}'
+
+
+def test_free_uses_cannot_be_overdrawn_concurrently(users, user_id):
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        charged = list(pool.map(lambda _: users.charge_uses(user_id, 1, limit=3), range(32)))
+    assert charged.count(True) == 3
+    assert users.check_user(user_id)['uses'] == 3
+    assert not users.charge_uses(user_id, 1, limit=3)
+    users.refund_uses(user_id)
+    assert users.charge_uses(user_id, 1, limit=3)
+
+
+def test_increment_use_counts_one_strategy(users, user_id):
+    users.increment_use(user_id)
+    users.increment_use(user_id)
+    assert users.check_user(user_id)['uses'] == 2
+
+
+def test_failed_generation_refunds_quota(monkeypatch, user_id):
+    monkeypatch.setitem(index.app.config['PLANS'], 'starter', {'requests_per_minute': 60, 'monthly_quota': 1})
+    index.user_manager.set_paid(user_id, f'cus_{user_id}', f'sub_{user_id}', 'starter')
+
+    def unavailable(product, keyword):
+        raise RuntimeError('provider pool down')
+    monkeypatch.setattr(index.RealTimeData, 'get_all', staticmethod(unavailable))
+    with pytest.raises(RuntimeError):
+        index.strategist.generate_strategy('trail boots', 'hikers', 500, user_id)
+
+    assert index.user_manager.check_user(user_id)['uses'] == 0
+    assert index.quota_manager.acquire(user_id, index.user_manager.check_user(user_id)) is None
+    assert index.quota_manager.acquire(user_id, index.user_manager.check_user(user_id))['quota_exceeded']
+
+
+def test_durable_user_store_keeps_quotas_with_it(tmp_path):
+    code = 'import index; print(type(index.quota_manager.backend).__name__, index.quota_manager.backend.path)'
+    env = dict(os.environ, USER_DB_PATH=str(tmp_path / 'users.db'))
+    output = subprocess.run(
+        [sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ).stdout.split()
+    assert output == ['SQLiteBackend', str(tmp_path / 'users.db')]
+
+
+def test_user_store_defaults_to_a_durable_file():
+    code = (
+        'import os, index; '
+        'print(index.app.config["USER_DB_PATH"] == os.path.join(index.app.instance_path, "dacv.db"), '
+        'type(index.user_manager).__name__, type(index.job_queue.store).__name__, '
+        'type(index.webhook_processor.store).__name__)'
+    )
+    env = {key: value for key, value in os.environ.items() if key != 'USER_DB_PATH'}
+    output = subprocess.run(
+        [sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ).stdout.split()
+    assert output == ['True', 'SQLiteUserManager', 'SQLiteJobStore', 'SQLiteWebhookEventStore']
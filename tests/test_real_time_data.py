@@ -0,0 +1,40 @@
+import time
+
+import index
+
+
+def test_get_many_deadlines_stretch_with_batch_size(monkeypatch):
+    monkeypatch.setitem(index.app.config, 'PROVIDER_DEADLINES', {'social_trends': 0.2, 'seo': 0.2, 'sentiment': 0.2})
+    monkeypatch.setitem(index.app.config, 'PROVIDER_TOTAL_DEADLINE', 0.25)
+    monkeypatch.setattr(index.cache_warmer, 'record_many', lambda products, keywords: None)
+
+    def slow(value):
+        def fetch(*args):
+            time.sleep(0.1)
+            return value
+        return staticmethod(fetch)
+
+    monkeypatch.setattr(index.RealTimeData, 'get_social_media_trends', slow({'trending_platforms': ['live']}))
+    monkeypatch.setattr(index.RealTimeData, 'get_market_sentiment', slow({'sentiment': 'live'}))
+    monkeypatch.setattr(index.RealTimeData, 'get_seo_data', slow({'search_volume': 'live'}))
+
+    # 1 + 20 + 20 calls need three waves of the 16-thread pool; each wave alone fits the deadlines
+    products = [f'product {i}' for i in range(20)]
+    results = index.RealTimeData.get_many(products, [f'keyword{i}' for i in range(20)])
+    assert results['social_trends'] == {'trending_platforms': ['live']}
+    assert all(value == {'sentiment': 'live'} for value in results['sentiment'].values())
+    assert all(value == {'search_volume': 'live'} for value in results['seo'].values())
+
+
+def test_warmers_sharing_a_backend_refresh_each_key_once(monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(index.RealTimeData, 'get_seo_data', staticmethod(lambda keyword, refresh=False: refreshed.append(keyword)))
+    monkeypatch.setattr(index.real_time_cache, 'expires_in', lambda key: None)
+
+    backend = index.create_backend('memory://')
+    warmers = [index.CacheWarmer(index.app.config, backend) for _ in range(3)]
+    for warmer in warmers:
+        warmer.scores['seo'] = {'boots': 5, 'tents': 3}
+        warmer._last_trends_refresh = time.monotonic()
+        warmer.warm()
+    assert sorted(refreshed) == ['boots', 'tents']
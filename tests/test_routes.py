@@ -0,0 +1,253 @@
+import uuid
+
+import pytest
+
+import index
+
+
+@pytest.fixture
+def client():
+    return index.app.test_client()
+
+
+@pytest.fixture
+def user_id():
+    return f'test_{uuid.uuid4().hex[:12]}'
+
+
+def test_stream_rate_limit_is_a_429(client, user_id, monkeypatch):
+    monkeypatch.setitem(index.app.config['PLANS'], 'starter', {'requests_per_minute': 1, 'monthly_quota': None})
+    index.user_manager.set_paid(user_id, f'cus_{user_id}', f'sub_{user_id}', 'starter')
+    assert index.quota_manager.acquire(user_id, index.user_manager.check_user(user_id)) is None
+    
+    response = client.post('/generate-strategy/stream', json={
+        'user_id': user_id, 'product': 'trail boots', 'audience': 'hikers', 'budget': 500
+    })
+    assert response.status_code == 429
+    assert response.mimetype == 'application/x-ndjson'
+    assert int(response.headers['Retry-After']) > 0
+    event, = stream_events(response)
+    assert event['event'] == 'error' and event['rate_limited']
+
+
+def stream_events(response):
+    """Parse an NDJSON body line by line, the way the page reads it"""
+    import json
+    return [json.loads(line) for line in response.get_data(as_text=True).split('\n') if line.strip()]
+
+
+def test_stream_payment_denial_is_one_parsable_line(client, user_id, monkeypatch):
+    monkeypatch.setattr(index.app.json, 'compact', False)  # What debug mode does to jsonify output
+    monkeypatch.setitem(index.app.config, 'MAX_FREE_USES', 0)
+    response = client.post('/generate-strategy/stream', json={
+        'user_id': user_id, 'product': 'trail boots', 'audience': 'hikers', 'budget': 500
+    })
+    assert response.status_code == 402
+    assert response.mimetype == 'application/x-ndjson'
+    event, = stream_events(response)
+    assert event['event'] == 'error' and event['payment_required']
+
+
+def asgi_post(path, body):
+    """Run one POST through the ASGI app and return (status, JSON body)"""
+    import asyncio
+    import json
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': json.dumps(body).encode(), 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': path, 'client': ('127.0.0.1', 1234), 'headers': []}
+    asyncio.run(index.create_asgi_app()(scope, receive, send))
+    return messages[0]['status'], json.loads(b''.join(m.get('body', b'') for m in messages[1:]))
+
+
+def test_asgi_missing_fields_are_a_400(user_id):
+    pytest.importorskip('asgiref')
+    status, body = asgi_post('/generate-strategy', {'user_id': user_id, 'product': 'trail boots'})
+    assert status == 400
+    assert body == {'error': 'Missing fields: audience, budget'}
+
+
+@pytest.mark.parametrize('path', ['/generate-strategy', '/generate-strategy/stream', '/generate-strategy?async=1'])
+def test_missing_fields_are_a_400(client, user_id, path):
+    response = client.post(path, json={'user_id': user_id, 'audience': 'hikers'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Missing fields: product, budget'}
+
+
+def test_batch_rejects_blank_and_non_string_products_per_item(client, user_id, monkeypatch):
+    monkeypatch.setitem(index.app.config, 'MAX_FREE_USES', 10)
+    monkeypatch.setattr(index.RealTimeData, 'get_many', staticmethod(lambda products, keywords: {
+        'social_trends': index.RealTimeData.social_trends_fallback(),
+        'sentiment': {product: index.RealTimeData.sentiment_fallback() for product in products},
+        'seo': {keyword: index.RealTimeData.seo_fallback(keyword) for keyword in keywords}
+    }))
+    response = client.post('/generate-strategies/batch', json={'user_id': user_id, 'items': [
+        {'product': '   ', 'audience': 'hikers', 'budget': 100},
+        {'product': 42, 'audience': 'hikers', 'budget': 100}
+    ]})
+    assert response.status_code == 200
+    assert [result['error'] for result in response.get_json()['results']] == ['Missing fields: product'] * 2
+
+
+def test_batch_charges_only_valid_items(client, user_id, monkeypatch):
+    monkeypatch.setitem(index.app.config, 'MAX_FREE_USES', 1)
+    monkeypatch.setattr(index.RealTimeData, 'get_many', staticmethod(lambda products, keywords: {
+        'social_trends': index.RealTimeData.social_trends_fallback(),
+        'sentiment': {product: index.RealTimeData.sentiment_fallback() for product in products},
+        'seo': {keyword: index.RealTimeData.seo_fallback(keyword) for keyword in keywords}
+    }))
+    monkeypatch.setattr(index.llm_router, '_call', lambda request, prompt_tokens, model: {})
+    response = client.post('/generate-strategies/batch', json={'user_id': user_id, 'items': [
+        {'product': f'Trail boots {uuid.uuid4().hex[:8]}', 'audience': 'hikers', 'budget': 100},
+        {'product': 'Tents', 'audience': 'campers'}
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert 'strategy' in results[0]
+    assert results[1]['error'] == 'Missing fields: budget'
+    assert index.user_manager.check_user(user_id)['uses'] == 1
+
+
+@pytest.mark.parametrize('path', ['/generate-strategy', '/generate-strategy/stream', '/generate-strategy?async=1'])
+@pytest.mark.parametrize('budget', ['1e309', '-500', '"lots"', 'true'])
+def test_unusable_budgets_are_a_400(client, user_id, path, budget):
+    body = f'{{"user_id": "{user_id}", "product": "trail boots", "audience": "hikers", "budget": {budget}}}'
+    response = client.post(path, data=body, content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid budget'
+    assert index.user_manager.check_user(user_id)['uses'] == 0
+
+
+def test_asgi_unusable_budget_is_a_400(user_id):
+    pytest.importorskip('asgiref')
+    status, body = asgi_post('/generate-strategy', {'user_id': user_id, 'product': 'boots', 'audience': 'hikers', 'budget': -1})
+    assert status == 400
+    assert body['error'] == 'Invalid budget'
+
+
+def test_allocation_tolerates_non_finite_budgets():
+    allocation, = index.allocation_engine.allocate_channels([(float('inf'), {}, {})])
+    assert allocation['allocations']['paid_advertising']['amount'] == 0
+
+
+def test_stream_sends_budget_before_provider_fan_out(user_id, monkeypatch):
+    events = []
+
+    def get_all(product, keyword):
+        events.append('get_all')
+        return {
+            'social_trends': index.RealTimeData.social_trends_fallback(),
+            'sentiment': index.RealTimeData.sentiment_fallback(),
+            'seo': index.RealTimeData.seo_fallback(keyword, product)
+        }
+    monkeypatch.setattr(index.RealTimeData, 'get_all', staticmethod(get_all))
+
+    stream = index.strategist.stream_strategy('trail boots', 'hikers', 500, user_id, check_access=False)
+    for event in stream:
+        events.append(event.get('section'))
+        if event.get('section') == 'real_time_insights':
+            break
+    stream.close()
+    assert events == ['budget_allocation', 'paid_advertising', 'get_all', 'real_time_insights']
+
+
+def test_stylesheet_styles_every_class_on_the_landing_page(client):
+    import re
+    page = client.get('/').get_data(as_text=True)
+    response = client.get(re.search(r'href="(/assets/app\.[0-9a-f]+\.css)"', page).group(1))
+    assert response.status_code == 200
+    css = response.get_data(as_text=True)
+    classes = {name for names in re.findall(r'class="([^"]+)"', page) for name in names.split()}
+    assert classes
+    assert {name for name in classes if f'.{name}' not in css} == set()
+
+
+def test_script_defines_every_function_the_page_calls(client):
+    import re
+    page = client.get('/').get_data(as_text=True)
+    script = client.get(re.search(r'src="(/assets/app\.[0-9a-f]+\.js)"', page).group(1)).get_data(as_text=True)
+    defined = set(re.findall(r'function (\w+)\(', script))
+    called = set(re.findall(r'on\w+="(\w+)\(', page)) | {'displayStrategy', 'loadUserHistory'}
+    assert called - defined == set()
+    assert '[Keep' not in script
+    css = client.get(re.search(r'href="(/assets/app\.[0-9a-f]+\.css)"', page).group(1)).get_data(as_text=True)
+    rendered = {name for names in re.findall(r'class(?:Name)?\s*=\s*"([^"$]+)"', script) for name in names.split()}
+    assert {name for name in rendered if f'.{name}' not in css} == set()
+
+
+@pytest.mark.parametrize('filename', list(index.static_assets))
+def test_assets_are_immutable_and_revalidate_by_etag(client, filename):
+    response = client.get(f'/assets/{filename}')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == index.static_assets[filename].body
+
+    revalidated = client.get(f'/assets/{filename}', headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert client.get(f'/assets/{filename}', headers={'If-None-Match': 'W/"stale"'}).status_code == 200
+
+
+def test_assets_serve_the_precompressed_gzip_variant(client):
+    import gzip
+    filename = next(iter(index.static_assets))
+    response = client.get(f'/assets/{filename}', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == index.static_assets[filename].body
+    assert client.get(f'/assets/{filename}', headers={'Accept-Encoding': 'gzip;q=0'}).headers.get('Content-Encoding') is None
+    assert client.get('/assets/app.0000000000000000.js').status_code == 404
+
+
+def test_landing_page_revalidates_by_etag(client):
+    response = client.get('/')
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert client.get('/', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_metrics_export_stage_histograms_and_counters(client, user_id, monkeypatch):
+    monkeypatch.setattr(index.RealTimeData, 'get_all', staticmethod(lambda product, keyword: {
+        'social_trends': index.RealTimeData.social_trends_fallback(),
+        'sentiment': index.RealTimeData.sentiment_fallback(),
+        'seo': index.RealTimeData.seo_fallback(keyword, product)
+    }))
+    monkeypatch.setattr(index.llm_router, '_call', lambda request, prompt_tokens, model: {})
+    response = client.post('/generate-strategy', json={
+        'user_id': user_id, 'product': f'Trail boots {uuid.uuid4().hex[:8]}', 'audience': 'hikers', 'budget': 500
+    })
+    assert response.status_code == 200
+
+    lines = client.get('/metrics').get_data(as_text=True).splitlines()
+    assert '# TYPE dacv_stage_duration_seconds histogram' in lines
+    for prefix in (
+        'dacv_stage_duration_seconds_bucket{stage="get_competitor_analysis",le="+Inf"} ',
+        'dacv_stage_duration_seconds_count{stage="generate_ai_strategy"} ',
+        'dacv_request_duration_seconds_count{endpoint="generate_strategy"} ',
+        'dacv_cache_misses_total{cache="ai_strategy",',
+        'dacv_job_queue_depth ',
+    ):
+        assert any(line.startswith(prefix) for line in lines), prefix
+    assert '# TYPE dacv_cache_misses_total counter' in lines
+
+
+@pytest.mark.parametrize('query', ['cursor=abc', 'cursor=-1', 'cursor=1.5', 'limit=ten'])
+def test_malformed_history_paging_is_a_400(client, user_id, query):
+    response = client.get(f'/get-user-history?user_id={user_id}&{query}')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == f"Invalid {query.split('=')[0]}"
+
+
+def test_history_route_pages_by_cursor(client, user_id):
+    for product in ('boots', 'tents', 'stoves'):
+        index.strategist._record(user_id, product, 'hikers', 500, {'timestamp': index.datetime.now().isoformat()})
+    first = client.get(f'/get-user-history?user_id={user_id}&limit=2').get_json()
+    assert [item['product'] for item in first['items']] == ['stoves', 'tents']
+    rest = client.get(f"/get-user-history?user_id={user_id}&limit=2&cursor={first['next_cursor']}").get_json()
+    assert [item['product'] for item in rest['items']] == ['boots']
+    assert rest['next_cursor'] is None
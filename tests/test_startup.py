@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+def run(code):
+    return subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ).stdout.split()
+
+
+def test_import_and_landing_page_load_no_heavy_modules():
+    code = (
+        'import sys, index; index.app.test_client().get("/"); '
+        'print(*sorted(name for name in ("numpy", "openai", "stripe", "limits") if name in sys.modules))'
+    )
+    assert run(code) == []
+
+
+def test_warm_up_loads_numpy_and_the_allocation_tables():
+    pytest.importorskip('openai')
+    pytest.importorskip('stripe')
+    pytest.importorskip('limits')
+    code = 'import sys, index; index.warm_up(); print("numpy.random" in sys.modules, index.allocation_engine._tables is not None)'
+    assert run(code) == ['True', 'True']
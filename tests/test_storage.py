@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import index
+
+
+@pytest.fixture
+def redis_backend(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')  # fakeredis runs Lua scripts through lupa
+    redis = pytest.importorskip('redis')
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, 'from_url', classmethod(lambda cls, url: fakeredis.FakeRedis(server=server)))
+    return index.create_backend('redis://localhost:6379/0')
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'redis':
+        return request.getfixturevalue('redis_backend')
+    if request.param == 'sqlite':
+        return index.create_backend(f'sqlite:///{tmp_path / "state.db"}')
+    return index.create_backend('memory://')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(index.time, 'time', lambda: now[0])
+    return now
+
+
+def test_key_value_round_trip(backend):
+    backend.set('k', {'nested': [1, 'two']})
+    assert backend.get('k') == {'nested': [1, 'two']}
+    assert backend.incr('n') == 1
+    assert backend.incr('n', 2) == 3
+    backend.delete('k')
+    assert backend.get('k') is None
+
+
+def test_add_sets_only_absent_keys(backend):
+    assert backend.add('lease', 1, ttl=0.05)
+    assert not backend.add('lease', 2, ttl=0.05)
+    assert backend.get('lease') == 1
+    time.sleep(0.1)
+    assert backend.add('lease', 3)
+    assert not backend.add('lease', 4, ttl=60)
+    assert backend.get('lease') == 3
+
+
+def test_take_tokens_until_empty_then_refill(backend, clock):
+    bucket = [('bucket:rate:u1', 2, 1.0, 1)]
+    assert backend.take_tokens(bucket) == (None, 0)
+    assert backend.take_tokens(bucket) == (None, 0)
+    failed, retry_after = backend.take_tokens(bucket)
+    assert failed == 0
+    assert retry_after == pytest.approx(1.0)
+    clock[0] += 1
+    assert backend.take_tokens(bucket) == (None, 0)
+
+
+def test_take_tokens_charges_all_buckets_or_none(backend, clock):
+    rate = ('bucket:rate:u1', 5, 5 / 60.0, 1)
+    quota = ('bucket:quota:starter:u1', 1, 0.0, 1)
+    assert backend.take_tokens([rate, quota]) == (None, 0)
+    assert backend.take_tokens([rate, quota]) == (1, None)  # Quota never refills, so no retry hint
+    # The rejected call must not have charged the rate bucket: 4 of 5 tokens are left
+    for _ in range(4):
+        assert backend.take_tokens([rate])[0] is None
+    assert backend.take_tokens([rate])[0] == 0
+
+
+def test_shared_cache_round_trip(redis_backend):
+    cache = index.SharedCache(redis_backend, ttls={'seo': 60}, stale_ttl=30, prefix='cache:')
+    cache.set('seo', 'key1', {'search_volume': 5000, 'related_keywords': ['a', 'b']})
+    assert cache.lookup('seo', 'key1') == ({'search_volume': 5000, 'related_keywords': ['a', 'b']}, True)
+    assert 0 < cache.expires_in('key1') <= 60
+    assert redis_backend.client.pttl('cache:key1') > 60_000  # Kept past expiry for stale reads
+
+    cache.set('seo', 'key2', {'search_volume': 1}, ttl=0)
+    assert cache.lookup('seo', 'key2') == ({'search_volume': 1}, False)
+    assert cache.lookup('seo', 'missing') == (None, False)
+    cache.delete('key1')
+    assert cache.get('seo', 'key1') is None
+    assert cache.stats()['namespaces']['seo'] == {'hits': 1, 'stale_hits': 1, 'misses': 2, 'evictions': 0, 'expirations': 0}
@@ -0,0 +1,175 @@
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+import index
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def processor(request, tmp_path, monkeypatch):
+    store = index.SQLiteWebhookEventStore(str(tmp_path / 'events.db')) if request.param == 'sqlite' else index.WebhookEventStore()
+    processor = index.WebhookProcessor(store)
+    monkeypatch.setattr(processor, 'start', lambda: None)  # Batches are processed by the test, not the worker thread
+    return processor
+
+
+@pytest.fixture
+def customer():
+    """A user with a Stripe customer id, as left by the start of checkout"""
+    user_id, customer_id = f'test_{uuid.uuid4().hex[:12]}', f'cus_{uuid.uuid4().hex[:12]}'
+    index.user_manager.set_customer(user_id, customer_id)
+    return SimpleNamespace(user_id=user_id, id=customer_id)
+
+
+def event(event_type, created, customer_id, subscription_id, price_id='price_1'):
+    if event_type == 'customer.subscription.deleted':
+        obj = {'id': subscription_id, 'customer': customer_id}
+    else:
+        obj = {'customer': customer_id, 'subscription': subscription_id, 'lines': {'data': [{'price': {'id': price_id}}]}}
+    return {'id': f'evt_{uuid.uuid4().hex[:12]}', 'type': event_type, 'created': created, 'data': {'object': obj}}
+
+
+def paid(customer):
+    user = index.user_manager.check_user(customer.user_id)
+    return user['paid'], user['plan'], user['subscription_id']
+
+
+def test_payment_activates_the_plan_and_duplicates_are_dropped(processor, customer):
+    payment = event('invoice.payment_succeeded', 100, customer.id, 'sub_1', 'price_2')
+    assert processor.enqueue(payment)
+    assert not processor.enqueue(payment)
+    assert processor.process_batch() == 1
+    assert processor.process_batch() == 0
+    assert paid(customer) == (True, 'professional', 'sub_1')
+
+
+def test_out_of_order_events_apply_in_created_order(processor, customer):
+    processor.enqueue(event('invoice.payment_succeeded', 200, customer.id, 'sub_1'))
+    processor.enqueue(event('customer.subscription.deleted', 100, customer.id, 'sub_1'))
+    processor.process_batch()
+    assert paid(customer) == (True, 'starter', 'sub_1')
+
+
+def test_event_older_than_one_already_applied_is_superseded(processor, customer):
+    processor.enqueue(event('invoice.payment_succeeded', 200, customer.id, 'sub_1'))
+    processor.process_batch()
+    processor.enqueue(event('customer.subscription.deleted', 100, customer.id, 'sub_1'))
+    processor.process_batch()
+    assert paid(customer) == (True, 'starter', 'sub_1')
+
+
+def test_revoke_only_cancels_the_current_subscription(processor, customer):
+    processor.enqueue(event('invoice.payment_succeeded', 100, customer.id, 'sub_2'))
+    processor.enqueue(event('customer.subscription.deleted', 200, customer.id, 'sub_1'))
+    processor.process_batch()
+    assert paid(customer) == (True, 'starter', 'sub_2')
+    processor.enqueue(event('customer.subscription.deleted', 300, customer.id, 'sub_2'))
+    processor.process_batch()
+    assert paid(customer) == (False, None, 'sub_2')
+
+
+def test_unhandled_events_are_ignored(processor, customer):
+    assert not processor.enqueue(event('customer.created', 100, customer.id, None))
+    assert not processor.enqueue(event('invoice.payment_succeeded', 100, None, 'sub_1'))
+    assert processor.process_batch() == 0
+
+
+def test_route_queues_the_verified_event(monkeypatch, customer):
+    pytest.importorskip('stripe')
+    monkeypatch.setitem(index.app.config, 'STRIPE_WEBHOOK_SECRET', 'whsec_test')
+    queued = []
+    monkeypatch.setattr(index.webhook_processor, 'enqueue', queued.append)
+    payload = json.dumps(event('invoice.payment_succeeded', 100, customer.id, 'sub_1'))
+    timestamp = int(time.time())
+    signature = hmac.new(b'whsec_test', f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    client = index.app.test_client()
+
+    response = client.post('/stripe-webhook', data=payload, headers={'Stripe-Signature': f't={timestamp},v1={signature}'})
+    assert response.status_code == 200
+    assert queued == [json.loads(payload)]
+    assert type(queued[0]['data']['object']) is dict  # Plain data the stores can serialise
+    response = client.post('/stripe-webhook', data=payload, headers={'Stripe-Signature': f't={timestamp},v1={"0" * 64}'})
+    assert response.status_code == 400
+    assert len(queued) == 1
+
+
+class FakeStripe:
+    """Stripe client stub recording calls; subscription creates fail while `down` is set"""
+    def __init__(self):
+        self.calls = []
+        self.down = False
+        self.status = 'incomplete'
+        self.customers = SimpleNamespace(create=self.create_customer)
+        self.subscriptions = SimpleNamespace(create=self.create_subscription, retrieve=self.retrieve)
+
+    def create_customer(self, params, options):
+        self.calls.append(('customer', options['idempotency_key']))
+        return SimpleNamespace(id='cus_' + options['idempotency_key'][:8])
+
+    def create_subscription(self, params, options):
+        self.calls.append(('subscription', options['idempotency_key']))
+        if self.down:
+            raise ConnectionError('Stripe unreachable')
+        payment_intent = SimpleNamespace(client_secret='pi_secret')
+        return SimpleNamespace(id='sub_' + options['idempotency_key'][:8], latest_invoice=SimpleNamespace(payment_intent=payment_intent))
+
+    def retrieve(self, subscription_id):
+        self.calls.append(('retrieve', subscription_id))
+        return SimpleNamespace(id=subscription_id, status=self.status)
+
+
+@pytest.fixture
+def stripe(monkeypatch):
+    fake = FakeStripe()
+    monkeypatch.setattr(index, 'stripe_client', lambda call: fake)
+    return fake
+
+
+def test_checkout_resumes_after_a_failed_step(stripe):
+    flow = index.SubscriptionFlow(index.create_backend('memory://'))
+    user_id = f'test_{uuid.uuid4().hex[:12]}'
+    stripe.down = True
+    with pytest.raises(ConnectionError):
+        flow.advance(user_id, 'price_1', 'a@example.com')
+    assert flow.get(user_id, 'price_1')['state'] == 'customer'
+
+    stripe.down = False
+    state = flow.advance(user_id, 'price_1', 'a@example.com')
+    assert state['state'] == 'awaiting_payment' and state['client_secret'] == 'pi_secret'
+    assert [call for call, _ in stripe.calls] == ['customer', 'subscription', 'subscription']
+    assert stripe.calls[1] == stripe.calls[2]  # The retry reuses the idempotency key
+
+    assert flow.advance(user_id, 'price_1', 'a@example.com')['state'] == 'awaiting_payment'
+    stripe.status = 'active'
+    assert flow.advance(user_id, 'price_1', 'a@example.com')['state'] == 'active'
+    assert index.user_manager.check_user(user_id)['plan'] == 'starter'
+    assert [call for call, _ in stripe.calls].count('customer') == 1
+
+
+def test_expired_checkout_starts_a_new_subscription(stripe):
+    flow = index.SubscriptionFlow(index.create_backend('memory://'))
+    user_id = f'test_{uuid.uuid4().hex[:12]}'
+    first = flow.advance(user_id, 'price_1', None)['subscription_id']
+    stripe.status = 'incomplete_expired'
+    assert flow.advance(user_id, 'price_1', None)['state'] == 'customer'
+    stripe.status = 'incomplete'
+    second = flow.advance(user_id, 'price_1', None)['subscription_id']
+    assert second != first
+    assert not index.user_manager.check_user(user_id)['paid']
+
+
+def test_webhook_activation_completes_a_waiting_checkout(stripe, processor):
+    flow = index.SubscriptionFlow(index.create_backend('memory://'))
+    user_id = f'test_{uuid.uuid4().hex[:12]}'
+    state = flow.advance(user_id, 'price_2', None)
+    processor.enqueue(event('invoice.payment_succeeded', 100, state['customer_id'], state['subscription_id'], 'price_2'))
+    processor.process_batch()
+    retrieves = len(stripe.calls)
+    assert flow.advance(user_id, 'price_2', None)['state'] == 'active'
+    assert len(stripe.calls) == retrieves  # Applied by the worker, so no Stripe round trip
+    assert index.user_manager.check_user(user_id)['plan'] == 'professional'